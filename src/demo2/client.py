@@ -105,6 +105,13 @@ PRESS ANY KEY WHEN READY :)"""
 
         super().updateInterface()
 
+    def readyReply(self, reply):
+        """Process the server's reply to readyRequest (see self['socket'].sendRequest())."""
+        if reply is None:
+            log("Server did not reply to readyRequest.", "WARNING")
+        else:
+            log("Player Ready.")
+
     def processEvent(self, event):
         """Extend processEvent()
 
@@ -115,10 +122,11 @@ PRESS ANY KEY WHEN READY :)"""
         if self['ready'] == False:
             if event.type == QUIT:
                 quit()
+            elif event.type == VIDEORESIZE:
+                super().processEvent(event)
             elif event.type == pygame.TEXTINPUT:
-                self['socket'].sendRecvMessage({'type': 'readyRequest'})
+                self['socket'].sendRequest({'type': 'readyRequest'}, callback=self.readyReply)
                 self['ready'] = True
-                log("Player Ready.")
         else:
             if event.type == pygame.TEXTINPUT:
                 if event.text == 'r':
@@ -29,3 +29,7 @@ class Messages(engine.messages.Messages):
             'fireDestX': 'int',
             'fireDestY': 'int'
             }
+        self['spriteFields'].update({
+            'prop-team': 'str',
+            'prop-holdable-type': 'str'
+            })
@@ -46,6 +46,10 @@ class Server(engine.server.Server):
         self['ENDURREGENSEC'] = self['MAXENDUR'] * 5.0  # seconds to regen full run from 0
         self['RUNSPEED'] = 2.0  # multiplier of running vs. normal speed.
 
+        # only the newest run and fire msgs from a player each step matter.
+        self['INPUT_COALESCE_TYPES'].update(('run', 'fire'))
+        self.applyInputLimits()
+
         self.setCollsion()
         self.randomizeWeapons()
         self.createDoors()
@@ -128,6 +132,7 @@ class Server(engine.server.Server):
                     doorTrigger['y'] -= 10
                     doorTrigger['width'] += 20
                     doorTrigger['height'] += 20
+                    map.updateSpatialIndexes(doorTrigger)
 
                     # add doorTile icon graphic
                     doorTile = doorTiles[random.randrange(0, len(doorTiles))]
@@ -310,20 +315,6 @@ class Server(engine.server.Server):
     # GAME LOGIC
     ########################################################
 
-    def stepServer(self):
-        """OVERRIDE stepServer()
-
-        Take the game one "step" forward in time. Unlike engine.server.Server.stepServer()
-        this function steps every map on every step, not just maps with players. This allows
-        monsters to chase players through map doors.
-        """
-        self.stepServerStart()
-
-        for mapName in self['maps']:
-            self['maps'][mapName].stepMap()
-
-        self.stepServerEnd()
-
     def updateWaiting(self):
         """Detect if all players are ready and switch mode to gameOn. Update players as each player becomes ready."""
 
@@ -1,6 +1,7 @@
 """Game Client"""
 
 import signal
+import asyncio
 import engine.time as time
 
 import pygame
@@ -11,6 +12,11 @@ from engine.log import log
 
 import engine.network
 import engine.loaders
+import engine.stepdelta
+import engine.codec
+import engine.spritecodec
+import engine.netemu
+import engine.geometry as geo
 
 
 def quit(signal=None, frame=None):
@@ -133,19 +139,23 @@ class Client(dict):
 
         if self['connectName']:
             self['clientIP'] = '0.0.0.0'  # ignore clinetIP if we are going to request server address from connector.
+        self['zdict'] = engine.loaders.loadZdict(self['game'])
         try:
             self['socket'] = engine.network.Socket(
                 messages=engine.loaders.loadModule("messages", game=self['game']).Messages(),
                 msgProcessor=self,
                 sourceIP=self['clientIP'],
                 sourcePort=self['clientPort'],
-                sourcePortSearch=True
+                sourcePortSearch=True,
+                codec=engine.codec.Codec(zdict=self['zdict']),
+                netEmulator=engine.netemu.fromArgs(args)
                 )
         except Exception as e:
             log(str(e), "FAILURE")
             quit()
 
         self['clientPort'] = self['socket'].sourcePort  # may have changed to a different available port.
+        self['spriteCodec'] = engine.spritecodec.SpriteCodec(self['socket'].messages['spriteFields'])
         joinReply = False
         if self['connectName']:
             # talk to connector for connetinfo msg
@@ -187,6 +197,12 @@ class Client(dict):
 
         self['playerNumber'] = joinReply['playerNumber']
 
+        if 'codec' in joinReply:
+            # use the same codec as the server for msgs sent to the server.
+            self['socket'].setCodec(
+                engine.codec.Codec(joinReply['codec'], zdict=self['zdict']),
+                self['serverIP'], self['serverPort'])
+
         # set the time so client engine.time.perf_counter() will return secs in sync (very close) to server.
         time.set(joinReply['serverSec'])
 
@@ -194,10 +210,18 @@ class Client(dict):
         if(self['testMode']):
             log("Server running in TEST MODE.")
 
+        # server sends step msgs at this rate when it is lower than the server's fps. See predictSprites().
+        self['sendFps'] = joinReply.get('sendFps', False)
+        if self['sendFps']:
+            log(f"Server sending {self['sendFps']} step msgs per second. Predicting moves in between.")
+        self['stepReceivedAt'] = 0  # time the current step msg was received.
+
         log("Join server was successful.")
 
         self['serverIpport'] = engine.network.formatIpPort(self['serverIP'], self['serverPort'])
         self['step'] = False  # Currently displayed step. Empty until we get first step msg from server. = {}
+        self['stepSnapshots'] = {}  # {stepNum: snapshot, ...} only used if server is sending step deltas.
+        self['STEP_SNAPSHOTS'] = 64  # max number of step snapshots to keep.
         self['mapOffset'] = (0, 0)
 
         # Note, we must init pygame before we load tileset data.
@@ -230,12 +254,18 @@ class Client(dict):
         try:
             log(f"Sending joinRequest to server at {self['serverIP']}:{self['serverPort']}")
             self['socket'].setDestinationAddress(self['serverIP'], self['serverPort'])
-            joinReply = self['socket'].sendRecvMessage({
+            joinRequest = {
                 'type': 'joinRequest',
                 'game': self['game'],
-                'playerDisplayName': self['playerDisplayName']
-                },
-                retries=5, delay=1, delayMultiplier=1)
+                'playerDisplayName': self['playerDisplayName'],
+                'codecs': ['zlib', 'none'],
+                'windowWidth': self['windowWidth'],
+                'windowHeight': self['windowHeight']
+                }
+            if self['zdict']:
+                joinRequest['codecs'].insert(0, 'zdict')
+                joinRequest['zdictChecksum'] = engine.codec.zdictChecksum(self['zdict'])
+            joinReply = self['socket'].sendRecvMessage(joinRequest, retries=5, delay=1, delayMultiplier=1)
             if joinReply['type'] != "joinReply":
                 log(f"Expected joinReply message but got {joinReply['type']}, quiting!", "FAILURE")
                 quit()
@@ -252,44 +282,59 @@ class Client(dict):
     ########################################################
 
     def run(self):
-        '''Main client loop.
+        """Main client loop.
 
         This loop is controlled to run once every 1/fps seconds.
         Every loop it received msgs from the server, updates the screen, and
         processes user input events. It also prints server busy messages on
         a regular interval.
-        '''
+        """
 
-        startAt = time.perf_counter()
-        nextStatusAt = startAt + self['busySec']
-        sleepTime = 0
-        nextStepAt = startAt + (1.0 / self['fps'])
+        pacer = time.StepPacer(self['fps'], self['busySec'], "Client")
         while True:
-            # process messages from server (recvReplyMsgs calls msg<msgType> for each msg received)
-            self['socket'].recvReplyMsgs()
+            self.runStep()
+
+            # wait until next step should start.
+            waitUntil = pacer.getWaitUntil()
+            if waitUntil:
+                time.sleep(until=waitUntil)
+            pacer.scheduleNextStep()
+
+    async def runAsync(self):
+        """Main client loop for asyncio.
 
-            # update the screen so player can see data that server sent
-            self.updateScreen()
+        Same as run() but msgs are received by the asyncio event loop and
+        the time between steps is given back to the event loop rather than
+        spent busy waiting.
+        """
+        await self['socket'].startAsync()
 
-            # process any user input and send it to the server as required.
-            self.processEvents()
+        pacer = time.StepPacer(self['fps'], self['busySec'], "Client")
+        while True:
+            self.runStep()
 
             # wait until next step should start.
-            ptime = time.perf_counter()
-            if ptime < nextStepAt:
-                sleepTime += nextStepAt - ptime
-
-                if ptime > nextStatusAt:
-                    # log the amount of time we are busy vs. waiting for the next step.
-                    log(f"Status: busy == {int(100-(sleepTime/(ptime-startAt)*100))}%")
-                    startAt = ptime
-                    nextStatusAt = startAt + self['busySec']
-                    sleepTime = 0
-                time.sleep(until=nextStepAt)
+            waitUntil = pacer.getWaitUntil()
+            if waitUntil:
+                await asyncio.sleep(waitUntil - time.perf_counter())
             else:
-                log("Client running slower than " + str(self['fps']) + " fps.", "VERBOSE")
+                await asyncio.sleep(0)  # let the event loop receive msgs.
+            pacer.scheduleNextStep()
 
-            nextStepAt = time.perf_counter() + (1.0 / self['fps'])
+    def runStep(self):
+        """Run one pass of the main loop.
+
+        Receives msgs from the server, updates the screen, and processes
+        user input events.
+        """
+        # process messages from server (recvReplyMsgs calls msg<msgType> for each msg received)
+        self['socket'].recvReplyMsgs()
+
+        # update the screen so player can see data that server sent
+        self.updateScreen()
+
+        # process any user input and send it to the server as required.
+        self.processEvents()
 
     ########################################################
     # NETWORK MESSAGE PROCESSING
@@ -298,7 +343,10 @@ class Client(dict):
     def msgStep(self, ip, port, ipport, msg):
         """Process msg of type step.
 
-        Store step msg and invalidate the screen timer.
+        Store step msg and invalidate the screen timer. If the server
+        sent the sprites in compact form then decode them. If the server
+        sent the step as a delta then rebuild the sprites from the
+        snapshot the delta is based on and acknowledge the new snapshot.
 
         This method is designed to be called from self['socket'].recvReplyMsgs().
         self['socket'].recvReplyMsgs() will call this method when it receives a
@@ -317,7 +365,38 @@ class Client(dict):
         if ipport != self['serverIpport']:
             log(f"Msg received but not from server! Msg from ({ipport}).", "WARNING")
             return
+
+        if 'spriteStrings' in msg:
+            # sprites are in compact form.
+            msg['sprites'] = self['spriteCodec'].decodeSprites(msg['sprites'], msg['spriteStrings'], 'stepNum' in msg)
+            del msg['spriteStrings']
+
+        if 'stepNum' in msg:
+            if self['step'] and 'stepNum' in self['step'] and msg['stepNum'] < self['step']['stepNum']:
+                return  # step arrived out of order so ignore it.
+
+            base = False
+            if 'baseStepNum' in msg:
+                if msg['baseStepNum'] not in self['stepSnapshots']:
+                    log(f"Step {msg['stepNum']} ignored. Base step {msg['baseStepNum']} not found.", "VERBOSE")
+                    return
+                base = self['stepSnapshots'][msg['baseStepNum']]
+
+            snapshot = engine.stepdelta.decodeSprites(msg['stepNum'], msg['sprites'], base)
+            self['stepSnapshots'][snapshot['stepNum']] = snapshot
+            msg['sprites'] = engine.stepdelta.getSprites(snapshot)
+
+            # server will never send deltas based on a snapshot older than base so forget them.
+            if base:
+                for stepNum in [n for n in self['stepSnapshots'] if n < base['stepNum']]:
+                    del self['stepSnapshots'][stepNum]
+            while len(self['stepSnapshots']) > self['STEP_SNAPSHOTS']:
+                del self['stepSnapshots'][min(self['stepSnapshots'])]
+
+            self['socket'].sendMessage({'type': 'stepAck', 'stepNum': snapshot['stepNum']})
+
         self['step'] = msg  # store the new step
+        self['stepReceivedAt'] = time.perf_counter()
         self['screenValidUntil'] = 0  # flag that we need to redraw the screen.
 
     def msgQuitting(self, ip, port, ipport, msg):
@@ -370,11 +449,18 @@ class Client(dict):
             # update layer visibility from the server step message.
             map.setLayerVisablityMask(self['step']['layerVisabilityMask'])
 
+            sprites = self['step']['sprites']
+            moving = False
+            if self['sendFps']:
+                sprites, moving = self.predictSprites(sprites)
+
             # compute the best map offset given the players position
-            self['mapOffset'] = self.setMapOffset(map)
+            self['mapOffset'] = self.setMapOffset(map, sprites)
 
             # draw the map.
-            self['screenValidUntil'] = map.blitMap(self['screen'], self['mapOffset'], self['step']['sprites'])
+            self['screenValidUntil'] = map.blitMap(self['screen'], self['mapOffset'], sprites)
+            if moving:
+                self['screenValidUntil'] = 0  # keep drawing sprites as they move between step msgs.
 
             # add on any items not specific to the map.
             self.updateInterface()
@@ -382,7 +468,48 @@ class Client(dict):
             # tell pygame to actually display changes to user.
             pygame.display.update()
 
-    def setMapOffset(self, map):
+    def predictSprites(self, sprites):
+        """Return sprites with moving sprites moved to where they probably are now.
+
+        When the server sends step msgs less often than it steps, sprites
+        would only move when a step msg arrives. To fill the gap, sprites
+        with a linear move (see engine.servermap.ServerMap.setMoveLinear())
+        are moved towards their destination at their move speed for the
+        time since the step msg arrived, up to two step msgs worth of time.
+        The next step msg replaces any wrong guesses.
+
+        Args:
+            sprites (list): Sprites from the current step msg. These are not changed.
+
+        Returns:
+            sprites (list): Sprites to draw.
+            moving (bool): True if any sprite was moved.
+        """
+        dt = min(time.perf_counter() - self['stepReceivedAt'], 2.0 / self['sendFps'])
+        predicted = []
+        moving = False
+        for sprite in sprites:
+            if 'move' in sprite and sprite['move'].get('type') == 'Linear' and 'anchorX' in sprite:
+                move = sprite['move']
+                dis = min(move['s'] * dt, geo.distance(sprite['anchorX'], sprite['anchorY'], move['x'], move['y']))
+                if dis > 0:
+                    x, y = geo.project(
+                        sprite['anchorX'],
+                        sprite['anchorY'],
+                        geo.angle(sprite['anchorX'], sprite['anchorY'], move['x'], move['y']),
+                        dis)
+                    dx = x - sprite['anchorX']
+                    dy = y - sprite['anchorY']
+                    sprite = sprite.copy()
+                    sprite['anchorX'] = x
+                    sprite['anchorY'] = y
+                    sprite['x'] += dx
+                    sprite['y'] += dy
+                    moving = True
+            predicted.append(sprite)
+        return predicted, moving
+
+    def setMapOffset(self, map, sprites=None):
         """Return an offset for displaying the map.
 
         The offset needs to ensure the map is centered
@@ -394,10 +521,14 @@ class Client(dict):
         Args:
         map : engine.map.Map
             The map the player is on.
+        sprites : list
+            The sprites being drawn. If None then the sprites from the current step msg.
 
         Returns:
             (mapOffsetX, mapOffsetY) (int, int): a list of two ints.
         """
+        if sprites is None:
+            sprites = self['step']['sprites']
         mapOffsetX = 0
         mapOffsetY = 0
 
@@ -408,7 +539,7 @@ class Client(dict):
 
         if map['pixelWidth'] > self['screen'].get_width() or map['pixelHeight'] > self['screen'].get_height():
             # find the player.
-            for sprite in self['step']['sprites']:
+            for sprite in sprites:
                 if "playerNumber" in sprite and self['playerNumber'] == sprite['playerNumber']:
                     break
 
@@ -538,6 +669,10 @@ class Client(dict):
             quit()
         elif event.type == VIDEORESIZE:
             self['screenValidUntil'] = 0
+            # let the server know what the player can now see.
+            self['windowWidth'] = event.w
+            self['windowHeight'] = event.h
+            self['socket'].sendMessage({'type': 'windowSize', 'windowWidth': event.w, 'windowHeight': event.h})
         elif event.type == pygame.TEXTINPUT:
             if event.text == ' ':
                 self['socket'].sendMessage({'type': 'playerAction'})
@@ -0,0 +1,161 @@
+"""Encode/Decode Network Bytes
+
+Every datagram sent by engine.network.Socket starts with a flag byte that
+tells the receiver how the rest of the datagram was encoded:
+
+    FLAG_COMPOSITE: Shared part and overlay (see Socket.serializeComposite()).
+    FLAG_RAW: msgpack bytes, not compressed.
+    FLAG_ZLIB: zlib compressed msgpack bytes.
+    FLAG_ZDICT: zlib compressed msgpack bytes using the game's preset
+        dictionary (<game>/step.zdict).
+    FLAG_FRAGMENT: One piece of a msg that was too big for one datagram
+        (see Socket.sendBytes()).
+
+The receiver can always decode every flag (as long as it has the same
+zdict) so the codec a sender uses is only a choice of how much CPU to spend
+to make datagrams smaller. Client and server agree on a codec in the
+joinRequest/joinReply msgs.
+"""
+
+import zlib
+import collections
+import msgpack
+
+FLAG_COMPOSITE = 0
+FLAG_RAW = 1
+FLAG_ZLIB = 2
+FLAG_ZDICT = 3
+FLAG_FRAGMENT = 4
+
+# Codec names in order of preference.
+CODECS = ('zdict', 'zlib', 'none')
+
+
+class Codec(dict):
+    """Codec Class
+
+    Encodes msgpack bytes for sending. Which codec is used is stored in
+    the flag byte so the receiver does not need to know the Codec settings.
+    """
+
+    def __init__(self, name='zlib', level=6, threshold=128, zdict=None):
+        """Create a codec.
+
+        Args:
+            name (str): One of CODECS.
+            level (int): zlib compression level (1-9).
+            threshold (int): msgpack bytes shorter than this are never
+                compressed since compression would make them bigger.
+            zdict (bytes): Preset dictionary. Required if name is 'zdict'.
+        """
+        if name not in CODECS:
+            raise ValueError(f"Codec name {name} is not one of {CODECS}.")
+        if name == 'zdict' and not zdict:
+            raise ValueError("Codec 'zdict' requires a zdict.")
+
+        self['name'] = name
+        self['level'] = level
+        self['threshold'] = threshold
+        self['zdict'] = zdict
+
+    def encode(self, b):
+        """Return b (msgpack bytes) encoded and prefixed by a flag byte."""
+        if self['name'] == 'none' or len(b) < self['threshold']:
+            return bytes((FLAG_RAW,)) + b
+        if self['name'] == 'zdict':
+            c = zlib.compressobj(self['level'], zdict=self['zdict'])
+            return bytes((FLAG_ZDICT,)) + c.compress(b) + c.flush()
+        return bytes((FLAG_ZLIB,)) + zlib.compress(b, self['level'])
+
+
+def decode(b, zdict=None):
+    """Return msgpack bytes from b which was encoded by Codec.encode().
+
+    Args:
+        b (bytes-like): Encoded bytes, starting with the flag byte.
+        zdict (bytes): The preset dictionary to use if b was encoded with it.
+
+    Raises:
+        ValueError: if flag byte is not known or b needs a zdict that is not available.
+    """
+    flag = b[0]
+    if flag == FLAG_RAW:
+        return b[1:]
+    if flag == FLAG_ZLIB:
+        return zlib.decompress(b[1:])
+    if flag == FLAG_ZDICT:
+        if not zdict:
+            raise ValueError("Received msg encoded with zdict but no zdict is loaded.")
+        d = zlib.decompressobj(zdict=zdict)
+        return d.decompress(b[1:]) + d.flush()
+    raise ValueError(f"Received msg with unknown codec flag {flag}.")
+
+
+def zdictChecksum(zdict):
+    """Return a checksum (int) used to check that both ends have the same zdict."""
+    return zlib.crc32(zdict)
+
+
+def chooseCodec(offered, zdictChecksumOffered, codecs):
+    """Return the name of the best codec both ends support.
+
+    Args:
+        offered (list): Codec names offered by the other end.
+        zdictChecksumOffered (int): zdictChecksum() of the other end's zdict or None.
+        codecs (dict): {name: Codec, ...} that this end is willing to use.
+
+    Returns:
+        str: One of CODECS or None if nothing offered is acceptable.
+    """
+    for name in CODECS:
+        if name not in offered or name not in codecs:
+            continue
+        if name == 'zdict' and zdictChecksumOffered != zdictChecksum(codecs['zdict']['zdict']):
+            continue
+        return name
+    return None
+
+
+def trainZdict(samples, size=32768):
+    """Return a preset dictionary built from samples.
+
+    The dictionary is made from the msgpack encoding of the dict keys and
+    key/value pairs that save the most bytes (length * occurrences) across
+    all samples. The most valuable strings are placed at the end of the
+    dictionary since zlib can refer to them with the shortest distances.
+
+    Args:
+        samples (list): Python objects (usually step msgs) like those that will be sent.
+        size (int): Maximum size of the dictionary in bytes. zlib uses at most 32768.
+
+    Returns:
+        bytes
+    """
+    counts = collections.Counter()
+
+    def count(o):
+        if isinstance(o, dict):
+            for k, v in o.items():
+                counts[msgpack.packb(k, use_bin_type=True)] += 1
+                if not isinstance(v, (dict, list)):
+                    counts[msgpack.packb(k, use_bin_type=True) + msgpack.packb(v, use_bin_type=True)] += 1
+                count(v)
+        elif isinstance(o, list):
+            for v in o:
+                count(v)
+
+    for sample in samples:
+        count(sample)
+
+    chosen = []
+    total = 0
+    for s, n in sorted(counts.items(), key=lambda x: (len(x[0]) * x[1], x[0]), reverse=True):
+        if len(s) < 3:
+            continue  # too short for zlib to use.
+        if total + len(s) > size:
+            break
+        chosen.append(s)
+        total += len(s)
+
+    chosen.reverse()  # most valuable last.
+    return b''.join(chosen)
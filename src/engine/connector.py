@@ -1,6 +1,7 @@
 """Connector Server"""
 
 import signal
+import asyncio
 import engine.time as time
 import random
 import os
@@ -92,15 +93,29 @@ class Connector(dict):
     ########################################################
 
     def run(self):
-        '''Main connector loop.
+        """Main connector loop.
 
-        Runs once every second.
-        '''
+        Processes msgs as soon as they arrive and checks for timeouts at
+        least once every second.
+        """
+        while True:
+            # process messages from servers and clients (recvReplyMsgs calls msg<msgType> for each msg received)
+            self['socket'].recvReplyMsgs()
+            self.checkTimeouts()
+            self['socket'].waitForData(1)
+
+    async def runAsync(self):
+        """Main connector loop for asyncio.
+
+        Processes msgs as soon as the asyncio event loop receives them and
+        checks for timeouts at least once every second.
+        """
+        await self['socket'].startAsync()
         while True:
+            await self['socket'].waitForMsgs(timeout=1)
             # process messages from servers and clients (recvReplyMsgs calls msg<msgType> for each msg received)
             self['socket'].recvReplyMsgs()
             self.checkTimeouts()
-            time.sleep(sec=1)
 
     def checkTimeouts(self):
         """Remove any serverName from self['serverlist'] that have timed out.
@@ -77,6 +77,25 @@ def loadTilesets(game, loadImages):
     return tilesets
 
 
+def loadZdict(game):
+    '''Load game's preset compression dictionary.
+
+    Args:
+        game (str): The game name (game folder name). The dictionary is
+            loaded from <game>/step.zdict
+
+    Returns:
+        bytes or None: The dictionary or None if the game does not have one.
+    '''
+    zdictFile = f"src/{game}/step.zdict"
+    if not os.path.isfile(zdictFile):
+        return None
+    with open(zdictFile, "rb") as f:
+        zdict = f.read()
+    log(f"Loaded {len(zdict)} byte compression dictionary from {zdictFile}", "VERBOSE")
+    return zdict
+
+
 def loadMaps(tilesets, game, maptype):
     '''Load game maps.
 
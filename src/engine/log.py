@@ -3,8 +3,10 @@
 Prints messages to command line window in a standard format.
 """
 
-import inspect
-import os
+import sys
+import atexit
+import queue
+import threading
 from datetime import datetime
 import pprint
 
@@ -15,6 +17,9 @@ LOGVERBOSE = False
 # global printing to logfile on/off
 LOGFILE = False
 
+# lines waiting to be written to LOGFILE by the log writer thread.
+LOGQUEUE = None
+
 
 def setLogLevel(debug=False, verbose=False):
     """Set the log levels that will be printed.
@@ -32,16 +37,70 @@ def setLogLevel(debug=False, verbose=False):
     log("DEBUG logging = " + str(LOGDEBUG) + ". VERBOSE logging = " + str(LOGVERBOSE), "INFO")
 
 
+def isLogged(level):
+    """Return True if msgs of level will be printed.
+
+    Use this to skip work that is only needed to build a log msg, e.g.
+        if isLogged("DEBUG"):
+            log(expensiveSummary(), "DEBUG")
+    """
+    if level == "DEBUG":
+        return LOGDEBUG
+    if level == "VERBOSE":
+        return LOGVERBOSE
+    return True
+
+
 def setLogFile(filename=False):
-    """Turn writing to file on or off. Off by default."""
+    """Turn writing to file on or off. Off by default.
+
+    Lines are written to the file by a background thread so logging does
+    not wait on the disk.
+    """
+
+    global LOGFILE, LOGQUEUE
 
-    global LOGFILE
+    if LOGQUEUE is None and filename:
+        LOGQUEUE = queue.Queue()
+        threading.Thread(target=logWriter, args=(LOGQUEUE,), name="logWriter", daemon=True).start()
+        atexit.register(LOGQUEUE.join)  # make sure all lines are written before program exits.
 
     LOGFILE = filename
     log("LOGFILE set to " + str(LOGFILE), "INFO")
 
 
-def log(msg, level="INFO", depth=3):
+def logWriter(q):
+    """Write lines from q to their log files. Runs forever in the log writer thread.
+
+    All lines already waiting in q are written with one open() of the file.
+    """
+    while True:
+        batch = [q.get()]
+        while True:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            filename = None
+            f = None
+            for lineFile, line in batch:
+                if lineFile != filename:
+                    if f:
+                        f.close()
+                    filename = lineFile
+                    f = open(filename, "a+")
+                f.write(line)
+            if f:
+                f.close()
+        except Exception as e:
+            print("ERROR Could not write to log file: " + str(e))
+        finally:
+            for i in range(len(batch)):
+                q.task_done()
+
+
+def log(msg, level="INFO", depth=3, args=None):
     """Print msg to standard output.
 
     format: LogLevel Time Function: msg
@@ -55,41 +114,47 @@ def log(msg, level="INFO", depth=3):
         ERROR: Can not continue as planned.
         FAILURE: program will need to quit or initialize.
 
+    Msgs that are expensive to build should be passed so they are only built
+    if they will be printed, either as a format string and args or as a
+    function that returns the msg. For example:
+        log("Sending %s", "DEBUG", args=(msg,))
+        log(lambda: dictToStr(msg), "DEBUG")
+
     Args:
-        msg (str): The log message to print
+        msg (str, dict, or callable): The log message to print. If callable then
+            it is called with no arguments to get the log message.
         level (str): Log level of the msg. DEBUG and VERBOSE will only be printed if
             turned on using setLog Level.
         depth (int): When logging objects, this is the depth of nested objects to print.
+        args (tuple): If provided then msg is a format string and the log message is msg % args.
 
 
     """
 
-    global LOGDEBUG, LOGVERBOSE, LOGFILE
-
-    if level == "DEBUG" and LOGDEBUG == False:
+    if level == "DEBUG" and not LOGDEBUG:
         return
 
-    if level == "VERBOSE" and LOGVERBOSE == False:
+    if level == "VERBOSE" and not LOGVERBOSE:
         return
 
     try:
-        # Get the execution frame of the calling function and use it to determine the calling filename and function name
-        # This will fail if called from a python interactive shell.
-        frame = inspect.stack()[1]
-        module = inspect.getmodule(frame[0])
-        filename = os.path.basename(module.__file__)
-        modulename = module.__name__
-        function = frame[0].f_code.co_name
+        # Get the execution frame of the calling function and use it to determine the calling module and function name
+        frame = sys._getframe(1)
+        modulename = frame.f_globals.get('__name__', '-')
+        function = frame.f_code.co_name
         if function != '<module>':
             function = function + '()'
     except Exception as e:
         modulename = '-'
-        filename = '-'
         function = '-'
 
     time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
     # format msg to be human readable
+    if callable(msg):
+        msg = msg()
+    if args is not None:
+        msg = msg % args
     if(isinstance(msg, dict)):
         msg = dictToStr(msg, depth)
     else:
@@ -100,8 +165,7 @@ def log(msg, level="INFO", depth=3):
     print(output)
 
     if LOGFILE:
-        with open(LOGFILE, "a+") as f:
-            f.write(output + "\n")
+        LOGQUEUE.put((LOGFILE, output + "\n"))
 
 
 def dictToStr(object, depth=3):
@@ -6,6 +6,71 @@ import engine.log
 from engine.log import log
 import engine.geometry as geo
 from engine.geometry import collidesFast
+import engine.spatialindex
+
+# id given to the next object added to any map's object registry (see Map.getObjectId()).
+# Shared by all maps so an id is never used on two maps in the same process.
+nextObjectId = 1
+
+
+class ObjectList(list):
+    """ObjectList Class
+
+    The list of Tiled objects of an object layer. It is a normal python list
+    except it counts the changes made to it in self.changeCount, so a Map can
+    tell when an object list was changed without using addObject() or
+    removeObject() (e.g. objectList[i] = object) and update its object registry.
+    """
+
+    changeCount = 0
+
+    def __setitem__(self, *args):
+        self.changeCount += 1
+        return super().__setitem__(*args)
+
+    def __delitem__(self, *args):
+        self.changeCount += 1
+        return super().__delitem__(*args)
+
+    def __iadd__(self, *args):
+        self.changeCount += 1
+        return super().__iadd__(*args)
+
+    def __imul__(self, *args):
+        self.changeCount += 1
+        return super().__imul__(*args)
+
+    def append(self, *args):
+        self.changeCount += 1
+        return super().append(*args)
+
+    def extend(self, *args):
+        self.changeCount += 1
+        return super().extend(*args)
+
+    def insert(self, *args):
+        self.changeCount += 1
+        return super().insert(*args)
+
+    def pop(self, *args):
+        self.changeCount += 1
+        return super().pop(*args)
+
+    def remove(self, *args):
+        self.changeCount += 1
+        return super().remove(*args)
+
+    def clear(self):
+        self.changeCount += 1
+        return super().clear()
+
+    def sort(self, **kwargs):
+        self.changeCount += 1
+        return super().sort(**kwargs)
+
+    def reverse(self):
+        self.changeCount += 1
+        return super().reverse()
 
 
 class Map(dict):
@@ -46,12 +111,17 @@ class Map(dict):
         self['mapDir'] = mapDir
 
         # Flag to say something on this map has changed
+        self.changeCount = 0
         self.setMapChanged()
 
+        # engine.spatialindex.SpatialIndex of object lists, created when first needed. See SPATIAL INDEX section below.
+        self['spatialIndexes'] = {}  # {listName: SpatialIndex, ...}
+
         # self['follow'] is an array of game objects that follow other game objects.
         # Form: [{'leader': leaderObject, 'followers': [(followerObject, deltaAnchorX, deltaAnchorY),...]}, ...]
         # See FOLLOW section below.
         self['follow'] = []
+        self['followIndex'] = {}  # {id(leaderObject): entry from self['follow'], ...}
 
         # Maps are named based on their mapDirectory
         self['name'] = mapDir.split("/")[-1]
@@ -91,6 +161,8 @@ class Map(dict):
         self['tilewidth'] = mapfiledata['tilewidth']
         self['pixelHeight'] = self['height'] * self['tileheight']
         self['pixelWidth'] = self['width'] * self['tilewidth']
+        self['SPATIAL_CELL_SIZE'] = max(self['tilewidth'], self['tileheight']) * 2  # pixels
+        self['SPATIAL_MIN_OBJECTS'] = 16  # object lists shorter than this are faster to search without an index.
         self['layers'] = mapfiledata['layers']
 
         self['backgroundcolor'] = (32, 32, 32, 255)
@@ -117,6 +189,20 @@ class Map(dict):
                 log(f"Map '{self['name']}' uses a tileset '{tilesetName}', which does not exist!", "FAILURE")
                 exit()
 
+        '''
+        Create lookup table from gid to tileset name and tileset tile number so
+        findTile() does not need to search the tilesets. gids not in any tileset are None.
+        [None, (tilesetName1, 0), (tilesetName1, 1), ..., (tilesetName2, 0), ...]
+        '''
+        self['gidTiles'] = []
+        for tilesetName, firstGid in self['tsFirstGid'].items():
+            lastGid = firstGid + self['tilesets'][tilesetName]['tilecount'] - 1
+            if len(self['gidTiles']) <= lastGid:
+                self['gidTiles'].extend([None] * (lastGid + 1 - len(self['gidTiles'])))
+            for tileGid in range(firstGid, lastGid + 1):
+                if self['gidTiles'][tileGid] is None:  # if tilesets overlap then the first one is used.
+                    self['gidTiles'][tileGid] = (tilesetName, tileGid - firstGid)
+
         # convert layer visibility data into a more compact form that is better for sending over network.
         self['layerVisabilityMask'] = 0
         for layerIndex in range(len(self['layers'])):
@@ -165,15 +251,16 @@ class Map(dict):
                     self.checkObject(object)
                 # sort objects by area from largest to smallest. This will make finding collisions slightly faster.
                 layer['objects'].sort(key=lambda o: o['width']*o['height'], reverse=True)
+                layer['objects'] = ObjectList(layer['objects'])
 
         # set up quick reference to object lists of well known object layers.
         # these can be used directly rather than searching for these layers over and over.
         # it also ensures all these layers exist (via these refernces) in case they were not in the Tiled file.
-        self['triggers'] = []
-        self['sprites'] = []
-        self['reference'] = []
-        self['inBounds'] = []
-        self['outOfBounds'] = []
+        self['triggers'] = ObjectList()
+        self['sprites'] = ObjectList()
+        self['reference'] = ObjectList()
+        self['inBounds'] = ObjectList()
+        self['outOfBounds'] = ObjectList()
         for l in self['layers']:
             if l['type'] == "objectgroup":
                 log(f"Object layer '{l['name']}' contains {len(l['objects'])} objects.","VERBOSE")
@@ -188,6 +275,24 @@ class Map(dict):
                 elif l['name'] == "outOfBounds":
                     self['outOfBounds'] = l['objects']
 
+        # all object lists on this map, the well known ones above and any other object layers.
+        self['objectLists'] = {}  # {listName: objectList, ...}
+        for listName in ('triggers', 'sprites', 'reference', 'inBounds', 'outOfBounds'):
+            self['objectLists'][listName] = self[listName]
+        for layerIndex in range(len(self['layers'])):
+            l = self['layers'][layerIndex]
+            if l['type'] == "objectgroup" and not any(l['objects'] is ol for ol in self['objectLists'].values()):
+                listName = l['name'] if l['name'] not in self['objectLists'] else f"{l['name']}-{layerIndex}"
+                self['objectLists'][listName] = l['objects']
+
+        # Give every object an id. See OBJECT REGISTRY section below.
+        self['objectsById'] = {}  # {objectId: object, ...}
+        self['objectIds'] = {}  # {id(object): objectId, ...}
+        self['objectLayers'] = {}  # {objectId: {listName, ...}, ...} the object lists each object is in.
+        self['objectListChangeCounts'] = {}  # {listName: objectList.changeCount, ...} used to check if the registry is current.
+        self['objectListNames'] = {}  # {id(objectList): listName, ...}
+        self.resetObjectRegistry()
+
     def __str__(self):
         return engine.log.objectToStr(self, depth=2)
 
@@ -227,8 +332,14 @@ class Map(dict):
 
         This is used to determine if the server needs to send an
         update to clients.
+
+        self.changeCount counts the times the map has been flagged as
+        changed. Unlike self.changed it is never reset so code can tell if
+        the map changed since it last looked (see engine.mapworker).
         """
         self.changed = changed
+        if changed:
+            self.changeCount += 1
 
     ########################################################
     # TILE GID (Tile Map Global Identifier)
@@ -244,12 +355,8 @@ class Map(dict):
             tilesetName (str): name of tileset which contians tileGid
             tilesetTileNumber (int): tileNumber relative to tilesetName
         """
-        for tilesetName in self['tsFirstGid']:
-            firstGid = self['tsFirstGid'][tilesetName]
-            lastGid = firstGid + self['tilesets'][tilesetName]['tilecount'] - 1
-            if firstGid <= tileGid and tileGid <= lastGid:
-                tilesetTileNumber = tileGid - firstGid
-                return tilesetName, tilesetTileNumber
+        if 0 <= tileGid < len(self['gidTiles']) and self['gidTiles'][tileGid]:
+            return self['gidTiles'][tileGid]
 
         # By design, this should never happen so we need to quit!
         log(f"tileGid {str(tileGid)} not found in map {self['name']}!", "FAILURE")
@@ -267,9 +374,8 @@ class Map(dict):
         Returns:
             tileGid (int): A map global tile number.
         """
-        for tilesetName in self['tsFirstGid']:
-            if tilesetName == tilesetSearchName:
-                return self['tsFirstGid'][tilesetName] + tilesetTileSearchNumber
+        if tilesetSearchName in self['tsFirstGid']:
+            return self['tsFirstGid'][tilesetSearchName] + tilesetTileSearchNumber
 
         # By design this should never happen so we need to quit!
         # This probably means a tile object was added to this map but this map does
@@ -281,6 +387,42 @@ class Map(dict):
     # FOLLOW
     ########################################################
 
+    def getFollowEntry(self, leaderObject):
+        """Return the entry in self['follow'] for leaderObject or None if it has no followers.
+
+        Entries are found with self['followIndex'], which is rebuilt if
+        self['follow'] was changed without it knowing.
+        """
+        if len(self['followIndex']) != len(self['follow']):
+            self.resetFollowIndex()
+        entry = self['followIndex'].get(id(leaderObject))
+        if entry is None or entry['leader'] is not leaderObject:
+            return None
+        return entry
+
+    def resetFollowIndex(self):
+        """Rebuild self['followIndex'] from self['follow'].
+
+        This is done automatically if self['follow'] changes length. Code that
+        changes self['follow'] in other ways must call this after.
+        """
+        self['followIndex'] = {id(entry['leader']): entry for entry in self['follow']}
+
+    def isFollowing(self, followerObject, leaderObject):
+        """Return True if followerObject follows leaderObject, directly or through other followers."""
+        stack = [leaderObject]
+        done = set()
+        while stack:
+            entry = self.getFollowEntry(stack.pop())
+            if entry is None or id(entry['leader']) in done:
+                continue
+            done.add(id(entry['leader']))
+            for fo in entry['followers']:
+                if fo[0] is followerObject:
+                    return True
+                stack.append(fo[0])
+        return False
+
     def addFollower(self, leaderObject, followerObject):
         """Add leaderObject/followerObject relationship to self['follow']
         This also records the relative position of the objects.
@@ -291,39 +433,46 @@ class Map(dict):
         Once a followerObject has been added it should not longer be used with
         setObjectLocationByAnchor() or setObjectMap(), only the leaderObject
         should.
+
+        followerObject may have its own followers but a leaderObject can't
+        follow itself, directly or through other followers. If it would then
+        an error is logged and the relationship is not added.
         """
+        if leaderObject is followerObject or self.isFollowing(leaderObject, followerObject):
+            log(f"Can't add follower '{followerObject['name']}' to '{leaderObject['name']}' since it would create a follow cycle.", "ERROR")
+            return
+
         deltaAnchorX = followerObject['anchorX'] - leaderObject['anchorX']
         deltaAnchorY = followerObject['anchorY'] - leaderObject['anchorY'] 
-        for i in range(len(self['follow'])):
-            if self['follow'][i]['leader'] == leaderObject:
-                for fo in self['follow'][i]['followers']:
-                    if fo[0] == followerObject:
-                        return  # followerObject has already been added.
-                self['follow'][i]['followers'].append((followerObject,deltaAnchorX,deltaAnchorY))
-                return
-        self['follow'].append({'leader': leaderObject, 'followers': [(followerObject,deltaAnchorX,deltaAnchorY)]})
-
+        entry = self.getFollowEntry(leaderObject)
+        if entry is None:
+            entry = {'leader': leaderObject, 'followers': []}
+            self['follow'].append(entry)
+            self['followIndex'][id(leaderObject)] = entry
+        for fo in entry['followers']:
+            if fo[0] is followerObject:
+                return  # followerObject has already been added.
+        entry['followers'].append((followerObject,deltaAnchorX,deltaAnchorY))
 
     def removeFollower(self, leaderObject, followerObject):
         """Remove leaderObject/followerObject relationship from self['follow']"""
-
-        for i in range(len(self['follow'])):
-            if self['follow'][i]['leader'] == leaderObject:
-                for fo in self['follow'][i]['followers']:
-                    if fo[0] == followerObject:
-                        self['follow'][i]['followers'].remove(fo)
-                    if len(self['follow'][i]['followers']) == 0:
-                        del self['follow'][i]
-                return
+        entry = self.getFollowEntry(leaderObject)
+        if entry is None:
+            return
+        entry['followers'][:] = [fo for fo in entry['followers'] if fo[0] is not followerObject]
+        if len(entry['followers']) == 0:
+            for i in range(len(self['follow'])):
+                if self['follow'][i] is entry:
+                    del self['follow'][i]
+                    break
+            del self['followIndex'][id(leaderObject)]
 
     def getFollowers(self, leaderObject):
         """Returns array of objects that follow leaderObject: [object,object,object]"""
-        followers = []
-        for i in range(len(self['follow'])):
-            if self['follow'][i]['leader'] == leaderObject:
-                for followerObject, deltaAnchorX, deltaAnchorY in self['follow'][i]['followers']:
-                    followers.append(followerObject)
-        return followers
+        entry = self.getFollowEntry(leaderObject)
+        if entry is None:
+            return []
+        return [followerObject for followerObject, deltaAnchorX, deltaAnchorY in entry['followers']]
 
     def logFollow(self, m):
         """log() a human readable version of m['follow'] (for debugging)"""
@@ -358,7 +507,12 @@ class Map(dict):
         object['mapName'] = self['name']
 
         # add object to list
+        index = self.getSpatialIndex(objectList, create=False)
+        self.checkObjectRegistry()
         objectList.append(object)
+        self.registerObject(object, objectList)
+        if index:
+            index.add(object)
 
         # Update tile gid since destMap may have a different gid for the same tile image.
         if "gid" in object:
@@ -383,11 +537,19 @@ class Map(dict):
         if not isinstance(objectList, list):
             objectList = self['sprites']
 
-        try:  # ignore error is object is not in objectlist.
-            objectList.remove(object)
-            self.setMapChanged()
-        except:
-            pass
+        index = self.getSpatialIndex(objectList, create=False)
+        self.checkObjectRegistry()
+        for i in range(len(objectList)):
+            if objectList[i] is object:
+                del objectList[i]
+                break
+        else:  # ignore object if it is not in objectlist.
+            return
+
+        self.unregisterObject(object, objectList)
+        self.setMapChanged()
+        if index:
+            index.remove(object)
 
     def removeObjectFromAllLayers(self, object):
         """Remove a Tiled object from all layers of this map.
@@ -403,23 +565,9 @@ class Map(dict):
             object (dict): Tiled object
         """
 
-        # remove object from all object layers.
-        if object in self['triggers']:
-            self.removeObject(object, objectList=self['triggers'])
-        if object in self['sprites']:
-            self.removeObject(object, objectList=self['sprites'])
-        if object in self['reference']:
-            self.removeObject(object, objectList=self['reference'])
-        if object in self['inBounds']:
-            self.removeObject(object, objectList=self['inBounds'])
-        if object in self['outOfBounds']:
-            self.removeObject(object, objectList=self['outOfBounds'])
-
-        # also remove object from any other layers (other than the well known ones above)
-        for layer in self['layers']:
-            if layer['type'] == "objectgroup":
-                if object in layer['objects']:
-                    layer['objects'].remove(object)
+        # remove object from all object layers, including ones other than the well known layers.
+        for listName in self.getObjectLayers(object):
+            self.removeObject(object, objectList=self['objectLists'][listName])
 
         self.setMapChanged()
 
@@ -449,7 +597,10 @@ class Map(dict):
         '''
         if not isinstance(objectList, list):
             objectList = self['sprites']
-        
+
+        if collidesWith != False:
+            objectList = self.findObjectsNear(collidesWith, objectList)
+
         found = []
         for object in objectList:
             if name != False and object['name'] != name:
@@ -458,7 +609,7 @@ class Map(dict):
                 continue
             if collisionType != False and object['collisionType'] != collisionType:
                 continue
-            if exclude != False and exclude == object:
+            if exclude != False and exclude is object:
                 continue
             if collidesWith != False and not geo.collides(collidesWith, object, overlap=overlap):
                     continue
@@ -470,6 +621,218 @@ class Map(dict):
             return False
         return found
 
+    ########################################################
+    # OBJECT REGISTRY
+    ########################################################
+
+    def resetObjectRegistry(self):
+        """Rebuild the object registry from the object lists.
+
+        Objects that were already registered keep their ids. This is done
+        automatically when an object list was changed without using addObject()
+        or removeObject() (see ObjectList).
+        """
+        global nextObjectId
+
+        # found from objectsById, rather than objectIds, since id() changes if the map is copied to another process.
+        oldObjectIds = {id(object): objectId for objectId, object in self['objectsById'].items()}
+        self['objectListNames'] = {id(objectList): listName for listName, objectList in self['objectLists'].items()}
+        self['objectsById'] = {}
+        self['objectIds'] = {}
+        self['objectLayers'] = {}
+        self['objectListChangeCounts'] = {}
+        for listName, objectList in self['objectLists'].items():
+            for object in objectList:
+                objectId = oldObjectIds.get(id(object))
+                if objectId is not None and objectId not in self['objectsById']:
+                    self['objectsById'][objectId] = object
+                    self['objectIds'][id(object)] = objectId
+                    self['objectLayers'][objectId] = set()
+        # ids kept from another process (see engine.mapworker) must not be given out again.
+        nextObjectId = max(nextObjectId, max(self['objectsById'], default=0) + 1)
+        for listName, objectList in self['objectLists'].items():
+            for object in objectList:
+                self.registerObject(object, objectList)
+            self['objectListChangeCounts'][listName] = objectList.changeCount
+
+    def checkObjectRegistry(self):
+        """Rebuild the object registry if an object list was changed without it knowing."""
+        changeCounts = self['objectListChangeCounts']
+        for listName, objectList in self['objectLists'].items():
+            if objectList.changeCount != changeCounts[listName]:
+                self.resetObjectRegistry()
+                return
+
+    def registerObject(self, object, objectList):
+        """Record that object was added to objectList. Gives object an id if it does not have one."""
+        global nextObjectId
+
+        listName = self['objectListNames'].get(id(objectList))
+        if listName is None:
+            return  # objectList is not on this map.
+        objectId = self['objectIds'].get(id(object))
+        if objectId is None:
+            objectId = nextObjectId
+            nextObjectId += 1
+            self['objectsById'][objectId] = object
+            self['objectIds'][id(object)] = objectId
+            self['objectLayers'][objectId] = set()
+        self['objectLayers'][objectId].add(listName)
+        self['objectListChangeCounts'][listName] = objectList.changeCount
+
+    def unregisterObject(self, object, objectList):
+        """Record that object was removed from objectList. The id is forgotten once object is in no list."""
+        listName = self['objectListNames'].get(id(objectList))
+        objectId = self['objectIds'].get(id(object))
+        if listName is None or objectId is None:
+            return
+        self['objectListChangeCounts'][listName] = objectList.changeCount
+        self['objectLayers'][objectId].discard(listName)
+        if not self['objectLayers'][objectId]:
+            del self['objectLayers'][objectId]
+            del self['objectsById'][objectId]
+            del self['objectIds'][id(object)]
+
+    def getObjectId(self, object):
+        """Return the id of object on this map.
+
+        Every object in an object list of this map has an int id. The id stays
+        the same while the object is on the map and is never used by another
+        object, on this map or any other map. An object that leaves the map and
+        comes back is given a new id.
+
+        Args:
+            object (dict): Tiled object
+
+        Returns:
+            int: The object's id or False if object is not in an object list of this map.
+        """
+        self.checkObjectRegistry()
+        objectId = self['objectIds'].get(id(object))
+        if objectId is None:
+            return False
+        return objectId
+
+    def getObjectIds(self, objectList=False):
+        """Return a list of the ids (see getObjectId()) of the objects in objectList, in list order.
+
+        Args:
+            objectList (dict): An objectList from a layer on this map. Default is self['sprites'].
+        """
+        if not isinstance(objectList, list):
+            objectList = self['sprites']
+        self.checkObjectRegistry()
+        objectIds = self['objectIds']
+        return [objectIds.get(id(object), False) for object in objectList]
+
+    def getObjectById(self, objectId):
+        """Return the object with objectId (see getObjectId()) or False if there is none."""
+        self.checkObjectRegistry()
+        return self['objectsById'].get(objectId, False)
+
+    def getObjectLayers(self, object):
+        """Return a list of the names of the object lists on this map that object is in.
+
+        The names of the well known lists (e.g. 'sprites') are the same as the
+        list's key in this map. Other object lists are named after their layer.
+        """
+        self.checkObjectRegistry()
+        objectId = self['objectIds'].get(id(object))
+        if objectId is None:
+            return []
+        return list(self['objectLayers'][objectId])
+
+    def isObjectInList(self, object, objectList=False):
+        """Return True if object (not just an equal object) is in objectList.
+
+        Args:
+            object (dict): Tiled object
+            objectList (dict): An objectList from a layer on this map. Default is self['sprites'].
+        """
+        if not isinstance(objectList, list):
+            objectList = self['sprites']
+        listName = self['objectListNames'].get(id(objectList))
+        if listName is None:
+            return any(object is o for o in objectList)  # objectList is not on this map.
+        self.checkObjectRegistry()
+        objectId = self['objectIds'].get(id(object))
+        return objectId is not None and listName in self['objectLayers'][objectId]
+
+    ########################################################
+    # SPATIAL INDEX
+    ########################################################
+
+    def getSpatialIndex(self, objectList, create=True):
+        """Return the engine.spatialindex.SpatialIndex of objectList.
+
+        Only the sprites, triggers, inBounds and outOfBounds lists are indexed.
+        The index is created the first time it is needed and is rebuilt if
+        objectList was changed without using addObject() or removeObject().
+
+        Args:
+            objectList (list): An objectList from a layer on this map.
+            create (bool): If False then do not create or rebuild the index.
+
+        Returns:
+            SpatialIndex or None if objectList is not indexed (or create
+            is False and there is no current index).
+        """
+        for listName in ('sprites', 'triggers', 'inBounds', 'outOfBounds'):
+            if self[listName] is objectList:
+                break
+        else:
+            return None
+
+        index = self['spatialIndexes'].get(listName)
+        if index and index.isCurrent(objectList):
+            return index
+        if not create:
+            return None
+        index = engine.spatialindex.SpatialIndex(objectList, self['SPATIAL_CELL_SIZE'])
+        self['spatialIndexes'][listName] = index
+        return index
+
+    def updateSpatialIndexes(self, object):
+        """Update the spatial indexes after object's location or size changed.
+
+        setObjectLocationByAnchor() and setObjectLocationByXY() already do
+        this. Code that changes x, y, width, height, anchorX, anchorY,
+        polyline or polygon directly must call this after.
+
+        Args:
+            object (dict): Tiled object
+        """
+        for index in self['spatialIndexes'].values():
+            index.update(object)
+
+    def resetSpatialIndexes(self):
+        """Discard all spatial indexes so they are rebuilt when next needed."""
+        self['spatialIndexes'] = {}
+
+    def findObjectsNear(self, object, objectList, ordered=True):
+        """Return the objects in objectList that may collide with object.
+
+        This is a quick first pass that uses the spatial index of objectList
+        to skip objects that are too far away to collide. The objects returned
+        still need to be checked for an actual collision. If objectList is
+        not indexed then the whole list is returned.
+
+        Args:
+            object (dict): Tiled object, which does not need to be on this map.
+            objectList (list): An objectList from a layer on this map.
+            ordered (bool): If True then the objects are returned in the same
+                order as objectList.
+
+        Returns:
+            list: The objects. This may be objectList itself so it must not be changed.
+        """
+        if len(objectList) < self['SPATIAL_MIN_OBJECTS']:
+            return objectList
+        index = self.getSpatialIndex(objectList)
+        if not index:
+            return objectList
+        return index.query(engine.spatialindex.getBounds(object), ordered)
+
     ########################################################
     # OBJECTS (mostly useful for sprites)
     ########################################################
@@ -557,6 +920,7 @@ class Map(dict):
         4) if the inBounds layer is empty then it IS valid
         5) if object is fully inside an object or objects on the inBounds layer then it IS valid.
         6) else it is NOT valid.
+        Steps 3 to 6 are done by checkBounds().
 
         Args:
             object (dict): A Tiled object.
@@ -594,14 +958,14 @@ class Map(dict):
         #if self.findObject(collidesWith=collidesWith, exclude=object):
         #    return False
         if 'sprites' in checkLocationOn:
-            for o in self['sprites']:
+            for o in self.findObjectsNear(collidesWith, self['sprites'], ordered=False):
                 # do a quick check to see if we can avoid collidesFast() function call.
                 if collidesWith['collisionType'] != 'line' and ((o['collisionType']!='rect' and o['collisionType']!='circle') or \
                     o['x'] > collidesWith['x']+collidesWith['width'] or o['y'] > collidesWith['y']+collidesWith['height'] or \
                     collidesWith['x'] > o['x']+o['width'] or collidesWith['y'] > o['y']+o['height']):
                     continue
                 # using collidesFast() assumes sprite objects have collision types of rect or circle. Others will return False
-                if collidesFast(collidesWith,collidesWith['collisionType'], o,o['collisionType']) and o != object:
+                if collidesFast(collidesWith,collidesWith['collisionType'], o,o['collisionType']) and o is not object:
                     return False
 
         # if object does not fully collide (overlap) with the map then it is NOT valid.
@@ -619,19 +983,34 @@ class Map(dict):
                 overlap='full'):
             return False
 
+        return self.checkBounds(object, collidesWith, checkLocationOn)
+
+    def checkBounds(self, object, collidesWith, checkLocationOn):
+        """Check the inBounds and outOfBounds part of checkLocation().
+
+        Args:
+            object (dict): A Tiled object.
+            collidesWith (dict): object at the location being checked.
+            checkLocationOn (list): Layer names to check. See checkLocation()
+
+        Returns:
+            bool: True if collidesWith does not collide with an object on the outOfBounds
+                layer and is fully inside an object on the inBounds layer (or the
+                inBounds layer is empty), else False.
+        """
         # if object collides (overlaps) with an object on the outOfBounds layer then it is NOT valid.
         # The next two lines were removed and replaced with the lines below to increase performance.
         #if self.findObject(collidesWith=collidesWith, objectList=self['outOfBounds']):
         #    return False
         if 'outOfBounds' in checkLocationOn:
-            for o in self['outOfBounds']:
+            for o in self.findObjectsNear(collidesWith, self['outOfBounds'], ordered=False):
                 # do a quick check to see if we can avoid collidesFast() function call.
                 if collidesWith['collisionType'] != 'line' and ((o['collisionType']!='rect' and o['collisionType']!='circle') or \
                     o['x'] > collidesWith['x']+collidesWith['width'] or o['y'] > collidesWith['y']+collidesWith['height'] or \
                     collidesWith['x'] > o['x']+o['width'] or collidesWith['y'] > o['y']+o['height']):
                     continue
                 # using collidesFast() assumes outOfBounds objects have collision types of rect or circle
-                if collidesFast(collidesWith,collidesWith['collisionType'], o,o['collisionType']) and o != object:
+                if collidesFast(collidesWith,collidesWith['collisionType'], o,o['collisionType']) and o is not object:
                     return False
 
         # if object is fully inside an object or objects on the inBounds layer then it IS valid.
@@ -644,14 +1023,14 @@ class Map(dict):
         if 'inBounds' in checkLocationOn:
             if len(self['inBounds']) == 0:
                 return True
-            for o in self['inBounds']:
+            for o in self.findObjectsNear(collidesWith, self['inBounds'], ordered=False):
                 # do a quick check to see if we can avoid collidesFast() function call.
                 if collidesWith['collisionType'] != 'line' and ((o['collisionType']!='rect' and o['collisionType']!='circle') or \
                     o['x'] > collidesWith['x']+collidesWith['width'] or o['y'] > collidesWith['y']+collidesWith['height'] or \
                     collidesWith['x'] > o['x']+o['width'] or collidesWith['y'] > o['y']+o['height']):
                     continue
                 # using collidesFast() assumes outOfBounds objects have collision types of rect or circle
-                if collidesFast(collidesWith,collidesWith['collisionType'], o,o['collisionType'], overlap='full') and o != object:
+                if collidesFast(collidesWith,collidesWith['collisionType'], o,o['collisionType'], overlap='full') and o is not object:
                     return True
         else:
             return True
@@ -719,6 +1098,7 @@ class Map(dict):
             object['anchorX'] = object['x'] + object['width'] / 2
             object['anchorY'] = object['y'] + object['height'] / 2
 
+        self.updateSpatialIndexes(object)
         self.setMapChanged()
 
     def setObjectLocationByAnchor(self, object, anchorX, anchorY):
@@ -743,10 +1123,12 @@ class Map(dict):
             object['x'] = anchorX - object['width'] / 2
             object['y'] = anchorY - object['height'] / 2
 
-        for i in range(len(self['follow'])):
-            if self['follow'][i]['leader'] == object:
-                for followerObject, deltaAnchorX, deltaAnchorY in self['follow'][i]['followers']:
-                    self.setObjectLocationByAnchor(followerObject, anchorX+deltaAnchorX, anchorY+deltaAnchorY)
+        self.updateSpatialIndexes(object)
+
+        entry = self.getFollowEntry(object)
+        if entry:
+            for followerObject, deltaAnchorX, deltaAnchorY in entry['followers']:
+                self.setObjectLocationByAnchor(followerObject, anchorX+deltaAnchorX, anchorY+deltaAnchorY)
                 
         self.setMapChanged()
 
@@ -764,29 +1146,16 @@ class Map(dict):
         """
 
         # if we are moving the object from one map to the same map then we are done.
-        if(self == destMap):
+        if self is destMap:
             return
 
-        if object in self['triggers']:
-            self.removeObject(object, objectList=self['triggers'])
-            destMap.addObject(object, objectList=destMap['triggers'])
-
-        if object in self['sprites']:
-            self.removeObject(object, objectList=self['sprites'])
-            destMap.addObject(object, objectList=destMap['sprites'])
-
-        if object in self['reference']:
-            self.removeObject(object, objectList=self['reference'])
-            destMap.addObject(object, objectList=destMap['reference'])
-
-        if object in self['inBounds']:
-            self.removeObject(object, objectList=self['inBounds'])
-            destMap.addObject(object, objectList=destMap['inBounds'])
-
-        if object in self['outOfBounds']:
-            self.removeObject(object, objectList=self['outOfBounds'])
-            destMap.addObject(object, objectList=destMap['outOfBounds'])
+        layers = self.getObjectLayers(object)
+        for listName in ('triggers', 'sprites', 'reference', 'inBounds', 'outOfBounds'):
+            if listName in layers:
+                self.removeObject(object, objectList=self[listName])
+                destMap.addObject(object, objectList=destMap[listName])
 
+        # move followers, and their followers, with object. This always ends since addFollower() does not allow cycles.
         followObjects = self.getFollowers(object)
         for f in followObjects:
             self.removeFollower(object,f)
@@ -0,0 +1,739 @@
+"""Parallel Map Stepping
+
+This module is used by engine.server.Server to step maps in worker
+processes when the server is started with -mapworkers. The maps are
+divided between the workers and each worker owns (steps) the ServerMap
+instances of its maps. The server process keeps its own copy of every map,
+which is what msg processing, stepServerStart(), stepServerEnd() and step
+msgs use, the same as when the server steps the maps itself.
+
+Each step the server and the workers trade changes:
+
+    1) The server sends each worker the changes the server made to the
+       worker's maps since the last step (e.g. while processing player
+       msgs), changes other workers made to them (e.g. a sprite moved
+       onto them through a mapDoor), and the Server and player data.
+    2) All workers step their maps at the same time.
+    3) Each worker sends back the changes made during the step, including
+       objects it moved onto maps owned by other workers and Server and
+       player data changed by map code.
+    4) The server applies the changes to its copy of the maps so step msgs
+       can be sent as usual. Objects moved onto another worker's map are
+       sent to that worker at the start of the next step.
+
+Tiled objects are identified across processes by an int id (see
+ObjectSync). References from one object to another (e.g. sprite['holding'])
+are sent as an ObjectRef so they still refer to the same object after being
+received. Only objects that have changed since the other process last
+received them are sent.
+
+Map code stepped by a worker must follow these rules:
+
+    - Changes to a map must flag the map as changed (setMapChanged()). The
+      engine methods, such as addObject() and setObjectLocationByAnchor(),
+      already do. This is the same rule step msgs already rely on. Player
+      sprites are always checked for changes.
+    - Objects that are only on the reference, inBounds or outOfBounds layers
+      are sent when they are added to a map but later changes to them are not.
+    - Server and player data changed by map code must be simple values
+      (int, float, str, bool, None) stored directly in the Server or the
+      player, e.g. player['health'] -= 1. Changes to numbers are merged by
+      adding them up so several workers can change the same value in one step.
+    - Maps owned by other workers are copies from when the workers started.
+      Objects can be moved onto them (e.g. with setObjectMap()) but other
+      changes to them are lost.
+    - engine.server.SERVER is a stand in for the Server (see WorkerServer).
+      It is an instance of the game's Server class, so its methods can be
+      called, but Server.__init__() is not run in workers. It only has the
+      Server data that is one of SIMPLE_TYPES, 'tilesets', 'maps', 'players'
+      and 'playersByNum'. Other Server data, such as 'socket', is not
+      available and using it raises a KeyError that names the missing key.
+      Games whose map code needs more than this must not use -mapworkers.
+
+The workers are started with multiprocessing so the game's Server class,
+ServerMap classes, and tilesets must be able to be pickled. Where the
+"spawn" start method is used (e.g. Windows) they are also imported again in
+each worker.
+"""
+
+import signal
+import random
+import traceback
+import multiprocessing
+
+from engine.log import log
+import engine.server
+
+# map layers whose objects are kept the same in the server and workers.
+OBJECT_LISTS = ('sprites', 'triggers', 'reference', 'inBounds', 'outOfBounds')
+
+# types of Server and player data that is sent to and from workers.
+SIMPLE_TYPES = (int, float, str, bool, type(None))
+
+# secs MapWorkerPool.stop() waits for each worker to quit before terminating it.
+STOP_TIMEOUT = 2
+
+
+class ObjectRef:
+    """A reference to a Tiled object, used in place of the object when it is sent."""
+
+    __slots__ = ('id',)
+
+    def __init__(self, id):
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, ObjectRef) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"ObjectRef({self.id})"
+
+
+def getFields(d):
+    """Return {key: value, ...} of the items of d with a value that is one of SIMPLE_TYPES."""
+    return {k: v for k, v in d.items() if type(v) in SIMPLE_TYPES}
+
+
+def getFieldChanges(before, after):
+    """Return the changes from before to after, both from getFields().
+
+    Returns:
+        dict: {key: ('add', amount) or ('set', value), ...} for each key that changed.
+            Numbers that changed are given as the amount they changed by.
+    """
+    changes = {}
+    for k, v in after.items():
+        old = before.get(k)
+        if k in before and old == v and type(old) is type(v):
+            continue
+        if type(v) in (int, float) and type(old) in (int, float):
+            changes[k] = ('add', v - old)
+        else:
+            changes[k] = ('set', v)
+    return changes
+
+
+def applyFieldChanges(d, changes):
+    """Apply changes from getFieldChanges() to d."""
+    for k, (op, v) in changes.items():
+        if op == 'add' and type(d.get(k)) in (int, float):
+            d[k] += v
+        else:
+            d[k] = v
+
+
+class ObjectSync(dict):
+    """ObjectSync Class
+
+    Gives Tiled objects an id that is the same in the server and all
+    workers, and converts objects to and from the form that is sent
+    between them.
+
+    New objects can be created in any process so ids are counted up in
+    steps of self['slots'] starting from self['slot'], which is 0 for the
+    server and worker number + 1 for workers. That keeps the ids from
+    different processes from ever being the same.
+    """
+
+    def __init__(self, slot, slots, objects):
+        """Create an ObjectSync.
+
+        Args:
+            slot (int): 0 in the server process, worker number + 1 in a worker.
+            slots (int): Number of workers + 1.
+            objects (dict): {id: object, ...} objects that already have ids.
+        """
+        self['slot'] = slot
+        self['slots'] = slots
+        self['objects'] = objects
+        self['ids'] = {id(o): i for i, o in objects.items()}  # {python id(): object id, ...}
+        self['nextId'] = (max(objects, default=0) // slots + 1) * slots + slot
+
+    def getId(self, object):
+        """Return the id of object, giving it one if it does not have one yet."""
+        i = self['ids'].get(id(object))
+        if i is None:
+            i = self['nextId']
+            self['nextId'] += self['slots']
+            self['ids'][id(object)] = i
+            self['objects'][i] = object
+        return i
+
+    def getObject(self, i):
+        """Return the object with id i. If there is none yet then an empty one is created."""
+        object = self['objects'].get(i)
+        if object is None:
+            object = {}
+            self['ids'][id(object)] = i
+            self['objects'][i] = object
+        return object
+
+    ########################################################
+    # ENCODE/DECODE
+    ########################################################
+
+    def encodeValue(self, value, refs):
+        """Return a copy of value with objects that have an id replaced by ObjectRef.
+
+        Args:
+            value: Any value from a Tiled object.
+            refs (list): Objects that were replaced by an ObjectRef are appended to refs.
+        """
+        if type(value) in SIMPLE_TYPES:
+            return value
+        if isinstance(value, dict):
+            i = self['ids'].get(id(value))
+            if i is not None:
+                refs.append(value)
+                return ObjectRef(i)
+            return {k: self.encodeValue(v, refs) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.encodeValue(v, refs) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self.encodeValue(v, refs) for v in value)
+        return value
+
+    def decodeValue(self, value):
+        """Return value from encodeValue() with each ObjectRef replaced by the object."""
+        if type(value) in SIMPLE_TYPES:
+            return value
+        if isinstance(value, ObjectRef):
+            return self.getObject(value.id)
+        if isinstance(value, dict):
+            return {k: self.decodeValue(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.decodeValue(v) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self.decodeValue(v) for v in value)
+        return value
+
+    def getChangedStates(self, objects, known):
+        """Return the state of each object that is not the same as in known.
+
+        Objects referred to by objects are also checked.
+
+        Args:
+            objects (list): Objects to check.
+            known (dict): {id: state, ...} the state of each object the other
+                process has. Updated with the states returned.
+
+        Returns:
+            dict: {id: state, ...} where state is the object encoded with encodeValue().
+        """
+        states = {}
+        done = set()
+        while objects:
+            object = objects.pop()
+            i = self.getId(object)
+            if i in done:
+                continue
+            done.add(i)
+            state = {k: self.encodeValue(v, objects) for k, v in object.items()}
+            if known.get(i) != state:
+                known[i] = state
+                states[i] = state
+        return states
+
+    def applyStates(self, states, maps):
+        """Update objects with states from getChangedStates().
+
+        Args:
+            states (dict): From getChangedStates().
+            maps (dict): {mapName: map, ...} The spatial index of the map each
+                object is on is updated in case the object moved.
+        """
+        for i, state in states.items():
+            object = self.getObject(i)
+            state = {k: self.decodeValue(v) for k, v in state.items()}
+            object.clear()
+            object.update(state)
+            if object.get('mapName') in maps:
+                maps[object['mapName']].updateSpatialIndexes(object)
+
+    def getMapObjects(self, map, known):
+        """Return the objects of map that getChangedStates() should check.
+
+        Objects only on the reference, inBounds and outOfBounds layers are rarely
+        changed so they are only returned if the other process does not have them.
+        """
+        objects = map['sprites'] + map['triggers']
+        for listName in ('reference', 'inBounds', 'outOfBounds'):
+            for object in map[listName]:
+                if self.getId(object) not in known:
+                    objects.append(object)
+        return objects
+
+    def encodeMap(self, map, refs):
+        """Return the object lists, follow data, and layer visibility of map."""
+        for entry in map['follow']:
+            self.getId(entry['leader'])
+            for follower in entry['followers']:
+                self.getId(follower[0])
+        return {
+            'lists': {listName: [self.getId(o) for o in map[listName]] for listName in OBJECT_LISTS},
+            'follow': self.encodeValue(map['follow'], refs),
+            'layerVisabilityMask': map['layerVisabilityMask']
+            }
+
+    def applyMap(self, map, mapState):
+        """Update map with mapState from encodeMap()."""
+        for listName, ids in mapState['lists'].items():
+            map[listName][:] = [self.getObject(i) for i in ids]
+        map['follow'][:] = self.decodeValue(mapState['follow'])
+        map['layerVisabilityMask'] = mapState['layerVisabilityMask']
+        map.resetSpatialIndexes()
+        map.resetObjectRegistry()
+        map.resetFollowIndex()
+
+
+class MapWorkerPool(ObjectSync):
+    """MapWorkerPool Class
+
+    Runs in the server process. Starts the worker processes, sends them the
+    maps to step, and keeps the server's copy of the maps the same as the
+    workers' copies.
+    """
+
+    def __init__(self, server, workers, startMethod=None):
+        """Start the worker processes.
+
+        Args:
+            server (engine.server.Server): The server. Its maps must be fully set up.
+            workers (int): Number of worker processes to start.
+            startMethod (str): multiprocessing start method (e.g. "spawn") or None
+                for the platform's default.
+        """
+        super().__init__(0, workers + 1, {})
+        self['server'] = server
+        self['workers'] = workers
+        self['stopped'] = False
+
+        # give every object an id before the workers start so they all have the same ids.
+        for map in server['maps'].values():
+            for listName in OBJECT_LISTS:
+                for object in map[listName]:
+                    self.getId(object)
+
+        self['workerMaps'] = self.partitionMaps(server['maps'], workers)  # [[mapName, ...], ...] for each worker
+        self['owners'] = {}  # {mapName: worker, ...}
+        for worker in range(workers):
+            for mapName in self['workerMaps'][worker]:
+                self['owners'][mapName] = worker
+
+        self['known'] = [{} for worker in range(workers)]  # state of each object each worker has (see getChangedStates())
+        # map.changeCount when each map was last sent to or received from its worker.
+        self['syncedChangeCount'] = {mapName: map.changeCount for mapName, map in server['maps'].items()}
+
+        state = {
+            'serverClass': type(server),
+            'serverFields': getFields(server),
+            'tilesets': server['tilesets'],
+            'maps': server['maps'],
+            'objects': self['objects'],
+            'slots': self['slots']
+            }
+        context = multiprocessing.get_context(startMethod)
+        self['processes'] = []
+        self['conns'] = []
+        for worker in range(workers):
+            conn, workerConn = context.Pipe()
+            process = context.Process(
+                target=runWorker,
+                args=(workerConn, worker, self['workerMaps'][worker], state),
+                name=f"mapworker{worker}",
+                daemon=True  # only relied on if the server exits without calling stop().
+                )
+            process.start()
+            workerConn.close()
+            self['processes'].append(process)
+            self['conns'].append(conn)
+            log(f"Map worker {worker} (pid {process.pid}) owns maps: {', '.join(self['workerMaps'][worker])}")
+
+    def stop(self):
+        """Stop the worker processes. Does nothing if they have already been stopped.
+
+        Each worker is sent a stop request and given STOP_TIMEOUT secs to
+        quit. Workers that are still running after that are terminated.
+        """
+        if self['stopped']:
+            return
+        self['stopped'] = True
+
+        for conn in self['conns']:
+            try:
+                conn.send(None)
+            except (EOFError, OSError):
+                pass  # worker has already quit.
+        for worker, process in enumerate(self['processes']):
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                log(f"Map worker {worker} did not stop so terminating it.", "WARNING")
+                process.terminate()
+                process.join()
+        for conn in self['conns']:
+            conn.close()
+        log("Map workers stopped.", "VERBOSE")
+
+    def partitionMaps(self, maps, workers):
+        """Return [[mapName, ...], ...] the maps each worker will own.
+
+        Maps are handed out biggest first to the worker with the least to do
+        so far. The size of a map is an estimate of the checks needed to step
+        it: sprites * (sprites + triggers + inBounds + outOfBounds).
+        """
+        sizes = {}
+        for mapName, map in maps.items():
+            sizes[mapName] = 1 + len(map['sprites']) * (
+                len(map['sprites']) + len(map['triggers']) + len(map['inBounds']) + len(map['outOfBounds']))
+
+        workerMaps = [[] for worker in range(workers)]
+        loads = [0] * workers
+        for mapName in sorted(maps, key=lambda mapName: (-sizes[mapName], mapName)):
+            worker = loads.index(min(loads))
+            workerMaps[worker].append(mapName)
+            loads[worker] += sizes[mapName]
+        return workerMaps
+
+    def stepMaps(self, mapNames, mapDts=None):
+        """Step the maps in mapNames, in parallel, and update the server's copy of all maps.
+
+        Args:
+            mapNames (list): Names of maps to step.
+            mapDts (dict): {mapName: dt, ...} passed to each map's stepMap() or None.
+        """
+        server = self['server']
+        maps = server['maps']
+
+        stepping = [[] for worker in range(self['workers'])]
+        for mapName in mapNames:
+            stepping[self['owners'][mapName]].append(mapName)
+
+        serverFields = getFields(server)
+        players = {}
+        for ipport, player in server['players'].items():
+            players[ipport] = getFields(player)
+            players[ipport]['sprite'] = ObjectRef(self.getId(player['sprite']))
+
+        # send each worker the maps to step and what changed since the last step.
+        for worker in range(self['workers']):
+            if not stepping[worker]:
+                continue  # changes will be sent the next time the worker has a map to step.
+            known = self['known'][worker]
+            objects = []
+            mapStates = {}
+            for mapName in self['workerMaps'][worker]:
+                map = maps[mapName]
+                if map.changeCount != self['syncedChangeCount'][mapName]:
+                    self['syncedChangeCount'][mapName] = map.changeCount
+                    mapStates[mapName] = self.encodeMap(map, objects)
+                    objects += self.getMapObjects(map, known)
+            for player in server['players'].values():
+                if self['owners'][player['sprite']['mapName']] == worker:
+                    objects.append(player['sprite'])
+            states = self.getChangedStates(objects, known)
+            dts = {mapName: mapDts[mapName] for mapName in stepping[worker]} if mapDts else None
+            self['conns'][worker].send((stepping[worker], dts, states, mapStates, serverFields, players))
+
+        results = []
+        for worker in range(self['workers']):
+            if stepping[worker]:
+                results.append((worker, self.recvResult(worker)))
+
+        # apply all object changes before changes to maps since maps refer to objects, then
+        # apply changes to maps before objects moved onto them so the moved objects are not lost.
+        for worker, result in results:
+            self.applyStates(result['states'], maps)
+            self['known'][worker].update(result['states'])
+        for worker, result in results:
+            for mapName, mapState in result['maps'].items():
+                map = maps[mapName]
+                self.applyMap(map, mapState)
+                map.setMapChanged()
+                self['syncedChangeCount'][mapName] = map.changeCount
+            for mapName, (stepsProcessed, stepProcessingTime) in result['stats'].items():
+                maps[mapName]['stepsProcessed'] = stepsProcessed
+                maps[mapName]['stepProcessingTime'] = stepProcessingTime
+        for worker, result in results:
+            for mapName, transfer in result['transfers'].items():
+                self.applyTransfer(maps[mapName], transfer)
+            applyFieldChanges(server, result['serverChanges'])
+            for ipport, changes in result['playerChanges'].items():
+                if ipport in server['players']:
+                    applyFieldChanges(server['players'][ipport], changes)
+
+    def recvResult(self, worker):
+        """Return the result of a step from worker. Quits the server if the worker failed."""
+        try:
+            result = self['conns'][worker].recv()
+        except (EOFError, OSError):
+            log(f"Map worker {worker} quit unexpectedly.", "FAILURE")
+            engine.server.quit()
+        if 'error' in result:
+            log(f"Map worker {worker} failed:\n{result['error']}", "FAILURE")
+            engine.server.quit()
+        return result
+
+    def applyTransfer(self, map, transfer):
+        """Add and remove the objects a worker moved onto or off of map, which another worker owns.
+
+        map is flagged as changed so the changes are sent to the worker that owns it.
+
+        Args:
+            map (engine.servermap.ServerMap): The server's copy of the map.
+            transfer (dict): From MapWorker.getTransfer()
+        """
+        for listName, ids in transfer['add'].items():
+            objectList = map[listName]
+            for i in ids:
+                object = self.getObject(i)
+                if not any(object is o for o in objectList):
+                    objectList.append(object)
+
+        for listName, ids in transfer['remove'].items():
+            ids = set(ids)
+            map[listName][:] = [o for o in map[listName] if self['ids'].get(id(o)) not in ids]
+
+        for entry in transfer['follow']:
+            entry = self.decodeValue(entry)
+            e = map.getFollowEntry(entry['leader'])
+            if e:
+                for follower in entry['followers']:
+                    if not any(follower[0] is f[0] for f in e['followers']):
+                        e['followers'].append(follower)
+            else:
+                map['follow'].append(entry)
+                map['followIndex'][id(entry['leader'])] = entry
+
+        map.resetSpatialIndexes()
+        map.resetObjectRegistry()
+        map.resetFollowIndex()
+        map.setMapChanged()
+
+
+class MapWorker(ObjectSync):
+    """MapWorker Class
+
+    Runs in a worker process. Steps the maps the worker owns each time the
+    MapWorkerPool asks it to.
+    """
+
+    def __init__(self, worker, mapNames, state):
+        """Set up the worker.
+
+        Args:
+            worker (int): Worker number.
+            mapNames (list): Names of the maps this worker owns.
+            state (dict): Server data from MapWorkerPool.__init__()
+        """
+        super().__init__(worker + 1, state['slots'], state['objects'])
+        self['worker'] = worker
+        self['mapNames'] = mapNames
+        self['maps'] = state['maps']
+        for map in self['maps'].values():
+            # indexes, the object registry and the follow index use python id() which may not be the same in this process.
+            map.resetSpatialIndexes()
+            map.resetObjectRegistry()
+            map.resetFollowIndex()
+        self['known'] = {}  # state of each object the server has (see getChangedStates())
+        self['serverFields'] = {}  # Server data as it was received from the server.
+        self['playerFields'] = {}  # {ipport: player data, ...} as it was received from the server.
+
+        # Stand in for engine.server.SERVER so map code can use the Server as usual.
+        server = WorkerServer.create(state['serverClass'], state['serverFields'], state['tilesets'], state['maps'])
+        engine.server.SERVER = server
+        self['server'] = server
+
+        # maps owned by other workers are left as they are now. Objects moved
+        # onto (or off of) them during a step are sent to the server and then put back.
+        self['otherMaps'] = {}
+        for mapName, map in self['maps'].items():
+            if mapName not in mapNames:
+                self['otherMaps'][mapName] = self.getMapLists(map)
+
+    def getMapLists(self, map):
+        """Return a copy of map's object lists and follow data that restoreMapLists() can put back."""
+        lists = {listName: list(map[listName]) for listName in OBJECT_LISTS}
+        lists['follow'] = [{'leader': e['leader'], 'followers': list(e['followers'])} for e in map['follow']]
+        return lists
+
+    def restoreMapLists(self, map, lists):
+        """Put back map's object lists and follow data from getMapLists()."""
+        for listName in OBJECT_LISTS:
+            map[listName][:] = lists[listName]
+        map['follow'][:] = [{'leader': e['leader'], 'followers': list(e['followers'])} for e in lists['follow']]
+        map.resetSpatialIndexes()
+        map.resetObjectRegistry()
+        map.resetFollowIndex()
+
+    def step(self, mapNames, mapDts, states, mapStates, serverFields, players):
+        """Apply the changes sent by the server, step mapNames, and return what changed.
+
+        Args:
+            mapNames (list): Names of maps to step.
+            mapDts (dict): {mapName: dt, ...} passed to each map's stepMap() or None.
+            states (dict): Object states from the server's getChangedStates().
+            mapStates (dict): {mapName: mapState, ...} from the server's encodeMap().
+            serverFields (dict): Server data from getFields().
+            players (dict): {ipport: player data, ...}
+
+        Returns:
+            dict: The changes made during the step for MapWorkerPool.stepMaps().
+        """
+        self.applyStates(states, self['maps'])
+        self['known'].update(states)
+        for mapName, mapState in mapStates.items():
+            self.applyMap(self['maps'][mapName], mapState)
+        self.applyServer(serverFields, players)
+
+        changeCounts = {mapName: map.changeCount for mapName, map in self['maps'].items()}
+        for mapName in mapNames:
+            self['maps'][mapName].stepMap(mapDts[mapName] if mapDts else None)
+
+        objects = []
+        mapStates = {}
+        for mapName in self['mapNames']:
+            map = self['maps'][mapName]
+            if map.changeCount != changeCounts[mapName]:
+                mapStates[mapName] = self.encodeMap(map, objects)
+                objects += self.getMapObjects(map, self['known'])
+
+        server = self['server']
+        for player in server['players'].values():
+            if player['sprite']['mapName'] in self['mapNames']:
+                objects.append(player['sprite'])
+
+        transfers = {}
+        for mapName, lists in self['otherMaps'].items():
+            map = self['maps'][mapName]
+            if map.changeCount != changeCounts[mapName]:
+                transfers[mapName] = self.getTransfer(map, lists, objects)
+
+        playerChanges = {}
+        for ipport, player in server['players'].items():
+            changes = getFieldChanges(self['playerFields'][ipport], getFields(player))
+            if changes:
+                playerChanges[ipport] = changes
+
+        return {
+            'states': self.getChangedStates(objects, self['known']),
+            'maps': mapStates,
+            'transfers': transfers,
+            'stats': {mapName: (self['maps'][mapName]['stepsProcessed'], self['maps'][mapName]['stepProcessingTime'])
+                      for mapName in mapNames},
+            'serverChanges': getFieldChanges(self['serverFields'], getFields(server)),
+            'playerChanges': playerChanges
+            }
+
+    def applyServer(self, serverFields, players):
+        """Update the stand in Server and its players with data sent by the server."""
+        server = self['server']
+        server.update(serverFields)
+        self['serverFields'] = getFields(server)
+
+        oldPlayers = server['players']
+        server['players'] = {}
+        server['playersByNum'] = {}
+        self['playerFields'] = {}
+        for ipport, fields in players.items():
+            player = oldPlayers.get(ipport, {})
+            player.update(fields)
+            player['sprite'] = self.getObject(fields['sprite'].id)
+            server['players'][ipport] = player
+            server['playersByNum'][player['playerNumber']] = player
+            self['playerFields'][ipport] = getFields(player)
+
+    def getTransfer(self, map, lists, objects):
+        """Return the objects moved onto or off of map, which another worker owns, and put map back.
+
+        Args:
+            map (engine.servermap.ServerMap): This worker's copy of the map.
+            lists (dict): map's object lists from getMapLists().
+            objects (list): Objects moved onto map are appended to objects
+                so their state is sent to the server.
+
+        Returns:
+            dict: {'add': {listName: [id, ...], ...}, 'remove': {listName: [id, ...], ...},
+                'follow': [follow entries of objects moved onto map, ...]}
+        """
+        transfer = {'add': {}, 'remove': {}, 'follow': []}
+        added = []
+        for listName in OBJECT_LISTS:
+            before = {id(o) for o in lists[listName]}
+            now = {id(o) for o in map[listName]}
+            add = [o for o in map[listName] if id(o) not in before]
+            remove = [o for o in lists[listName] if id(o) not in now]
+            if add:
+                transfer['add'][listName] = [self.getId(o) for o in add]
+                added += add
+            if remove:
+                transfer['remove'][listName] = [self.getId(o) for o in remove]
+
+        for entry in map['follow']:
+            if any(entry['leader'] is o for o in added):
+                for follower in entry['followers']:
+                    self.getId(follower[0])
+                transfer['follow'].append(self.encodeValue(entry, objects))
+
+        objects += added
+        self.restoreMapLists(map, lists)
+        return transfer
+
+
+class WorkerServer:
+    """WorkerServer Class
+
+    Mixed into the game's Server class to make the stand in for
+    engine.server.SERVER used by map code stepped in a worker. See the
+    rules at the top of this module for what it has.
+    """
+
+    @classmethod
+    def create(cls, serverClass, serverFields, tilesets, maps):
+        """Return a stand in Server.
+
+        Server.__init__() is not called since that would open the server socket.
+
+        Args:
+            serverClass (class): The game's Server class.
+            serverFields (dict): Server data from getFields().
+            tilesets (dict): The Server's tilesets.
+            maps (dict): The worker's maps.
+        """
+        facadeClass = type(f"Worker{serverClass.__name__}", (cls, serverClass), {})
+        server = facadeClass.__new__(facadeClass)
+        server.update(serverFields)
+        server['tilesets'] = tilesets
+        server['maps'] = maps
+        server['players'] = {}
+        server['playersByNum'] = {}
+        return server
+
+    def __missing__(self, key):
+        raise KeyError(f"Server['{key}'] is not available to map code stepped by -mapworkers. "
+                       "See engine.mapworker for the Server data map workers have.")
+
+
+def runWorker(conn, worker, mapNames, state):
+    """Main loop of a worker process. Steps maps each time the server sends a request on conn.
+
+    The worker quits when the server sends None (see MapWorkerPool.stop()) or closes conn.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the server process handles Ctrl-C and stops the workers.
+    random.seed()  # don't make the same random choices as the other workers.
+
+    mapWorker = MapWorker(worker, mapNames, state)
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break  # server has quit.
+        if request is None:
+            break  # server is stopping the workers.
+        try:
+            result = mapWorker.step(*request)
+        except Exception:
+            result = {'error': traceback.format_exc()}
+        conn.send(result)
@@ -30,6 +30,10 @@ class Messages(dict):
     <type> can be expressed as multiple acceptable types as (<type>,<type>,...)
 
     For fields of type 'str', min and max are the min length and max length of the string.
+
+    spriteFields below defines the sprite fields that can be sent in compact form in step
+    messages and the type of each (see engine.spritecodec). Sprites may have other fields
+    but they are sent unchanged. Client and server must use the same spriteFields.
     """
 
     def __init__(self):
@@ -40,12 +44,18 @@ class Messages(dict):
             # note, all msgs require their type to be included: eg. {'type': 'quitting'}
             'joinRequest': {
                 'game': ['str', 1, 32],
-                'playerDisplayName': ['str', 1, 16]
+                'playerDisplayName': ['str', 1, 16],
+                'codecs_o': 'list',  # codec names client can use (see engine.codec)
+                'zdictChecksum_o': 'int',
+                'windowWidth_o': 'int',  # size of client's window so server knows what player can see.
+                'windowHeight_o': 'int'
                 },
             'joinReply': {
                 'playerNumber': 'int',
                 'serverSec': 'float',
-                'testMode': 'bool'
+                'testMode': 'bool',
+                'codec_o': ['str', 1, 16],
+                'sendFps_o': 'int'  # only present if step msgs are sent less often than the server steps.
                 },
             'quitting': {},
             'playerMove': {
@@ -53,13 +63,23 @@ class Messages(dict):
                 'moveDestY': 'int'
                 },
             'playerAction': {},
+            'windowSize': {
+                'windowWidth': 'int',  # new size of client's window after the player resized it.
+                'windowHeight': 'int'
+                },
             'step': {
                 'gameSec': 'float',
                 'mapName': ['str', 1, 32],
                 'layerVisabilityMask': 'int',
                 'sprites': 'list',
                 'actionText_o': ['str', 1, 256],
-                'marqueeText_o': ['str', 1, 512]
+                'marqueeText_o': ['str', 1, 512],
+                'stepNum_o': 'int',  # only sent when server is sending step deltas (see engine.stepdelta)
+                'baseStepNum_o': 'int',
+                'spriteStrings_o': 'list'  # only sent when sprites are in compact form (see engine.spritecodec)
+                },
+            'stepAck': {
+                'stepNum': 'int'
                 },
             'Error': {
                 'result': 'str'
@@ -104,11 +124,47 @@ class Messages(dict):
             'udpPunchThrough': {}
             }
 
+        self['spriteFields'] = {
+            # sprite field names and their types. Add new fields to the end so existing fields keep their tag.
+            'name': 'str',
+            'type': 'str',
+            'mapName': 'str',
+            'tilesetName': 'str',
+            'collisionType': 'str',
+            'x': 'pos',
+            'y': 'pos',
+            'anchorX': 'pos',
+            'anchorY': 'pos',
+            'width': 'raw',
+            'height': 'raw',
+            'gid': 'raw',
+            'tilesetTileNumber': 'raw',
+            'rotation': 'raw',
+            'playerNumber': 'raw',
+            'labelText': 'str',
+            'speechText': 'str',
+            'checkLocationOn': 'strs',
+            'polyline': 'points',
+            'polygon': 'points',
+            'holding': 'sprite',
+            'move': 'raw',
+            'action': 'raw'
+            }
+
+        self['validators'] = {}  # {msgType: validator, ...} see compileValidator()
+
     def __str__(self):
         return engine.log.objectToStr(self)
 
-    def isValidMsg(self, msg):
-        """ Returns True if msg is a valid message as defined by messageDefinitions, otherwise returns False. """
+    def isValidMsg(self, msg, trusted=False):
+        """ Returns True if msg is a valid message as defined by messageDefinitions, otherwise returns False.
+
+        Args:
+            msg (dict): The message to check.
+            trusted (bool): If True then msg was built by this program (not received from
+                the network) so only check that it has the correct fields and skip checking
+                the type and range of each field value.
+        """
 
         if not isinstance(msg, dict):
             log("Msg is type " + str(type(msg)) + " but must be dict type: " + str(msg), "ERROR")
@@ -117,61 +173,102 @@ class Messages(dict):
             log("Msg does not contain 'type' key: " + str(msg), "ERROR")
             return False
 
-        unvalidedFields = list(msg.keys())
-        # type is validated below as part of loop so does not need specific validation.
-        unvalidedFields.remove('type')
+        validator = self['validators'].get(msg['type'])
+        if validator is None:
+            if not isinstance(msg['type'], str) or msg['type'] not in self['messageDefinitions']:
+                log("Msg 'type' key has value '" + str(msg['type']) + "' which is not known: " + str(msg), "ERROR")
+                return False
+            validator = self.compileValidator(msg['type'])
+            self['validators'][msg['type']] = validator
+
+        error = validator(msg, trusted)
+        if error:
+            log(error + ": " + str(msg), "ERROR")
+            return False
+        return True
+
+    def compileValidator(self, msgType):
+        """Return a function that validates msgs of type msgType.
+
+        The function is built from self['messageDefinitions'][msgType] so the
+        msg definition only needs to be interpreted once rather than for every
+        msg. Validators are compiled the first time each msg type is validated,
+        so subclasses can add to messageDefinitions after calling __init__().
+
+        The function has the form validator(msg, trusted) and returns None if msg
+        is valid or a description (str) of the first problem found.
+        """
+        required = []  # [(fld, types, min, max), ...]
+        optional = []  # [(fld, types, min, max), ...]
         # msgId and replyData are always optional and have no specific format. So they are always valid if present.
-        if 'msgID' in unvalidedFields:
-            unvalidedFields.remove('msgID')
-        if 'replyData' in unvalidedFields:
-            unvalidedFields.remove('replyData')
-
-        for msgtype, msgspec in self['messageDefinitions'].items():
-            if msgtype == msg['type']:
-                for fld, fldspec in msgspec.items():
-                    if fld.endswith('_o'):
-                        # remove magic suffix marking field as optional
-                        fld = fld.rstrip('_o')
-                        if fld not in msg:
-                            # optional field is not present, which is valid.
-                            continue
-                    elif fld not in msg:
-                        log("Msg does not contain required '" + fld + "' key: " + str(msg), "ERROR")
-                        return False
-                    if isinstance(fldspec, list):
-                        if not isinstance(msg[fld], eval(fldspec[0])):
-                            log("Msg '" + fld + "' key has value of type " + str(type(msg[fld])) +
-                                " but expected " + fldspec[0] + ": " + str(msg), "ERROR")
-                            return False
-                        if fldspec[0] is 'str':
-                            if len(msg[fld]) < fldspec[1] or len(msg[fld]) > fldspec[2]:
-                                log("Msg '" + fld + "' key has a string value " + str(msg[fld]) +
-                                    " with length out of range [" + str(fldspec[1]) + "," +
-                                    str(fldspec[2]) + "] : " + str(msg), "ERROR")
-                                return False
-                        elif msg[fld] < fldspec[1] or msg[fld] > fldspec[2]:
-                            log("Msg '" + fld + "' key has a value " + str(msg[fld]) +
-                                " which is out of range [" + str(fldspec[1]) + "," +
-                                str(fldspec[2]) + "] : " + str(msg), "ERROR")
-                            return False
-                    else:
-                        if not isinstance(msg[fld], eval(fldspec)):
-                            log("Msg '" + fld + "' key has value of type " + str(type(msg[fld])) +
-                                " but expected " + fldspec + ": " + str(msg), "ERROR")
-                            return False
-                    unvalidedFields.remove(fld)
-                # All fields defined for message type have now been examined and are valid
-                if len(unvalidedFields):
-                    # message has fields it should not have.
-                    log("Msg contains field(s) " + str(unvalidedFields) +
-                        " which is not defined for message type " + msg['type'] + ": " + str(msg), "ERROR")
-                    for fld in unvalidedFields:
-                        if fld.endswith('_o'):
-                            log("Optional message fields should not include '_o' suffix in field name.", "WARNING")
-                            break
-                    return False
-                else:
-                    # message is valid and has no extra fields.
-                    return True
-        log("Msg 'type' key has value '" + str(msg['type']) + "' which is not known: " + str(msg), "ERROR")
-        return False
+        allowed = {'type', 'msgID', 'replyData'}
+        for fld, fldspec in self['messageDefinitions'][msgType].items():
+            if isinstance(fldspec, list):
+                fldType, fldMin, fldMax = fldspec
+            else:
+                fldType, fldMin, fldMax = fldspec, None, None
+            spec = (fldType, parseTypes(fldType), fldMin, fldMax)
+            if fld.endswith('_o'):
+                # remove magic suffix marking field as optional
+                fld = fld[:-2]
+                optional.append((fld,) + spec)
+            else:
+                required.append((fld,) + spec)
+            allowed.add(fld)
+        requiredNames = frozenset(fld for fld, *spec in required)
+        allowed = frozenset(allowed)
+        checks = required + optional
+
+        def validator(msg, trusted):
+            keys = msg.keys()
+            if not requiredNames <= keys:
+                missing = sorted(requiredNames - keys)
+                return "Msg does not contain required '" + missing[0] + "' key"
+            if not keys <= allowed:
+                extra = sorted(keys - allowed)
+                error = "Msg contains field(s) " + str(extra) + " which is not defined for message type " + msgType
+                if any(fld.endswith('_o') for fld in extra):
+                    error += ". Optional message fields should not include '_o' suffix in field name"
+                return error
+            if trusted:
+                return None
+            for fld, fldType, types, fldMin, fldMax in checks:
+                if fld not in msg:
+                    continue  # optional field is not present, which is valid.
+                value = msg[fld]
+                if not isinstance(value, types):
+                    return "Msg '" + fld + "' key has value of type " + str(type(value)) + " but expected " + fldType
+                if fldMin is None:
+                    continue
+                if fldType == 'str':
+                    if len(value) < fldMin or len(value) > fldMax:
+                        return "Msg '" + fld + "' key has a string value " + str(value) + \
+                            " with length out of range [" + str(fldMin) + "," + str(fldMax) + "]"
+                elif value < fldMin or value > fldMax:
+                    return "Msg '" + fld + "' key has a value " + str(value) + \
+                        " which is out of range [" + str(fldMin) + "," + str(fldMax) + "]"
+            return None
+
+        return validator
+
+
+# Type names that may be used in messageDefinitions.
+FIELD_TYPES = {
+    'int': int,
+    'float': float,
+    'bool': bool,
+    'str': str,
+    'list': list,
+    'dict': dict,
+    'tuple': tuple,
+    'bytes': bytes
+    }
+
+
+def parseTypes(fldType):
+    """Return the type or tuple of types named by fldType (e.g. 'int' or '(int,float)')."""
+    names = fldType.strip('() ').split(',')
+    types = tuple(FIELD_TYPES[name.strip()] for name in names)
+    if len(types) == 1:
+        return types[0]
+    return types
@@ -0,0 +1,150 @@
+"""Network Condition Emulator
+
+This module is used by engine.network.Socket to make a fast local network
+behave like a slow or unreliable one so network code can be tested and
+tuned on one computer. It only affects datagrams that are sent, so to
+emulate both directions between a server and client enable it on both.
+
+Each datagram passed to NetEmulator.send() is, in this order:
+
+    dropped: with probability loss (%).
+    duplicated: with probability duplicate (%). Each copy is then
+        delayed independently.
+    rate limited: if rate (kbit/s) is not 0 then datagrams wait for the
+        previous ones to finish sending. Datagrams that would wait longer
+        than MAX_QUEUE_SEC are dropped, like a full router queue.
+    delayed: by latency (ms) plus a random 0 to jitter (ms).
+    reordered: with probability reorder (%) held back an extra
+        REORDER_SEC so datagrams sent after it arrive first.
+
+All random choices come from one random.Random(seed) so a run with the same
+seed and the same datagrams drops and delays the same datagrams.
+"""
+
+import heapq
+import random
+
+import engine.time as time
+
+
+class NetEmulator(dict):
+    """NetEmulator Class
+
+    Holds datagrams until the emulated network would deliver them.
+    """
+
+    def __init__(self, loss=0, latency=0, jitter=0, duplicate=0, reorder=0, rate=0, seed=0):
+        """Create a NetEmulator.
+
+        Args:
+            loss (float): Percent of datagrams to drop.
+            latency (float): Milliseconds to delay every datagram.
+            jitter (float): Up to this many more milliseconds of random delay.
+            duplicate (float): Percent of datagrams to send twice.
+            reorder (float): Percent of datagrams to hold back so they arrive out of order.
+            rate (float): Bandwidth in kbit/s. 0 is no limit.
+            seed (int): Seed for the random number generator.
+        """
+        self['loss'] = loss / 100
+        self['latency'] = latency / 1000
+        self['jitter'] = jitter / 1000
+        self['duplicate'] = duplicate / 100
+        self['reorder'] = reorder / 100
+        self['rate'] = rate * 1000 / 8  # bytes per sec
+        self['seed'] = seed
+
+        self['MAX_QUEUE_SEC'] = 0.5  # drop datagrams that would wait longer than this to be sent.
+        self['REORDER_SEC'] = 0.03  # extra delay of reordered datagrams.
+
+        self['random'] = random.Random(seed)
+        self['queue'] = []  # heap of (deliverAt, seq, datagram, address)
+        self['seq'] = 0  # keeps datagrams with the same deliverAt in the order they were sent.
+        self['linkFreeAt'] = 0  # time the rate limited link finishes sending queued datagrams.
+
+        self['sent'] = 0
+        self['lost'] = 0
+        self['duplicated'] = 0
+        self['reordered'] = 0
+        self['queueDrops'] = 0
+
+    def __str__(self):
+        return (f"loss={self['loss']*100:g}% latency={self['latency']*1000:g}ms jitter={self['jitter']*1000:g}ms "
+                f"duplicate={self['duplicate']*100:g}% reorder={self['reorder']*100:g}% "
+                f"rate={self['rate']*8/1000:g}kbit/s seed={self['seed']}")
+
+    def send(self, datagram, address):
+        """Queue datagram to be sent to address when the emulated network would deliver it.
+
+        Args:
+            datagram (bytes): Bytes to send.
+            address (tuple): (ip, port)
+        """
+        rand = self['random'].random
+        if rand() < self['loss']:
+            self['lost'] += 1
+            return
+
+        copies = 1
+        if rand() < self['duplicate']:
+            copies = 2
+            self['duplicated'] += 1
+
+        now = time.perf_counter()
+        for i in range(copies):
+            sentAt = now
+            if self['rate']:
+                sentAt = max(now, self['linkFreeAt'])
+                if sentAt - now > self['MAX_QUEUE_SEC']:
+                    self['queueDrops'] += 1
+                    continue
+                sentAt += len(datagram) / self['rate']
+                self['linkFreeAt'] = sentAt
+
+            deliverAt = sentAt + self['latency'] + rand() * self['jitter']
+            if rand() < self['reorder']:
+                deliverAt += self['REORDER_SEC']
+                self['reordered'] += 1
+
+            self['seq'] += 1
+            heapq.heappush(self['queue'], (deliverAt, self['seq'], datagram, address))
+
+    def flush(self, sendto):
+        """Send all queued datagrams that are due.
+
+        Args:
+            sendto (function): Called as sendto(datagram, address) for each datagram.
+        """
+        queue = self['queue']
+        if not queue:
+            return
+        now = time.perf_counter()
+        while queue and queue[0][0] <= now:
+            deliverAt, seq, datagram, address = heapq.heappop(queue)
+            self['sent'] += 1
+            sendto(datagram, address)
+
+    def getStats(self):
+        """Return str of emulator stats."""
+        return \
+            "\n    Emulated Network: " + str(self) + \
+            "\n       Emulated Sent: " + str(self['sent']) + \
+            "\n       Emulated Lost: " + str(self['lost'] + self['queueDrops']) + \
+            " (" + str(self['queueDrops']) + " over rate)" + \
+            "\n Emulated Duplicated: " + str(self['duplicated']) + \
+            "\n  Emulated Reordered: " + str(self['reordered']) + \
+            "\n     Emulated Queued: " + str(len(self['queue']))
+
+
+def fromArgs(args):
+    """Return a NetEmulator set up from startserver.py/startclient.py args or None if no -emu* args were given."""
+    if not (args.emuLoss or args.emuLatency or args.emuJitter or args.emuDuplicate or args.emuReorder or args.emuRate):
+        return None
+    return NetEmulator(
+        loss=args.emuLoss,
+        latency=args.emuLatency,
+        jitter=args.emuJitter,
+        duplicate=args.emuDuplicate,
+        reorder=args.emuReorder,
+        rate=args.emuRate,
+        seed=args.emuSeed
+        )
@@ -1,7 +1,10 @@
 """Send/Receive Messages Over Network"""
 
 import socket
-import zlib
+import select
+import asyncio
+import struct
+import sys
 import random
 import engine.time as time
 import re
@@ -10,6 +13,7 @@ import msgpack
 
 import engine.log
 from engine.log import log
+import engine.codec
 
 
 ########################################################
@@ -24,7 +28,9 @@ class Socket:
     """
 
     def __init__(self, messages, msgProcessor, sourceIP, sourcePort,
-                 sourcePortSearch=False, destinationIP='127.0.0.1', destinationPort=20000):
+                 sourcePortSearch=False, destinationIP='127.0.0.1', destinationPort=20000,
+                 recvBufferSize=1048576, sendBufferSize=1048576, codec=None, mtu=1400, netEmulator=None,
+                 reusePort=False):
         """Create and bind UDP socket.
 
         Args:
@@ -41,6 +47,20 @@ class Socket:
                 port that is available.
             destinationIP (str): set the default IP to send messages to.
             destinationPort (int): set the default port to send messages to.
+            recvBufferSize (int): Requested size in bytes of the OS receive buffer (SO_RCVBUF). The OS
+                may limit this to a smaller size.
+            sendBufferSize (int): Requested size in bytes of the OS send buffer (SO_SNDBUF). The OS
+                may limit this to a smaller size.
+            codec (engine.codec.Codec): Default codec used to encode msgs being sent. Also provides
+                the zdict used to decode received msgs. If None then zlib is used.
+            mtu (int): Largest datagram that will be sent. Larger msgs are sent as fragments. Should
+                be less than the network MTU minus IP and UDP headers (28 bytes) so the network
+                does not need to fragment datagrams.
+            netEmulator (engine.netemu.NetEmulator): If not None then all datagrams are sent
+                through it to emulate a slower or less reliable network.
+            reusePort (bool): Allow other processes to bind the same sourcePort (SO_REUSEPORT). The OS
+                then spreads incoming datagrams across them, always sending datagrams from the same
+                ip:port to the same process. Not available on Windows.
 
         Returns:
             Socket object.
@@ -66,12 +86,24 @@ class Socket:
         self.sendRecvMessageTime = 0  # Total time in sendRecvMessage
         self.sendTypes = {}
         self.recvTypes = {}
+        self.recvInvalid = 0  # Number of datagrams received that could not be decoded or were not valid msgs.
+        self.sendErrors = 0  # Number of batched sends that the OS refused.
+        self.kernelDrops = None  # Number of datagrams the OS dropped because the receive buffer was full.
+        self.fragmentedSent = 0  # Number of msgs sent as fragments.
+        self.fragmentsSent = 0  # Number of fragments sent.
+        self.fragmentedRecv = 0  # Number of msgs reassembled from fragments.
+        self.fragmentedLost = 0  # Number of msgs dropped because not all fragments arrived.
+        self.msgsCoalesced = 0  # Number of msgs skipped because a newer msg of the same type replaced them.
+        self.msgsDeferred = 0  # Number of times a msg was left for the next recvReplyMsgs() call.
+        self.msgsDropped = 0  # Number of msgs dropped because their sender had too many waiting.
 
         self.sendrecvDelay = 0.1
 
         self.sourceIP = sourceIP
         log("Creating socket with sourceIP=" + sourceIP + ", sourcePort=" + str(sourcePort), "VERBOSE")
         self.s = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        if reusePort:
+            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         if sourcePortSearch:
             portRange = 100  # try the source port provided and 100 ports above it until an available port is found.
@@ -99,9 +131,62 @@ class Socket:
         self.s.settimeout(0)
         self.destinationIP = resolve(destinationIP)
         self.destinationPort = destinationPort
+
+        for opt, size in ((socket.SO_RCVBUF, recvBufferSize), (socket.SO_SNDBUF, sendBufferSize)):
+            try:
+                self.s.setsockopt(socket.SOL_SOCKET, opt, size)
+            except OSError as e:
+                log(f"Could not set socket buffer size to {size}: {e}", "WARNING")
+        log(f"Socket buffer sizes: recv={self.s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} "
+            f"send={self.s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)}", "VERBOSE")
+
+        # On Linux, ask the OS to tell us how many datagrams it has dropped with each recv.
+        self.ancBufferSize = 0
+        if sys.platform.startswith('linux'):
+            try:
+                self.s.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.ancBufferSize = socket.CMSG_SPACE(4)
+                self.kernelDrops = 0
+            except (OSError, AttributeError):
+                pass
+
+        # All datagrams are received into the same preallocated buffer.
         self.bufferSize = 256000
+        self.recvBuffer = bytearray(self.bufferSize)
+        self.recvView = memoryview(self.recvBuffer)
+
+        self.sendBatch = None  # list of (networkbytes, address) while a send batch is open.
+
+        # fragmentation of msgs larger than one datagram.
+        self.mtu = mtu
+        self.fragmentID = 0  # id of last msg sent as fragments.
+        self.fragments = {}  # {(ipport, fragmentID): {'count':, 'parts': {index: bytes}, 'expires':}, ...}
+        self.FRAGMENT_TIMEOUT = 1.0  # secs to wait for all fragments of a msg.
+        self.MAX_INCOMPLETE = 64  # max number of partly received msgs kept.
+
+        if codec is None:
+            codec = engine.codec.Codec()
+        self.codec = codec  # default codec
+        self.codecs = {}  # {ipport: codec, ...} codecs agreed on with specific destinations.
+        self.peers = {}  # {(ip, port): Peer, ...} destinations that can be sent to with sendPeerMessage().
+
+        self.netEmulator = netEmulator
+        if self.netEmulator:
+            log(f"Emulating network: {self.netEmulator}")
         random.seed()
         self.msgID = random.randrange(0, 65000, 1)
+        self.requests = {}  # {msgID: request, ...} requests sent by sendRequest() still waiting for a reply.
+        self.pendingMsgs = []  # [(msg, ip, port), ...] received but not processed by recvReplyMsgs() yet.
+
+        # limits on the msgs processed by each recvReplyMsgs() call (see setInputLimits())
+        self.coalesceTypes = set()
+        self.maxMsgsPerSender = None
+        self.msgTimeBudget = None
+
+        # asyncio mode (see startAsync())
+        self.asyncMode = False
+        self.transport = None
+        self.msgsReady = None  # asyncio.Event set when msgs are added to self.pendingMsgs
 
     def __str__(self):
         return engine.log.objectToStr(self)
@@ -143,6 +228,27 @@ class Socket:
         """ Return str of Socket stats. """
         output = "\n\n             ====== Network Stats ======"
 
+        if self.kernelDrops is not None:
+            output += "\n     Kernel Dropped Msgs: " + str(self.kernelDrops)
+        output += \
+            "\n       Invalid Msgs Recv: " + str(self.recvInvalid) + \
+            "\n             Send Errors: " + str(self.sendErrors)
+        if self.fragmentedSent or self.fragmentedRecv or self.fragmentedLost:
+            output += \
+                "\n   Fragmented Msgs Sent: " + str(self.fragmentedSent) + \
+                "\n         Fragments Sent: " + str(self.fragmentsSent) + \
+                "\n   Fragmented Msgs Recv: " + str(self.fragmentedRecv) + \
+                "\n   Fragmented Msgs Lost: " + str(self.fragmentedLost)
+
+        if self.netEmulator:
+            output += self.netEmulator.getStats()
+
+        if self.msgsCoalesced or self.msgsDeferred or self.msgsDropped:
+            output += \
+                "\n         Msgs Coalesced: " + str(self.msgsCoalesced) + \
+                "\n          Msgs Deferred: " + str(self.msgsDeferred) + \
+                "\n           Msgs Dropped: " + str(self.msgsDropped)
+
         if self.sendRecvMessageCalls:
             output += \
                 "\n     sendRecvMessage Calls: " + str(self.sendRecvMessageCalls) + \
@@ -153,7 +259,7 @@ class Socket:
         for ipport in self.sent.keys():
             output += "\n\n               === To/From: " + ipport + " ==="\
                 "\n             Messages Sent: " + str(self.sent[ipport]) +\
-                "\n             Messages Recv: " + str(self.recv[ipport])
+                "\n             Messages Recv: " + str(self.recv.get(ipport, 0))
 
             if ipport in self.sendTypes:
                 output += "\n\n                Messages Sent by Type"
@@ -189,13 +295,65 @@ class Socket:
         self.destinationIP = destinationIP
         self.destinationPort = destinationPort
 
-    def serialize(self, msg):
-        return zlib.compress(msgpack.packb(msg, use_bin_type=True))
+    def setCodec(self, codec, destinationIP=None, destinationPort=None):
+        """Set the codec used to encode msgs sent to destinationIP:destinationPort.
+
+        If destinationIP and destinationPort are not provided then set the
+        default codec, which is used for all other destinations.
+
+        Args:
+            codec (engine.codec.Codec)
+            destinationIP (str)
+            destinationPort (int)
+        """
+        if destinationIP is None and destinationPort is None:
+            self.codec = codec
+        else:
+            self.codecs[formatIpPort(destinationIP, destinationPort)] = codec
+
+    def getCodec(self, destinationIP=None, destinationPort=None):
+        """Return the codec used to encode msgs sent to destinationIP:destinationPort."""
+        return self.codecs.get(formatIpPort(destinationIP, destinationPort), self.codec)
+
+    def getPeerCodec(self, peer):
+        """Return the codec used to encode msgs sent to peer (see getPeer())."""
+        return self.codecs.get(peer['ipport'], self.codec)
+
+    def serialize(self, msg, codec=None):
+        """Return msg as network bytes, encoded with codec (or the default codec)."""
+        if codec is None:
+            codec = self.codec
+        return codec.encode(msgpack.packb(msg, use_bin_type=True))
 
     def deserialize(self, b):
-        return msgpack.unpackb(zlib.decompress(b), raw=False)
+        """Return msg from network bytes created by serialize() or serializeComposite()."""
+        if b[0] == engine.codec.FLAG_COMPOSITE:
+            sharedLen = struct.unpack_from('!I', b, 1)[0]
+            msg = self.deserialize(b[5:5 + sharedLen])
+            msg.update(self.deserialize(b[5 + sharedLen:]))
+            return msg
+        return msgpack.unpackb(engine.codec.decode(b, self.codec['zdict']), raw=False)
+
+    def serializeComposite(self, shared, overlay, codec=None):
+        """Return network bytes for a msg made from a shared part and an overlay.
+
+        This allows the bulk of a msg that is sent to many destinations to be
+        serialized only once. The receiver's deserialize() merges the two parts
+        back into one msg, with fields in overlay replacing those in shared.
 
-    def sendMessage(self, msg, destinationIP=None, destinationPort=None, packedAndChecked=False):
+        Args:
+            shared (bytes): Part of the msg that has already been serialized
+                with serialize().
+            overlay (dict): Remaining fields of the msg. Must include 'type'.
+            codec (engine.codec.Codec): Codec used to encode overlay. If None then the
+                default codec is used.
+
+        Returns:
+            bytes: Suitable for sendMessage(..., packedAndChecked=True).
+        """
+        return COMPOSITE_MARKER + struct.pack('!I', len(shared)) + shared + self.serialize(overlay, codec)
+
+    def sendMessage(self, msg, destinationIP=None, destinationPort=None, packedAndChecked=False, trusted=False):
         """Send a msg over the network.
 
         Sends msg to destinationIP:destinationPort and then returns immediately.
@@ -212,11 +370,19 @@ class Socket:
         If packedAndChecked is True then msg is assumed to already be serialized
         and no other checks will be done.
 
+        If trusted is True then msg was built by this program and only its
+        fields are checked, not the type and range of their values (see
+        engine.messages.Messages.isValidMsg()).
+
+        If a send batch is open (see startSendBatch()) then msg is serialized
+        now but not sent until the batch is ended.
+
         Args:
             msg (dict): A valid message as defined in Messages object.
             destinationIP (str)
             destinationPort (int)
             packedAndChecked (bool)
+            trusted (bool)
 
         """
 
@@ -228,7 +394,7 @@ class Socket:
             destinationPort = self.destinationPort
 
         if not packedAndChecked:
-            if not self.messages.isValidMsg(msg):
+            if not self.messages.isValidMsg(msg, trusted):
                 raise SocketException("Could not send because msg is not valid format.")
             if not isValidIP(destinationIP):
                 raise SocketException("Could not send because destinationIP is not valid.")
@@ -236,13 +402,13 @@ class Socket:
                 raise SocketException("Could not send because destinationPort is not valid format.")
 
             # Convert data from python objects to network binary format
-            networkbytes = self.serialize(msg)
+            networkbytes = self.serialize(msg, self.getCodec(destinationIP, destinationPort))
         else:
             networkbytes = msg
 
-        log("Sending msg to " + destinationIP + ":" + str(destinationPort) +
-            " len=" + str(len(networkbytes)) + " bytes " + str(msg), "DEBUG")
-        self.s.sendto(networkbytes, (destinationIP, destinationPort))
+        log("Sending msg to %s:%s len=%s bytes %s", "DEBUG",
+            args=(destinationIP, destinationPort, len(networkbytes), msg))
+        self.sendBytes(networkbytes, (destinationIP, destinationPort))
 
         dest = formatIpPort(destinationIP, destinationPort)
         if dest in self.sent:
@@ -262,6 +428,223 @@ class Socket:
         else:
             self.sendTypes[dest][msgtype] = 1
 
+    def getPeer(self, destinationIP, destinationPort):
+        """Return the Peer for destinationIP:destinationPort, creating it the first time.
+
+        The destination is resolved and checked only when the Peer is created
+        so msgs can then be sent to it with sendPeerMessage() without repeating
+        that work for every msg.
+
+        Args:
+            destinationIP (str)
+            destinationPort (int)
+
+        Raises:
+            SocketException exception if the destination is not valid.
+        """
+        ip = resolve(destinationIP)
+        if not isValidIP(ip) or not isValidPort(destinationPort):
+            raise SocketException("Bad IP or Port Provided.")
+        address = (ip, destinationPort)
+        if address not in self.peers:
+            peer = Peer(ip, destinationPort)
+            self.sent.setdefault(peer['ipport'], 0)
+            peer['sendTypes'] = self.sendTypes.setdefault(peer['ipport'], {})
+            self.peers[address] = peer
+        return self.peers[address]
+
+    def sendPeerMessage(self, msg, peer, packed=False):
+        """Send a msg built by this program to peer.
+
+        This is the same as sendMessage() but is faster since msg is not
+        checked at all and the destination was already checked when peer was
+        created. Only use it for msgs that the engine builds itself, e.g. step
+        msgs.
+
+        Args:
+            msg (dict or bytes): A valid message as defined in Messages object,
+                or the msg already serialized if packed is True.
+            peer (Peer): From getPeer().
+            packed (bool): True if msg is already serialized.
+        """
+        if packed:
+            networkbytes = msg
+            msgtype = "Serialized"
+        else:
+            networkbytes = self.serialize(msg, self.getPeerCodec(peer))
+            msgtype = msg['type']
+
+        log("Sending msg to %s len=%s bytes %s", "DEBUG", args=(peer['ipport'], len(networkbytes), msg))
+        self.sendBytes(networkbytes, peer['address'])
+
+        self.sent[peer['ipport']] += 1
+        sendTypes = peer['sendTypes']
+        sendTypes[msgtype] = sendTypes.get(msgtype, 0) + 1
+
+    def sendBytes(self, networkbytes, address):
+        """Send networkbytes to address, as fragments if it is larger than self.mtu.
+
+        Each fragment starts with a header: the FLAG_FRAGMENT flag byte, the
+        fragment id of the msg (2 bytes), the fragment index (1 byte) and the
+        number of fragments (1 byte).
+        """
+        if len(networkbytes) <= self.mtu:
+            datagrams = (networkbytes,)
+        else:
+            size = self.mtu - FRAGMENT_HEADER.size
+            count = (len(networkbytes) + size - 1) // size
+            if count > 255:
+                raise SocketException(f"Could not send because msg is too large ({len(networkbytes)} bytes).")
+            self.fragmentID = (self.fragmentID + 1) % 65536
+            view = memoryview(networkbytes)
+            datagrams = [FRAGMENT_HEADER.pack(engine.codec.FLAG_FRAGMENT, self.fragmentID, i, count) +
+                         view[i * size:(i + 1) * size] for i in range(count)]
+            self.fragmentedSent += 1
+            self.fragmentsSent += count
+
+        for datagram in datagrams:
+            if self.sendBatch is not None:
+                self.sendBatch.append((datagram, address))
+            elif self.netEmulator:
+                self.netEmulator.send(datagram, address)
+            else:
+                self.s.sendto(datagram, address)
+        if self.sendBatch is None and self.netEmulator:
+            self.netEmulator.flush(self.sendDatagram)
+
+    def addFragment(self, data, address):
+        """Store the fragment in data (bytes-like).
+
+        Returns:
+            bytes or None: The complete msg if this was the last fragment
+                needed, otherwise None.
+        """
+        flag, fragmentID, index, count = FRAGMENT_HEADER.unpack_from(data)
+        key = (formatIpPort(address[0], address[1]), fragmentID)
+        now = time.perf_counter()
+
+        if key not in self.fragments:
+            # forget msgs that will never be completed.
+            for k in [k for k, f in self.fragments.items() if f['expires'] < now]:
+                del self.fragments[k]
+                self.fragmentedLost += 1
+            while len(self.fragments) >= self.MAX_INCOMPLETE:
+                del self.fragments[next(iter(self.fragments))]  # oldest
+                self.fragmentedLost += 1
+            self.fragments[key] = {'count': count, 'parts': {}, 'expires': now + self.FRAGMENT_TIMEOUT}
+
+        f = self.fragments[key]
+        if count != f['count'] or index >= count:
+            return None
+        f['parts'][index] = bytes(data[FRAGMENT_HEADER.size:])
+        if len(f['parts']) < count:
+            return None
+
+        del self.fragments[key]
+        self.fragmentedRecv += 1
+        return b''.join(f['parts'][i] for i in range(count))
+
+    def startSendBatch(self):
+        """Hold all msgs sent by sendMessage() until endSendBatch() is called.
+
+        This allows a burst of msgs (e.g. one step msg to every player) to be
+        prepared first and then sent to the OS together in a tight loop.
+        """
+        if self.sendBatch is None:
+            self.sendBatch = []
+
+    def endSendBatch(self):
+        """Send all msgs held since startSendBatch() and stop batching."""
+        batch = self.sendBatch
+        self.sendBatch = None
+        if not batch:
+            return
+        if self.netEmulator:
+            for networkbytes, address in batch:
+                self.netEmulator.send(networkbytes, address)
+            self.netEmulator.flush(self.sendDatagram)
+            return
+        sendto = self.s.sendto
+        for networkbytes, address in batch:
+            try:
+                sendto(networkbytes, address)
+            except OSError as e:
+                self.sendErrors += 1
+                log(f"Could not send msg to {formatIpPort(address[0], address[1])}: {e}", "VERBOSE")
+
+    def sendDatagram(self, datagram, address):
+        """Send one datagram to address, counting rather than raising send errors."""
+        try:
+            self.s.sendto(datagram, address)
+        except OSError as e:
+            self.sendErrors += 1
+            log(f"Could not send msg to {formatIpPort(address[0], address[1])}: {e}", "VERBOSE")
+
+    def recvInto(self):
+        """Receive one datagram into self.recvBuffer.
+
+        Returns:
+            nbytes (int): Number of bytes received.
+            address (tuple): (ip, port) of sender.
+
+        Raises:
+            Same exceptions as socket.recvfrom_into()
+        """
+        if self.ancBufferSize:
+            nbytes, ancdata, flags, address = self.s.recvmsg_into([self.recvBuffer], self.ancBufferSize)
+            for level, ancType, data in ancdata:
+                if level == socket.SOL_SOCKET and ancType == SO_RXQ_OVFL and len(data) >= 4:
+                    # OS reports the total number of drops since the socket was created.
+                    self.kernelDrops = struct.unpack('=I', data[:4])[0]
+            return nbytes, address
+        return self.s.recvfrom_into(self.recvBuffer)
+
+    def decodeMessage(self, data, address):
+        """Return msg decoded from data (bytes-like) or None if msg is not valid.
+
+        If the bytes are a fragment then None is returned until all fragments of
+        the msg have been received.
+
+        Also updates receive stats.
+        """
+        ip = address[0]
+        port = address[1]
+        nbytes = len(data)
+        try:
+            if nbytes and data[0] == engine.codec.FLAG_FRAGMENT:
+                networkbytes = self.addFragment(data, address)
+                if networkbytes is None:
+                    return None  # msg is not complete yet.
+            else:
+                networkbytes = data
+            # Convert data from network binary format to python objects
+            msg = self.deserialize(networkbytes)
+        except Exception as e:
+            self.recvInvalid += 1
+            log("Could not decode msg from " + ip + ":" + str(port) + " len=" + str(nbytes) + ": " + str(e), "ERROR")
+            return None
+
+        log("Received msg from %s:%s len=%s bytes %s", "DEBUG", args=(ip, port, nbytes, msg))
+
+        ipport = formatIpPort(ip, port)
+        if ipport in self.recv:
+            self.recv[ipport] += 1
+        else:
+            self.recv[ipport] = 1
+
+        if not self.messages.isValidMsg(msg):
+            self.recvInvalid += 1
+            return None
+
+        if ipport not in self.recvTypes:
+            self.recvTypes[ipport] = {}
+        if msg['type'] in self.recvTypes[ipport]:
+            self.recvTypes[ipport][msg['type']] += 1
+        else:
+            self.recvTypes[ipport][msg['type']] = 1
+
+        return msg
+
     def recvMessage(self):
         """
         Check the socket receive buffer and returns message, ip, and port only
@@ -286,28 +669,11 @@ class Socket:
             port (int): The Port number that sent the message
 
         """
-        try:
-            bytesAddressPair = self.s.recvfrom(self.bufferSize)
-            # Convert data from network binary format to python objects
-            msg = self.deserialize(bytesAddressPair[0])
-            ip = bytesAddressPair[1][0]
-            port = bytesAddressPair[1][1]
-            log("Received msg from " + ip + ":" + str(port) + " len=" +
-                str(len(bytesAddressPair[0])) + " bytes " + str(msg), "DEBUG")
-
-            ipport = formatIpPort(ip, port)
-            if ipport in self.recv:
-                self.recv[ipport] += 1
-            else:
-                self.recv[ipport] = 1
-
-            if ipport not in self.recvTypes:
-                self.recvTypes[ipport] = {}
-            if msg['type'] in self.recvTypes[ipport]:
-                self.recvTypes[ipport][msg['type']] += 1
-            else:
-                self.recvTypes[ipport][msg['type']] = 1
+        if self.netEmulator:
+            self.netEmulator.flush(self.sendDatagram)  # send datagrams the emulated network has delivered.
 
+        try:
+            nbytes, address = self.recvInto()
         except (BlockingIOError, socket.timeout):
             # There was no data in the receive buffer.
             raise SocketException("Receive buffer empty.")
@@ -317,10 +683,46 @@ class Socket:
             raise SocketException(
                 "The destination ip:port returned ICMP destination unreachable. Is the destination running?")
 
-        if not self.messages.isValidMsg(msg):
-            raise SocketException("Received message invalid format.")
+        msg = self.decodeMessage(self.recvView[:nbytes], address)
+        if msg is None:
+            raise SocketException("Received message invalid format or incomplete.")
+
+        return msg, address[0], address[1]
+
+    def recvMessages(self, maxMsgs=None):
+        """Return all valid msgs that are immediately ready to receive.
+
+        Unlike recvMessage(), invalid msgs are skipped (and counted in
+        getStats()) rather than ending the receive.
 
-        return msg, ip, port
+        Args:
+            maxMsgs (int): Stop after this many datagrams have been read. If None
+                then read until the receive buffer is empty.
+
+        Returns:
+            list: [(msg, ip, port), ...]
+        """
+        msgQ = []
+        if self.netEmulator:
+            self.netEmulator.flush(self.sendDatagram)  # send datagrams the emulated network has delivered.
+        if self.asyncMode:
+            return msgQ  # the event loop receives datagrams and passes them to datagramReceived().
+        count = 0
+        while maxMsgs is None or count < maxMsgs:
+            try:
+                nbytes, address = self.recvInto()
+            except (BlockingIOError, socket.timeout):
+                break  # receive buffer is empty.
+            except ConnectionResetError:
+                # Windows raises this when it gets back an ICMP destination unreachable packet
+                log("The destination ip:port returned ICMP destination unreachable. Is the destination running?",
+                    "WARNING")
+                continue
+            count += 1
+            msg = self.decodeMessage(self.recvView[:nbytes], address)
+            if msg is not None:
+                msgQ.append((msg, address[0], address[1]))
+        return msgQ
 
     def sendRecvMessage(self, msg, destinationIP=None, destinationPort=None,
                         retries=10, delay=None, delayMultiplier=1.2):
@@ -357,6 +759,9 @@ class Socket:
             SocketException exception if the msg does not hae a valid format.
         """
 
+        if self.asyncMode:
+            raise SocketException("sendRecvMessage() would block the asyncio event loop. Use sendRequest().")
+
         startTime = time.perf_counter()
         self.sendRecvMessageCalls += 1
 
@@ -374,11 +779,7 @@ class Socket:
 
         remaining = retries
 
-        self.msgID = self.msgID + 1
-        if self.msgID > 65000:
-            self.msgID = 0
-
-        msg['msgID'] = self.msgID
+        msg['msgID'] = self.nextMsgID()
 
         gotReply = False
         sendMessage = 0
@@ -404,6 +805,9 @@ class Socket:
                         isinstance(replyMsg, dict) and \
                         'msgID' in replyMsg and replyMsg['msgID'] == msg['msgID']:
                     gotReply = True
+                else:
+                    # keep other msgs for the next recvReplyMsgs()
+                    self.pendingMsgs.append((replyMsg, ip, port))
 
         self.s.settimeout(0)
 
@@ -422,6 +826,215 @@ class Socket:
         self.sendRecvMessageTime += time.perf_counter() - startTime
         return replyMsg
 
+    def nextMsgID(self):
+        """Return a new msgID (int) for a msg that expects a reply."""
+        self.msgID = self.msgID + 1
+        if self.msgID > 65000:
+            self.msgID = 0
+        while self.msgID in self.requests:
+            self.msgID = self.msgID + 1 if self.msgID < 65000 else 0
+        return self.msgID
+
+    def sendRequest(self, msg, destinationIP=None, destinationPort=None, callback=None,
+                    retries=10, delay=None, delayMultiplier=1.2):
+        """Send msg and return immediately. The reply is delivered later.
+
+        sendRequest is the asynchronous form of sendRecvMessage(). msg is resent
+        (with the delay growing by delayMultiplier each time) until a reply is
+        received or retries have been used up. Resends and replies are handled by
+        recvReplyMsgs() so the caller's main loop keeps running while waiting.
+
+        When the request is finished callback(reply) is called. reply is the
+        reply msg (without msgID), which may be of type "Error", or None if no
+        reply was received.
+
+        If destinationIP or destinationPort is not provided then the default will
+        be used (see setDestinationAddress()).
+
+        Args:
+            msg (dict): A valid message as defined in Messages object.
+            destinationIP (str)
+            destinationPort (int)
+            callback (function): Called with the reply. May be None.
+            retries (int): The number of times to send msg until reply is received.
+            delay (float): How long to wait before the first retry.
+            delayMultiplier (float): How much longer or shorter to wait
+                between each attempted retry.
+
+        Returns:
+            dict: The request. request['done'] becomes True and request['reply'] is set when
+                the request is finished, so the request can also be polled.
+
+        Raises:
+            SocketException exception if the msg does not have a valid format.
+        """
+        if destinationIP is None:
+            destinationIP = self.destinationIP
+        destinationIP = resolve(destinationIP)
+
+        if destinationPort is None:
+            destinationPort = self.destinationPort
+
+        if delay is None:
+            delay = self.sendrecvDelay
+
+        msg['msgID'] = self.nextMsgID()
+        request = {
+            'msg': msg,
+            'ip': destinationIP,
+            'port': destinationPort,
+            'callback': callback,
+            'remaining': retries - 1,
+            'delay': delay * delayMultiplier,
+            'delayMultiplier': delayMultiplier,
+            'resendAt': time.perf_counter() + delay,
+            'done': False,
+            'reply': None
+            }
+        self.sendMessage(msg, destinationIP, destinationPort)
+        self.requests[msg['msgID']] = request
+        return request
+
+    def pumpRequests(self):
+        """Resend requests that are due and give up on requests that have run out of retries."""
+        if not self.requests:
+            return
+        now = time.perf_counter()
+        for msgID, request in list(self.requests.items()):
+            if request['resendAt'] > now:
+                continue
+            if request['remaining'] <= 0:
+                del self.requests[msgID]
+                log(f"Failed to get reply to {request['msg']['type']} msg sent to "
+                    f"{formatIpPort(request['ip'], request['port'])}.", "VERBOSE")
+                self.finishRequest(request, None)
+                continue
+            try:
+                self.sendMessage(request['msg'], request['ip'], request['port'])
+            except Exception as e:
+                log(str(e), "ERROR")
+            self.sendRecvMessageResends += 1
+            request['remaining'] -= 1
+            request['resendAt'] = now + request['delay']
+            request['delay'] *= request['delayMultiplier']
+
+    def finishRequest(self, request, reply):
+        """Record reply in request and call the request callback."""
+        request['done'] = True
+        request['reply'] = reply
+        if request['callback']:
+            try:
+                request['callback'](reply)
+            except Exception as e:
+                log(f"Request callback failed: {type(e)} {e}", "ERROR")
+
+    async def startAsync(self):
+        """Switch socket to asyncio mode.
+
+        From now on datagrams are received by the running asyncio event loop
+        (see SocketProtocol) rather than by reading the socket in
+        recvMessages(). recvReplyMsgs() still processes msgs the same way.
+        sendRecvMessage() can't be used in asyncio mode, use sendRequest().
+        """
+        loop = asyncio.get_running_loop()
+        self.msgsReady = asyncio.Event()
+        self.transport, protocol = await loop.create_datagram_endpoint(lambda: SocketProtocol(self), sock=self.s)
+        self.asyncMode = True
+
+    def datagramReceived(self, data, address):
+        """Decode datagram received by the asyncio event loop and hold it for recvReplyMsgs()."""
+        msg = self.decodeMessage(data, address)
+        if msg is not None:
+            self.pendingMsgs.append((msg, address[0], address[1]))
+            self.msgsReady.set()
+
+    def waitForData(self, timeout):
+        """Wait until a datagram can be received, or timeout secs have passed, without busy waiting.
+
+        Returns:
+            bool: True if there is something for recvReplyMsgs() to process.
+        """
+        if self.pendingMsgs:
+            return True
+        if self.netEmulator and self.netEmulator['queue']:
+            # wake up in time to send datagrams the emulated network is holding.
+            timeout = min(timeout, max(0, self.netEmulator['queue'][0][0] - time.perf_counter()))
+        readable, writable, errors = select.select([self.s], [], [], timeout)
+        return bool(readable)
+
+    async def waitForMsgs(self, timeout=None):
+        """Wait (in asyncio mode) until msgs are ready for recvReplyMsgs() or timeout secs have passed."""
+        if not self.pendingMsgs:
+            try:
+                await asyncio.wait_for(self.msgsReady.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.msgsReady.clear()
+
+    def setInputLimits(self, coalesceTypes=None, maxMsgsPerSender=None, timeBudget=None):
+        """Limit the msgs processed by each call to recvReplyMsgs().
+
+        This stops one sender that floods the socket from using all the time
+        between steps.
+
+        Args:
+            coalesceTypes (set): Msg types where only the newest msg from each sender
+                matters (e.g. the player's latest move destination). Older msgs of these
+                types from the same sender are skipped. Msgs with a msgID are never skipped.
+            maxMsgsPerSender (int): Most msgs processed from one sender per call. The rest
+                wait for the next call. None is no limit.
+            timeBudget (float): Secs to spend processing msgs per call. Once used up the rest
+                of the msgs wait for the next call. None is no limit.
+        """
+        self.coalesceTypes = set(coalesceTypes) if coalesceTypes is not None else set()
+        self.maxMsgsPerSender = maxMsgsPerSender
+        self.msgTimeBudget = timeBudget
+
+    def limitMsgs(self, msgQ):
+        """Apply the limits from setInputLimits() to msgQ.
+
+        Args:
+            msgQ (list): [(msg, ip, port), ...] oldest first.
+
+        Returns:
+            list: msgs from msgQ to process now, oldest first. Msgs over the
+                per sender limit are added to self.pendingMsgs.
+        """
+        coalesceTypes = self.coalesceTypes
+        if coalesceTypes:
+            newest = set()
+            kept = []
+            for item in reversed(msgQ):
+                msg, ip, port = item
+                if msg['type'] in coalesceTypes and 'msgID' not in msg:
+                    key = (ip, port, msg['type'])
+                    if key in newest:
+                        self.msgsCoalesced += 1
+                        continue
+                    newest.add(key)
+                kept.append(item)
+            kept.reverse()
+            msgQ = kept
+
+        maxMsgs = self.maxMsgsPerSender
+        if maxMsgs:
+            counts = {}
+            now = []
+            for item in msgQ:
+                address = (item[1], item[2])
+                count = counts.get(address, 0) + 1
+                counts[address] = count
+                if count <= maxMsgs:
+                    now.append(item)
+                elif count <= maxMsgs * 4:
+                    self.pendingMsgs.append(item)
+                    self.msgsDeferred += 1
+                else:
+                    self.msgsDropped += 1  # sender is flooding faster than msgs can be processed.
+            msgQ = now
+
+        return msgQ
+
     def recvReplyMsgs(self):
         """Process all messages in socket recv buffer.
 
@@ -433,20 +1046,39 @@ class Socket:
 
         if the callback method returns a reply msg then send the
         reply msg back to the IP/Port that send us the message.
+
+        Replies to requests sent with sendRequest() are passed to the request's
+        callback instead and requests waiting for a reply are resent if needed.
+
+        The msgs processed may be limited (see setInputLimits()).
         """
-        msgQ = []
-        more = True
-        while more:
-            try:
-                msgQ.append(self.recvMessage())
-            except SocketException as e:
-                # BUG this assumes this exception is only thrown if buffer is
-                # empty but it is also thrown if an invalid msg is received.
-                more = False
-            except Exception as e:
-                log(str(type(e)) + " " + str(e), "ERROR")
-                more = False
-        for msg, ip, port in msgQ:
+        msgQ = self.pendingMsgs
+        self.pendingMsgs = []
+        try:
+            msgQ += self.recvMessages()
+        except Exception as e:
+            log(str(type(e)) + " " + str(e), "ERROR")
+        if self.coalesceTypes or self.maxMsgsPerSender:
+            msgQ = self.limitMsgs(msgQ)
+
+        stopAt = None
+        if self.msgTimeBudget is not None:
+            stopAt = time.perf_counter() + self.msgTimeBudget
+        for i, (msg, ip, port) in enumerate(msgQ):
+            if stopAt is not None and time.perf_counter() > stopAt:
+                # out of time so leave the rest for next time, ahead of any newer msgs.
+                self.pendingMsgs[:0] = msgQ[i:]
+                self.msgsDeferred += len(msgQ) - i
+                break
+
+            if 'msgID' in msg and msg['msgID'] in self.requests:
+                request = self.requests[msg['msgID']]
+                if request['ip'] == ip and request['port'] == port:
+                    del self.requests[msg['msgID']]
+                    del msg['msgID']
+                    self.finishRequest(request, msg)
+                    continue
+
             methodName = "msg" + msg['type'][:1].capitalize() + msg['type'][1:]
             if methodName not in self.msgProcessorMethods:
                 log(f"Cannot process msg of type {msg['type']}. No {methodName} method is found in msgProcessor.", "WARNING")
@@ -464,11 +1096,53 @@ class Socket:
                 except Exception as e:
                     log(str(e), "ERROR")
 
+        self.pumpRequests()
+
 
 class SocketException(Exception):
     """Raised by the Socket class."""
     pass
 
+
+class Peer(dict):
+    """Peer Class
+
+    A destination that has already been resolved and checked (see
+    Socket.getPeer()) so msgs can be sent to it quickly with
+    Socket.sendPeerMessage().
+    """
+
+    def __init__(self, ip, port):
+        self['ip'] = ip
+        self['port'] = port
+        self['address'] = (ip, port)  # as needed by socket.sendto()
+        self['ipport'] = sys.intern(formatIpPort(ip, port))
+        self['sendTypes'] = {}  # {msgType: count, ...} set to the Socket's sendTypes for this ipport.
+
+
+class SocketProtocol(asyncio.DatagramProtocol):
+    """Passes datagrams received by the asyncio event loop to a Socket (see Socket.startAsync())."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def datagram_received(self, data, addr):
+        self.sock.datagramReceived(data, addr)
+
+    def error_received(self, exc):
+        # Windows reports ICMP destination unreachable this way.
+        log(f"Socket error: {exc}", "VERBOSE")
+
+
+# First byte of network bytes created by Socket.serializeComposite().
+COMPOSITE_MARKER = bytes((engine.codec.FLAG_COMPOSITE,))
+
+# flag, fragmentID, index, count (see Socket.sendBytes())
+FRAGMENT_HEADER = struct.Struct('!BHBB')
+
+# Linux socket option to report receive buffer overflow drops. Not defined by the python socket module.
+SO_RXQ_OVFL = 40
+
 ########################################################
 # Network Utility Functions
 ########################################################
@@ -1,30 +1,41 @@
 """Game Server."""
 
 import signal
+import asyncio
 import engine.time as time
 import random
 import os
+import math
+import msgpack
 
 from engine.log import log
 import engine.log
 import engine.network
 import engine.loaders
+import engine.stepdelta
+import engine.codec
+import engine.spritecodec
+import engine.netemu
+import engine.mapworker
 
 
-def quit(signal=None, frame=None):
+def quit(signalNumber=None, frame=None):
     """Quit the server process.
 
     Designed to be used with the signal module to catch and shutdown when user hits Ctrl-C
     but can also be called by other code to shutdown gracefully.
 
     Args:
-        signal (int): Signal number.
+        signalNumber (int): Signal number.
         frame : stack frame
 
     Returns:
         Does not return. Exits python.
     """
 
+    # ignore more Ctrl-C while shutting down. The main loop stops the map workers on the way out.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
     # If the socket has been created then print network stats.
     global SERVER
 
@@ -123,19 +134,91 @@ class Server(dict):
         self['serverIP'] = args.serverIP
         self['serverPort'] = args.serverPort
         self['fps'] = args.fps
+        self['sendFps'] = min(args.sendFps, args.fps) if args.sendFps else args.fps
         self['testMode'] = args.testMode
         self['busySec'] = args.busySec
+        self['stepDelta'] = args.stepDelta
+        self['stepBudget'] = args.stepBudget
+        self['areaOfInterest'] = args.areaOfInterest
+        self['compactSprites'] = args.compactSprites
+        self['codec'] = args.codec
+        self['zlibLevel'] = args.zlibLevel
+        self['zlibMin'] = args.zlibMin
+        self['mapWorkers'] = args.mapWorkers
+        self['mapWorkerPool'] = False  # engine.mapworker.MapWorkerPool, started by the first call to stepMaps().
 
         self['playerMoveCheck'] = True
         self['CONNECTOR_KEEP_ALIVE'] = 10  # send a keepalive to connector every 10 secs until all players have joined.
+        self['IDLE_STEP_SEC'] = 0.5  # secs between steps while no players have joined, unless a msg arrives.
+        self['STEP_SNAPSHOTS'] = 32  # number of step snapshots kept per map for delta encoding.
+        self['STEP_RESEND_SEC'] = 0.5  # resend step if player has not acknowledged the latest snapshot in this time.
+        self['BUDGET_DISTANCE'] = 320  # sprites this many pixels from the player gain priority half as fast.
+        self['BUDGET_TYPE_PRIORITY'] = {'player': 4}  # {sprite type: priority gained per step, ...} default is 1.
+        self['AOI_MARGIN'] = 96  # send sprites this many pixels outside what the player can see.
+        self['AOI_HYSTERESIS'] = 64  # keep sending sprites until they are this many pixels further out.
+        # msg types where only a player's newest msg each step matters. Games that change
+        # the INPUT_* values after this __init__() must call applyInputLimits().
+        self['INPUT_COALESCE_TYPES'] = {'playerMove', 'playerAction', 'windowSize'}
+        self['INPUT_MAX_PER_PLAYER'] = 8  # most msgs processed from one player each step.
+        self['INPUT_BUDGET'] = 0.25  # most time spent processing msgs each step, as a fraction of the step.
+        self['MAP_NEAR_FPS'] = 5  # maps near players are stepped this many times per sec. 0 does not step them.
+        self['MAP_NEAR_SEC'] = 10  # maps are near players for this many secs after the last player leaves or they are woken.
 
         if(self['testMode']):
             log("Server running in TEST MODE.")
 
+        if self['stepBudget'] and not self['stepDelta']:
+            self['stepDelta'] = True  # budget relies on the player keeping sprites that were not resent.
+
+        if self['sendFps'] < self['fps']:
+            log(f"Server stepping at {self['fps']} fps but sending step messages at {self['sendFps']} fps.")
+
+        if self['stepDelta']:
+            log("Server sending step messages as deltas.")
+
+        if self['stepBudget']:
+            log(f"Server sending at most {self['stepBudget']} bytes of sprite changes per player per step.")
+
+        if self['areaOfInterest']:
+            log("Server only sending sprites near each player's view.")
+
+        # True if each player is sent their own view of the map so step deltas must be based on
+        # what each player was sent rather than the shared map snapshots.
+        self['playerStepViews'] = self['stepDelta'] and (self['stepBudget'] or self['areaOfInterest'])
+
+        if self['compactSprites']:
+            log("Server sending step sprites in compact form.")
+
+        if self['mapWorkers']:
+            log(f"Server stepping maps in {self['mapWorkers']} worker processes.")
+
         self['players'] = {}  # dict of players indexed by their ipport (eg. '192.168.3.4:20013')
         self['playersByNum'] = {}  # same as above but indexed by playerNumber
         self['gameStartSec'] = 0  # time.perf_counter() that the game started (send in step msgs)
 
+        # map scheduling data. See scheduleMaps()
+        self['mapSchedule'] = {}  # {mapName: {'lastStep': perf_counter() or False, 'nearUntil': perf_counter(), 'changeCount': int}, ...}
+
+        # step delta data (only used if self['stepDelta'] == True). See engine.stepdelta
+        self['stepNum'] = 0  # number of the last snapshot taken. Unique across all maps.
+        self['stepSnapshots'] = {}  # {mapName: {stepNum: snapshot, ...}, ...} oldest snapshot first.
+        self['latestStepSnapshot'] = {}  # {mapName: snapshot, ...} or False if map has changed since snapshot.
+        self['stepEncodeCache'] = {}  # {(stepNum, baseStepNum): encoded sprites, ...} reset each step.
+
+        # set up codecs the server is willing to use with players (see engine.codec)
+        zdict = engine.loaders.loadZdict(self['game'])
+        if self['codec'] == 'zdict' and not zdict:
+            log(f"Game {self['game']} has no step.zdict so using zlib codec.", "WARNING")
+            self['codec'] = 'zlib'
+        self['codecs'] = {}
+        for name in engine.codec.CODECS[engine.codec.CODECS.index(self['codec']):]:
+            self['codecs'][name] = engine.codec.Codec(name, self['zlibLevel'], self['zlibMin'], zdict)
+        if self['codec'] == 'zdict':
+            # can't assume other end (e.g. connector) has the zdict.
+            defaultCodec = self['codecs']['zlib']
+        else:
+            defaultCodec = self['codecs'][self['codec']]
+
         # set up networking
         log(f"Server Default IP: {engine.network.getDefaultIP()}")
 
@@ -147,26 +230,31 @@ class Server(dict):
                 messages=engine.loaders.loadModule("messages", game=self['game']).Messages(),
                 msgProcessor=self,
                 sourceIP=self['serverIP'],
-                sourcePort=self['serverPort']
+                sourcePort=self['serverPort'],
+                codec=defaultCodec,
+                netEmulator=engine.netemu.fromArgs(args),
+                reusePort=args.workers > 1
                 )
         except Exception as e:
             log(str(e), "FAILURE")
             quit()
 
+        self['spriteCodec'] = engine.spritecodec.SpriteCodec(self['socket'].messages['spriteFields'])
+
+        self.applyInputLimits()
+
         if self['registerName']:
+            # reply is processed by addServerReply() while the server loads and runs.
             try:
                 log(f"Adding server to connector as '{self['registerName']}'.")
-                reply = self['socket'].sendRecvMessage(
+                self['socket'].sendRequest(
                     self.getAddServerMsg(),
                     destinationIP=self['connectorHostName'],
                     destinationPort=self['connectorPort'],
+                    callback=self.addServerReply,
                     retries=10, delay=5, delayMultiplier=1)
-                if reply['type'] == "serverAdded":
-                    log(f"Server added to connector as {self['registerName']}.")
-                    self.sendAddServerAfter = time.perf_counter() + self['CONNECTOR_KEEP_ALIVE']
-                else:
-                    log(msg['result'], "FAILURE")
-                    quit()
+                # don't send keep alives until connector has replied.
+                self.sendAddServerAfter = time.perf_counter() + 50
             except Exception as e:
                 log(str(e), "FAILURE")
                 log("Is connector running?")
@@ -197,6 +285,18 @@ class Server(dict):
     def __str__(self):
         return engine.log.objectToStr(self)
 
+    def applyInputLimits(self):
+        """Apply the INPUT_* values (see __init__()) to the server socket.
+
+        __init__() calls this. Games that change INPUT_COALESCE_TYPES,
+        INPUT_MAX_PER_PLAYER or INPUT_BUDGET after that must call it again.
+        """
+        self['socket'].setInputLimits(
+            coalesceTypes=self['INPUT_COALESCE_TYPES'],
+            maxMsgsPerSender=self['INPUT_MAX_PER_PLAYER'],
+            timeBudget=self['INPUT_BUDGET'] / self['fps']
+            )
+
     ########################################################
     # MAIN LOOP
     ########################################################
@@ -211,39 +311,74 @@ class Server(dict):
         interval.
         """
 
-        startAt = time.perf_counter()
-        nextStatusAt = startAt + self['busySec']
-        sleepTime = 0
-        nextStepAt = startAt + (1.0 / self['fps'])
-        while True:
-            # process messages from server (recvReplyMsgs calls msg<msgType> for each msg received)
-            self['socket'].recvReplyMsgs()
+        pacer = time.StepPacer(self['fps'], self['busySec'], "Server")
+        try:
+            while True:
+                self.runStep()
+
+                if not self['players']:
+                    # nobody to send steps to so wait for a msg (e.g. joinRequest) rather than stepping every 1/fps.
+                    pacer.startIdle()
+                    self['socket'].waitForData(self['IDLE_STEP_SEC'])
+                    pacer.endIdle()
+                    continue
+
+                # wait until next step should start.
+                waitUntil = pacer.getWaitUntil()
+                if waitUntil:
+                    time.sleep(until=waitUntil)
+                pacer.scheduleNextStep()
+        finally:
+            self.stopMapWorkers()
+
+    async def runAsync(self):
+        """Main server loop for asyncio.
+
+        Same as run() but msgs are received by the asyncio event loop and
+        the time between steps is given back to the event loop rather than
+        spent busy waiting.
+        """
+        await self['socket'].startAsync()
 
-            # Run the game logic to move everything forward one step
-            self.stepServer()
+        pacer = time.StepPacer(self['fps'], self['busySec'], "Server")
+        try:
+            while True:
+                self.runStep()
+
+                if not self['players']:
+                    # nobody to send steps to so wait for a msg (e.g. joinRequest) rather than stepping every 1/fps.
+                    pacer.startIdle()
+                    await self['socket'].waitForMsgs(self['IDLE_STEP_SEC'])
+                    pacer.endIdle()
+                    continue
+
+                # wait until next step should start.
+                waitUntil = pacer.getWaitUntil()
+                if waitUntil:
+                    await asyncio.sleep(waitUntil - time.perf_counter())
+                else:
+                    await asyncio.sleep(0)  # let the event loop receive msgs.
+                pacer.scheduleNextStep()
+        finally:
+            self.stopMapWorkers()
 
-            # Send updates to players for maps that have changed during the step
-            self.sendStepMsgs()
+    def runStep(self):
+        """Run one pass of the main loop.
 
-            # send keep alive messages to connector
-            self.sendConnectorKeepAlive()
+        Receives msgs from players, takes one step forward in time, sends
+        updated step messages to players, and keeps the connector data current.
+        """
+        # process messages from server (recvReplyMsgs calls msg<msgType> for each msg received)
+        self['socket'].recvReplyMsgs()
 
-            # wait until next step should start.
-            ptime = time.perf_counter()
-            if ptime < nextStepAt:
-                sleepTime += nextStepAt - ptime
+        # Run the game logic to move everything forward one step
+        self.stepServer()
 
-                if ptime > nextStatusAt:
-                    # log the amount of time we are busy vs. waiting for the next step.
-                    log(f"Status: busy == {int(100-(sleepTime/(ptime-startAt)*100))}%")
-                    startAt = ptime
-                    nextStatusAt = startAt + self['busySec']
-                    sleepTime = 0
-                time.sleep(until=nextStepAt)
-            else:
-                log("Server running slower than " + str(self['fps']) + " fps.", "VERBOSE")
+        # Send updates to players for maps that have changed during the step
+        self.sendStepMsgs()
 
-            nextStepAt = time.perf_counter() + (1.0 / self['fps'])
+        # send keep alive messages to connector
+        self.sendConnectorKeepAlive()
 
     ########################################################
     # Networking - GAME MESSAGES
@@ -302,13 +437,27 @@ class Server(dict):
                     destinationPort=self['connectorPort']
                     )
 
-            # send the new client back their player number
-            return {
+            reply = {
                 'type': "joinReply",
                 'playerNumber': self['players'][ipport]['sprite']['playerNumber'],
                 'serverSec': time.perf_counter(),
                 'testMode': self['testMode']
                 }
+            if self['players'][ipport]['sendFps'] < self['fps']:
+                # tell client step msgs will have gaps between them that it needs to fill in.
+                reply['sendFps'] = self['players'][ipport]['sendFps']
+
+            # agree on the codec used to send msgs to this player.
+            codecName = engine.codec.chooseCodec(
+                msg.get('codecs', ['zlib']),
+                msg.get('zdictChecksum'),
+                self['codecs'])
+            if codecName:
+                self['socket'].setCodec(self['codecs'][codecName], ip, port)
+                reply['codec'] = codecName
+
+            # send the new client back their player number
+            return reply
         else:
             return {'type': 'Error', 'result': result}
 
@@ -362,6 +511,56 @@ class Server(dict):
             map = self['maps'][sprite['mapName']]
             map.setSpriteAction(sprite)
 
+    def msgWindowSize(self, ip, port, ipport, msg):
+        """Process msg of type windowSize.
+
+        Record the new size of the player's window so the sprites sent to
+        the player match what they can see (see getInterestKeys()).
+
+        This method is designed to be called from self['socket'].recvReplyMsgs().
+        self['socket'].recvReplyMsgs() will call this method when it receives a
+        msg of the corresponding type.
+
+        Args:
+            ip (str): IP Address of sender.
+            port (int): Port number of sender.
+            ipport (str): IP Address and Port of sender in format "ip:port".
+            msg (dict): The message which was received.
+
+        See Also:
+            Message format in engine.messages.Messages['messageDefinitions']
+            engine.socket.recvReplyMsgs()
+        """
+        if ipport in self['players']:  # if this is a player who has already joined the game
+            player = self['players'][ipport]
+            player['windowWidth'] = msg['windowWidth']
+            player['windowHeight'] = msg['windowHeight']
+
+    def msgStepAck(self, ip, port, ipport, msg):
+        """Process msg of type stepAck.
+
+        Record the newest step snapshot the player has received. Future step
+        msgs to the player will be sent as a delta against this snapshot.
+
+        This method is designed to be called from self['socket'].recvReplyMsgs().
+        self['socket'].recvReplyMsgs() will call this method when it receives a
+        msg of the corresponding type.
+
+        Args:
+            ip (str): IP Address of sender.
+            port (int): Port number of sender.
+            ipport (str): IP Address and Port of sender in format "ip:port".
+            msg (dict): The message which was received.
+
+        See Also:
+            Message format in engine.messages.Messages['messageDefinitions']
+            engine.socket.recvReplyMsgs()
+        """
+        if ipport in self['players']:  # if this is a player who has already joined the game
+            player = self['players'][ipport]
+            if msg['stepNum'] > player['stepAck']:
+                player['stepAck'] = msg['stepNum']
+
     ########################################################
     # Networking - TEST MESSAGES
     ########################################################
@@ -563,6 +762,23 @@ class Server(dict):
         """
         pass
 
+    def addServerReply(self, reply):
+        """Process the connector's reply to the first addServer msg (see self['socket'].sendRequest()).
+
+        Args:
+            reply (dict): serverAdded or Error msg from connector or None if connector did not reply.
+        """
+        if reply is None:
+            log("Connector did not reply to addServer msg.", "FAILURE")
+            log("Is connector running?")
+            quit()
+        elif reply['type'] == "serverAdded":
+            log(f"Server added to connector as {self['registerName']}.")
+            self.sendAddServerAfter = time.perf_counter() + self['CONNECTOR_KEEP_ALIVE']
+        else:
+            log(reply['result'], "FAILURE")
+            quit()
+
     def sendConnectorKeepAlive(self):
         """Keep server data in connector from timing out.
 
@@ -606,25 +822,85 @@ class Server(dict):
         """Send step msgs.
 
         Send a step msg to each player, but only if the map the
-        player is on has changed or the player has changed.
+        player is on has changed or the player has changed. If step
+        deltas are on then also resend if the player has not
+        acknowledged the latest snapshot of their map for a while.
+
+        Players are sent at most player['sendFps'] step msgs per second.
+        Changes made during steps in between are sent in the next step msg.
         """
+        if self['stepDelta']:
+            self.expireStepSnapshots()
+        self['stepEncodeCache'] = {}
+
+        # {(id(sprites), codec name): (sprites, serialized sprites), ...} so each sprites list
+        # is serialized once per codec, no matter how many players it is sent to. sprites is
+        # kept in the cache so its id() can't be reused by another list during this loop.
+        sharedCache = {}
+
+        now = time.perf_counter()
+        self['socket'].startSendBatch()
         for ipport in self['players']:
             player = self['players'][ipport]
             map = self['maps'][player['sprite']['mapName']]
             if map.changed or self.getPlayerChanged(player):
-                self['socket'].sendMessage(
-                    self.getStepMsg(player),
-                    destinationIP=self['players'][ipport]['ip'],
-                    destinationPort=self['players'][ipport]['port']
-                    )
-                player['lastStepMsgSent'] = time.perf_counter()
+                player['stepChanged'] = True
             # reset the change detection on player.
-            self.resetPlayerChanged(self['players'][ipport])
+            self.resetPlayerChanged(player)
+
+            if now < player['nextStepMsgAt']:
+                continue  # not time to send to this player yet.
+            if player['stepChanged'] or self.getPlayerStepResend(player) or player['stepBudgetPending']:
+                self.sendStepMsg(player, self.getStepMsg(player), sharedCache)
+                player['lastStepMsgSent'] = now
+                player['stepChanged'] = False
+                if player['sendFps'] < self['fps']:
+                    player['nextStepMsgAt'] += 1.0 / player['sendFps']
+                    if player['nextStepMsgAt'] < now:
+                        # nothing was sent for a while so start the schedule over.
+                        player['nextStepMsgAt'] = now + 1.0 / player['sendFps']
+        self['socket'].endSendBatch()
 
         # reset the change detection on all maps
         for mapName in self['maps']:
             self['maps'][mapName].setMapChanged(False)
 
+    def sendStepMsg(self, player, msg, sharedCache):
+        """Send step msg to player.
+
+        msg['sprites'] is serialized (and converted to compact form if
+        self['compactSprites']) only the first time it is seen and then
+        reused from sharedCache. The rest of msg, which is small and often
+        different for each player, is serialized separately and sent with it
+        (see engine.network.Socket.serializeComposite()).
+
+        The server builds step msgs itself so they are only checked when
+        DEBUG logging is on, which is useful when changing getStepMsg().
+
+        Args:
+            player (dict): A player from self['players']
+            msg (dict): Step msg from getStepMsg(player)
+            sharedCache (dict): Serialized sprites lists. Empty at the start of each step.
+        """
+        if engine.log.isLogged("DEBUG") and not self['socket'].messages.isValidMsg(msg, trusted=True):
+            log("Could not send because step msg is not valid format.", "ERROR")
+            return
+
+        peer = player['peer']
+        codec = self['socket'].getPeerCodec(peer)
+        sprites = msg.pop('sprites')
+        key = (id(sprites), codec['name'])
+        if key not in sharedCache:
+            if self['compactSprites']:
+                encoded, strings = self['spriteCodec'].encodeSprites(sprites, 'stepNum' in msg)
+                shared = {'sprites': encoded, 'spriteStrings': strings}
+            else:
+                shared = {'sprites': sprites}
+            sharedCache[key] = (sprites, self['socket'].serialize(shared, codec))
+
+        networkbytes = self['socket'].serializeComposite(sharedCache[key][1], msg, codec)
+        self['socket'].sendPeerMessage(networkbytes, peer, packed=True)
+
     def getStepMsg(self, player):
         """Creates a step msg that can be sent to a player.
 
@@ -643,6 +919,38 @@ class Server(dict):
             'sprites': map['sprites']
             }
 
+        if self['playerStepViews']:
+            base = player['stepViews'].get(player['stepAck'], False)
+            if base:
+                msg['baseStepNum'] = base['stepNum']
+            snapshot = self.getStepSnapshot(map)
+            if self['areaOfInterest']:
+                snapshot = self.getInterestSnapshot(player, map, snapshot)
+            if self['stepBudget']:
+                view, msg['sprites'] = self.getStepBudgetView(player, snapshot, base)
+            else:
+                view = self.addPlayerStepView(player, snapshot['keys'], snapshot['sprites'])
+                msg['sprites'] = engine.stepdelta.encodeSprites(view, base)
+            msg['stepNum'] = view['stepNum']
+        elif self['stepDelta']:
+            snapshot = self.getStepSnapshot(map)
+            base = False
+            if player['stepAck'] in self['stepSnapshots'][map['name']]:
+                base = self['stepSnapshots'][map['name']][player['stepAck']]
+                msg['baseStepNum'] = base['stepNum']
+            msg['stepNum'] = snapshot['stepNum']
+            # players on the same map with the same base share one encoding.
+            key = (snapshot['stepNum'], base and base['stepNum'])
+            if key not in self['stepEncodeCache']:
+                self['stepEncodeCache'][key] = engine.stepdelta.encodeSprites(snapshot, base)
+            msg['sprites'] = self['stepEncodeCache'][key]
+        elif self['areaOfInterest']:
+            sprites = dict(zip(engine.stepdelta.spriteKeys(map), map['sprites']))
+            keys = self.getInterestKeys(player, map, list(sprites), sprites)
+            if len(keys) < len(sprites):
+                msg['sprites'] = [sprites[key] for key in keys]
+            # else keep map['sprites'] so it is only serialized once for all players (see sendStepMsg())
+
         if player['actionText']:
             msg['actionText'] = player['actionText']
 
@@ -651,6 +959,272 @@ class Server(dict):
 
         return msg
 
+    def expireStepSnapshots(self):
+        """Forget the latest snapshot of each changed map.
+
+        getStepSnapshot() will then take a new snapshot, but only if a step msg
+        is sent for the map before it changes again.
+        """
+        for mapName in self['latestStepSnapshot']:
+            if self['maps'][mapName].changed:
+                self['latestStepSnapshot'][mapName] = False
+
+    def addStepSnapshot(self, map):
+        """Add a snapshot of map['sprites'] to the snapshots kept for map.
+
+        Only the newest self['STEP_SNAPSHOTS'] snapshots are kept for each map.
+
+        Returns:
+            dict: The new snapshot.
+        """
+        self['stepNum'] += 1
+        snapshot = engine.stepdelta.makeSnapshot(self['stepNum'], map)
+
+        if map['name'] not in self['stepSnapshots']:
+            self['stepSnapshots'][map['name']] = {}
+        snapshots = self['stepSnapshots'][map['name']]
+        snapshots[snapshot['stepNum']] = snapshot
+        while len(snapshots) > self['STEP_SNAPSHOTS']:
+            del snapshots[next(iter(snapshots))]
+
+        self['latestStepSnapshot'][map['name']] = snapshot
+        return snapshot
+
+    def getStepSnapshot(self, map):
+        """Return the latest snapshot of map, taking one if map does not have one yet."""
+        if not self['latestStepSnapshot'].get(map['name']):
+            return self.addStepSnapshot(map)
+        return self['latestStepSnapshot'][map['name']]
+
+    def getPlayerStepResend(self, player):
+        """Return True if step deltas are on and the player needs the latest snapshot of their map resent.
+
+        Step msgs are not reliable so if the player has not acknowledged the
+        latest snapshot after self['STEP_RESEND_SEC'] then assume the step msg
+        was lost.
+
+        Args:
+            player (dict): A player from self['players']
+
+        Returns:
+            boolean
+        """
+        if not self['stepDelta']:
+            return False
+        if self['playerStepViews']:
+            if not player['stepViews'] or player['stepAck'] == next(reversed(player['stepViews'])):
+                return False
+        elif not self['latestStepSnapshot'].get(player['sprite']['mapName']):
+            return False
+        elif player['stepAck'] == self['latestStepSnapshot'][player['sprite']['mapName']]['stepNum']:
+            return False
+        return player['lastStepMsgSent'] + self['STEP_RESEND_SEC'] < time.perf_counter()
+
+    def getStepBudgetView(self, player, snapshot, base):
+        """Return the player's view of snapshot, limited by the player's step budget.
+
+        Sprites that changed since base gain priority each step (see
+        getSpritePriority()) until they are sent. The player's own sprite,
+        removed sprites, and sprites that have not changed are always sent.
+        Changed sprites are then added in order of highest priority while they
+        fit in player['stepBudget'] bytes and their priority is reset. Other
+        changed sprites are left as the player last saw them (or left out if
+        the player has never seen them) and player['stepBudgetPending'] is set
+        so they are sent next step.
+
+        The view is kept in player['stepViews'] so it can be used as the base
+        of a later delta once the player acknowledges it.
+
+        Args:
+            player (dict): A player from self['players']
+            snapshot (dict): The latest snapshot of the player's map.
+            base (dict): The view the player has acknowledged or False.
+
+        Returns:
+            view (dict): A snapshot (see engine.stepdelta) of what the player will see.
+            entries (list): view encoded as a delta against base.
+        """
+        baseSprites = base['sprites'] if base else {}
+        # sprites the player may have seen but has not acknowledged yet. Keeping these
+        # stops sprites jumping back to base if they are not sent again this step.
+        lastSprites = player['stepViews'][next(reversed(player['stepViews']))]['sprites'] if player['stepViews'] else {}
+        playerKey = engine.stepdelta.spriteKey(self['maps'][player['sprite']['mapName']], player['sprite'])
+        priority = player['spritePriority']
+
+        chosen = {}  # {key: (sprite, entry), ...}
+        candidates = []  # [(priority, key), ...]
+        used = 0
+        for key in snapshot['keys']:
+            sprite = snapshot['sprites'][key]
+            baseSprite = baseSprites.get(key)
+            if sprite == baseSprite or key == playerKey:
+                entry = engine.stepdelta.encodeSprite(key, sprite, baseSprite)
+                chosen[key] = (sprite, entry)
+                used += len(msgpack.packb(entry, use_bin_type=True))
+                priority.pop(key, None)
+            else:
+                priority[key] = priority.get(key, 0) + self.getSpritePriority(player, sprite)
+                candidates.append((priority[key], key))
+
+        # fallback for each candidate that is not sent: what the player last saw, if anything.
+        fallback = {}
+        for p, key in candidates:
+            if key in lastSprites:
+                entry = engine.stepdelta.encodeSprite(key, lastSprites[key], baseSprites.get(key))
+                fallback[key] = (lastSprites[key], entry, len(msgpack.packb(entry, use_bin_type=True)))
+                used += fallback[key][2]
+
+        pending = False
+        sent = 0
+        for p, key in sorted(candidates, reverse=True):
+            sprite = snapshot['sprites'][key]
+            entry = engine.stepdelta.encodeSprite(key, sprite, baseSprites.get(key))
+            size = len(msgpack.packb(entry, use_bin_type=True))
+            if key in fallback:
+                size -= fallback[key][2]
+            # always send at least one changed sprite so a small budget can't stop all progress.
+            if used + size > player['stepBudget'] and sent:
+                pending = True
+                continue  # a smaller sprite with lower priority may still fit.
+            sent += 1
+            used += size
+            chosen[key] = (sprite, entry)
+            priority[key] = 0
+        player['stepBudgetPending'] = pending
+
+        for key in list(priority):
+            if key not in snapshot['sprites']:
+                del priority[key]  # sprite was removed.
+
+        keys = []
+        sprites = {}
+        entries = []
+        for key in snapshot['keys']:
+            if key in chosen:
+                sprite, entry = chosen[key]
+            elif key in fallback:
+                sprite, entry, size = fallback[key]
+            else:
+                continue  # player has never seen sprite so leave it out for now.
+            keys.append(key)
+            sprites[key] = sprite
+            entries.append(entry)
+
+        return self.addPlayerStepView(player, keys, sprites), entries
+
+    def addPlayerStepView(self, player, keys, sprites):
+        """Add a snapshot of what player is being sent to player['stepViews'].
+
+        Only the newest self['STEP_SNAPSHOTS'] views are kept for each player.
+
+        Args:
+            player (dict): A player from self['players']
+            keys (list): Sprite keys in sprite layer order.
+            sprites (dict): {key: sprite, ...} sprites from step snapshots.
+
+        Returns:
+            dict: The new view (a snapshot, see engine.stepdelta).
+        """
+        self['stepNum'] += 1
+        view = {'stepNum': self['stepNum'], 'keys': keys, 'sprites': sprites}
+        player['stepViews'][view['stepNum']] = view
+        while len(player['stepViews']) > self['STEP_SNAPSHOTS']:
+            del player['stepViews'][next(iter(player['stepViews']))]
+        return view
+
+    def getInterestSnapshot(self, player, map, snapshot):
+        """Return a copy of snapshot with only the sprites player is interested in (see getInterestKeys())."""
+        keys = self.getInterestKeys(player, map, snapshot['keys'], snapshot['sprites'])
+        if len(keys) == len(snapshot['keys']):
+            return snapshot
+        return {
+            'stepNum': snapshot['stepNum'],
+            'keys': keys,
+            'sprites': {key: snapshot['sprites'][key] for key in keys}
+            }
+
+    def getInterestKeys(self, player, map, keys, sprites):
+        """Return the keys of the sprites that are in or near the area of map that player can see.
+
+        The area is worked out the same way engine.client.Client.setMapOffset()
+        does, from the window size the player sent in their joinRequest, and
+        grown by self['AOI_MARGIN'] on each side. Sprites the player was
+        already sent are kept until they are self['AOI_HYSTERESIS'] pixels
+        further out so sprites moving along the edge do not flicker in and
+        out. The player's own sprite and sprites without a position are
+        always kept.
+
+        Args:
+            player (dict): A player from self['players']
+            map (engine.servermap.ServerMap): The map the player is on.
+            keys (list): Sprite keys in sprite layer order.
+            sprites (dict): {key: sprite, ...}
+
+        Returns:
+            list: keys in the same order, or keys itself if the player can see the whole map.
+        """
+        width = player['windowWidth']
+        height = player['windowHeight']
+        if not width or not height or (map['pixelWidth'] <= width and map['pixelHeight'] <= height):
+            player['interestKeys'] = set(keys)
+            return keys
+
+        left = 0
+        top = 0
+        right = map['pixelWidth']
+        bottom = map['pixelHeight']
+        if map['pixelWidth'] > width:
+            left = min(max(player['sprite']['anchorX'] - width / 2, 0), map['pixelWidth'] - width)
+            right = left + width
+        if map['pixelHeight'] > height:
+            top = min(max(player['sprite']['anchorY'] - height / 2, 0), map['pixelHeight'] - height)
+            bottom = top + height
+
+        playerKey = engine.stepdelta.spriteKey(map, player['sprite'])
+        wasInterested = player['interestKeys']
+        interested = []
+        for key in keys:
+            sprite = sprites[key]
+            margin = self['AOI_MARGIN']
+            if key in wasInterested:
+                margin += self['AOI_HYSTERESIS']
+            if key == playerKey:
+                pass
+            elif 'x' in sprite and 'y' in sprite:
+                if sprite['x'] + sprite.get('width', 0) < left - margin or sprite['x'] > right + margin or \
+                        sprite['y'] + sprite.get('height', 0) < top - margin or sprite['y'] > bottom + margin:
+                    continue
+            elif 'anchorX' in sprite and 'anchorY' in sprite:
+                if sprite['anchorX'] < left - margin or sprite['anchorX'] > right + margin or \
+                        sprite['anchorY'] < top - margin or sprite['anchorY'] > bottom + margin:
+                    continue
+            interested.append(key)
+
+        player['interestKeys'] = set(interested)
+        return interested
+
+    def getSpritePriority(self, player, sprite):
+        """Return how much priority sprite gains for each step it has changed but was not sent to player.
+
+        Sprites gain self['BUDGET_TYPE_PRIORITY'][sprite['type']] (or 1) per
+        step, scaled down by the sprite's distance from the player's sprite.
+        Priority keeps growing until the sprite is sent so distant sprites are
+        never starved.
+
+        Args:
+            player (dict): A player from self['players']
+            sprite (dict): A sprite from a step snapshot of the player's map.
+
+        Returns:
+            float
+        """
+        p = self['BUDGET_TYPE_PRIORITY'].get(sprite.get('type'), 1)
+        if 'anchorX' in sprite and 'anchorY' in sprite:
+            distance = math.hypot(sprite['anchorX'] - player['sprite']['anchorX'],
+                                  sprite['anchorY'] - player['sprite']['anchorY'])
+            p /= 1 + distance / self['BUDGET_DISTANCE']
+        return p
+
     ########################################################
     # GAME LOGIC
     ########################################################
@@ -661,28 +1235,132 @@ class Server(dict):
         This should be called once every 1/fps seconds by the main server loop.
         Three tasks are performed:
             1) call self.stepServerStart()
-            2) call map.stepMap() for each map that has at least one player on it.
+            2) call map.stepMap() for each map that is due to be stepped (see scheduleMaps()).
                Perform these calls in order of maps names sorted alphabetically.
             3) call self.stepServerEnd()
         """
         self.stepServerStart()
 
-        # Run map.stepMap() for any maps that have players on them. We do not bother
-        # to process maps that do not currently contain players.
+        # maps with players are stepped every step, maps near players less often, and other maps not at all.
+        mapDts = self.scheduleMaps()
+
+        # sorted() ensures we process maps in the same order each time.
+        self.stepMaps(sorted(mapDts), mapDts)
+
+        self.stepServerEnd()
+
+    def scheduleMaps(self):
+        """Return the maps that should be stepped this step.
 
-        # find mapNames that have at least one player on them.
-        mapNames = []
+        This should be called once per step. Each map is stepped at a rate
+        based on how close it is to the players:
+
+            active: Maps with at least one player on them are stepped every step.
+            near: Maps that a mapDoor on an active map leads to, maps that had a
+                player on them in the last MAP_NEAR_SEC secs, and maps that were
+                woken in the last MAP_NEAR_SEC secs are stepped MAP_NEAR_FPS
+                times per sec.
+            dormant: All other maps are not stepped.
+
+        A map is woken if it is changed while it is not being stepped, for
+        example by a sprite arriving through a mapDoor.
+
+        Near and dormant timing uses wall time (time.perf_counter()) so it
+        does not depend on how many steps the server manages per sec.
+
+        Returns:
+            dict: {mapName: dt, ...} where dt is the secs of game time since the
+                map was last stepped (see engine.stepmap.StepMap.stepMap()). Maps
+                with players are stepped by one step (1/fps secs). Near maps are
+                stepped by the wall time since their last step, capped at
+                2/MAP_NEAR_FPS secs so a stalled server does not cause a burst
+                of sub-steps. A map that was dormant continues from where it
+                stopped so its dt is one step.
+        """
+        now = time.perf_counter()
+        fps = self['fps']
+        if self['MAP_NEAR_FPS']:
+            nearInterval = 1.0 / self['MAP_NEAR_FPS']
+            # a near map is due on the server step closest to its interval.
+            nearDue = nearInterval - 0.5 / fps
+        else:
+            nearInterval = False
+
+        active = set()
         for ipport in self['players']:
-            mapNames.append(self['players'][ipport]['sprite']['mapName'])
+            active.add(self['players'][ipport]['sprite']['mapName'])
+
+        near = set()
+        for mapName in active:
+            for trigger in self['maps'][mapName]['triggers']:
+                if trigger['type'] == 'mapDoor' and trigger.get('prop-destMapName') in self['maps']:
+                    near.add(trigger['prop-destMapName'])
+
+        mapDts = {}
+        for mapName, map in self['maps'].items():
+            schedule = self['mapSchedule'].get(mapName)
+            if not schedule:
+                schedule = {'lastStep': False, 'nearUntil': 0, 'changeCount': map.changeCount}
+                self['mapSchedule'][mapName] = schedule
+
+            if map.changeCount != schedule['changeCount']:
+                # something other than the map's own step changed it so wake it up.
+                schedule['changeCount'] = map.changeCount
+                schedule['nearUntil'] = max(schedule['nearUntil'], now + self['MAP_NEAR_SEC'])
+
+            if mapName in active:
+                schedule['nearUntil'] = now + self['MAP_NEAR_SEC']
+                dt = 1.0 / fps
+            elif nearInterval and (mapName in near or now < schedule['nearUntil']):
+                if schedule['lastStep'] is False:
+                    dt = 1.0 / fps
+                elif now - schedule['lastStep'] < nearDue:
+                    continue  # not due yet.
+                else:
+                    dt = min(now - schedule['lastStep'], 2 * nearInterval)
+            else:
+                schedule['lastStep'] = False  # dormant
+                continue
 
-        # set() removes duplicates and sorted() ensures we process maps in the same order each time.
-        mapNames = sorted(set(mapNames))
+            mapDts[mapName] = dt
+            schedule['lastStep'] = now
 
-        # call stepMap for each map with at least one player
+        return mapDts
+
+    def stepMaps(self, mapNames, mapDts=None):
+        """Call stepMap() for each map in mapNames, in order.
+
+        If the server was started with -mapworkers then the maps are
+        stepped in parallel by worker processes instead and the server's
+        copy of every map is updated with the changes before this returns.
+        See engine.mapworker for the rules map code must follow.
+
+        Args:
+            mapNames (list): Names of maps to step.
+            mapDts (dict): {mapName: dt, ...} from scheduleMaps(). If None then
+                each map is stepped by one server step (1/fps secs).
+        """
+        if not self['mapWorkers']:
+            for mapName in mapNames:
+                self['maps'][mapName].stepMap(mapDts[mapName] if mapDts else None)
+        else:
+            if not self['mapWorkerPool']:
+                # started here, rather than in __init__(), so the game has finished setting up the maps.
+                self['mapWorkerPool'] = engine.mapworker.MapWorkerPool(self, self['mapWorkers'])
+            self['mapWorkerPool'].stepMaps(mapNames, mapDts)
+
+        # changes the maps made to themselves do not wake them up. See scheduleMaps()
         for mapName in mapNames:
-            self['maps'][mapName].stepMap()
+            if mapName in self['mapSchedule']:
+                self['mapSchedule'][mapName]['changeCount'] = self['maps'][mapName].changeCount
 
-        self.stepServerEnd()
+    def stopMapWorkers(self):
+        """Stop the map worker processes if they were started. See stepMaps()
+
+        Called once by the main loop as the server quits, including after Ctrl-C.
+        """
+        if self['mapWorkerPool']:
+            self['mapWorkerPool'].stop()
 
     def stepServerStart(self):
         """Server logic for the start of a step.
@@ -729,6 +1407,7 @@ class Server(dict):
         self['players'][ipport] = {
             'ip': ip,
             'port': port,
+            'peer': self['socket'].getPeer(ip, port),  # for sending step msgs (see sendStepMsg())
             'moveSpeed': 120,  # default move speed in pixels per second.
             'sprite': sprite,
             'playerNumber': sprite['playerNumber'],
@@ -736,7 +1415,18 @@ class Server(dict):
             'lastActionText': False,
             'marqueeText': False,
             'lastMarqueeText': False,  # set to false if not in use, rather than removing.
-            'lastStepMsgSent': 0
+            'lastStepMsgSent': 0,
+            'sendFps': self['sendFps'],  # max step msgs per second sent to player. Can be changed per player.
+            'nextStepMsgAt': 0,  # don't send player another step msg before this time.
+            'stepChanged': False,  # True if player's map or player changed since last step msg was sent.
+            'windowWidth': msg.get('windowWidth'),  # size of player's window (used by getInterestKeys())
+            'windowHeight': msg.get('windowHeight'),
+            'interestKeys': set(),  # keys of sprites player was sent last step (only used with areaOfInterest)
+            'stepAck': 0,  # newest step snapshot player has acknowledged (only used for step deltas)
+            'stepBudget': self['stepBudget'],  # max bytes of sprite changes per step (0 is no limit)
+            'stepBudgetPending': False,  # True if some changed sprites did not fit in the last step's budget.
+            'stepViews': {},  # {stepNum: snapshot, ...} what the player was sent (only used with playerStepViews)
+            'spritePriority': {}  # {sprite key: priority, ...} for sprites waiting to be sent (see getSpritePriority())
             }
         # Also add player to self['playersByNum'] with the playerNumber so we can look up either way.
         self['playersByNum'][sprite['playerNumber']] = self['players'][ipport]
@@ -6,6 +6,7 @@ import engine.geometry as geo
 import engine.time as time
 import engine.stepmap
 import engine.server
+import engine.walkgrid
 
 
 class ServerMap(engine.stepmap.StepMap):
@@ -54,6 +55,68 @@ class ServerMap(engine.stepmap.StepMap):
 
     """
 
+    def __init__(self, tilesets, mapDir):
+        """Extends engine.stepmap.StepMap.__init__()"""
+
+        # engine.walkgrid.WalkGrid of the inBounds and outOfBounds layers, created when first needed.
+        # Set before the map is loaded since loading objects updates the spatial indexes. See WALK GRID below.
+        self['walkGrid'] = False
+        self['WALK_CELLS_PER_TILE'] = 2  # walk grid cells across the width (and height) of a tile.
+
+        super().__init__(tilesets, mapDir)
+
+    ########################################################
+    # WALK GRID
+    ########################################################
+
+    def getWalkGrid(self):
+        """Return the engine.walkgrid.WalkGrid of this map's inBounds and outOfBounds layers.
+
+        The grid is created the first time it is needed and is rebuilt after
+        objects are added to, removed from, or moved on those layers.
+        """
+        if not self['walkGrid'] or not self['walkGrid'].isCurrent(self['inBounds'], self['outOfBounds']):
+            self['walkGrid'] = engine.walkgrid.WalkGrid(self['inBounds'], self['outOfBounds'],
+                                                        self['pixelWidth'], self['pixelHeight'],
+                                                        min(self['tilewidth'], self['tileheight']) / self['WALK_CELLS_PER_TILE'])
+        return self['walkGrid']
+
+    def checkBounds(self, object, collidesWith, checkLocationOn):
+        """Extends engine.map.Map.checkBounds()
+
+        Use the walk grid if it can answer, else do the full check.
+        """
+        if 'inBounds' in checkLocationOn and 'outOfBounds' in checkLocationOn:
+            walkGrid = self.getWalkGrid()
+            if id(object) not in walkGrid['ids']:
+                valid = walkGrid.check(collidesWith)
+                if valid is not None:
+                    return valid
+        return super().checkBounds(object, collidesWith, checkLocationOn)
+
+    def addObject(self, object, objectList=False):
+        """Extends engine.map.Map.addObject()"""
+        super().addObject(object, objectList)
+        if objectList is self['inBounds'] or objectList is self['outOfBounds']:
+            self['walkGrid'] = False
+
+    def removeObject(self, object, objectList=False):
+        """Extends engine.map.Map.removeObject()"""
+        super().removeObject(object, objectList)
+        if objectList is self['inBounds'] or objectList is self['outOfBounds']:
+            self['walkGrid'] = False
+
+    def updateSpatialIndexes(self, object):
+        """Extends engine.map.Map.updateSpatialIndexes()"""
+        super().updateSpatialIndexes(object)
+        if self['walkGrid'] and id(object) in self['walkGrid']['ids']:
+            self['walkGrid'] = False
+
+    def resetSpatialIndexes(self):
+        """Extends engine.map.Map.resetSpatialIndexes()"""
+        super().resetSpatialIndexes()
+        self['walkGrid'] = False
+
     ########################################################
     # MOVE LINEAR MECHANIC
     ########################################################
@@ -74,8 +137,8 @@ class ServerMap(engine.stepmap.StepMap):
             slide = sprite['move']['sl']
             easeIn = sprite['move']['ei']
 
-            # convert pixels per second to pixels per step
-            startStepSpeed = stepSpeed = moveSpeed / engine.server.SERVER['fps']
+            # convert pixels per second to pixels this step
+            startStepSpeed = stepSpeed = moveSpeed * self['stepDt']
 
             # compute a new angle in radians which moves directly towards destination
             # sprite['direction'] is stored and never removed so client will know the last
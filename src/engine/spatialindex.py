@@ -0,0 +1,204 @@
+"""Spatial Index of Tiled Objects
+
+This module is used by engine.map.Map to quickly find the objects on a
+layer (e.g. sprites or triggers) that may collide with another object,
+without checking every object on the layer.
+
+The map is divided into a uniform grid of square cells. Each object is
+stored in every cell its bounds touch. The bounds of an object are a
+rectangle that contains everything any collisionType could use: its
+x, y, width, height rect, its anchor point, the circle centered in the
+rect, and the points of a polyline or polygon. So the index does not
+need to be updated when an object's collisionType changes.
+
+A query returns the objects in the cells that the query bounds touch.
+These are only candidates, the caller still needs to check for an actual
+collision (e.g. with engine.geometry.collidesFast()). Candidates are
+returned in the same order as the object list so searches that stop at
+the first match find the same object with or without the index.
+
+Objects that would be stored in more than MAX_CELLS cells, or that have no
+bounds (e.g. a 'line' object without points), are returned by every query.
+
+The index must be told when an object moves (update()). engine.map.Map
+does this in setObjectLocationByAnchor() and setObjectLocationByXY().
+"""
+
+import math
+
+MAX_CELLS = 64  # objects that cover more cells than this are returned by every query.
+
+
+def getBounds(object):
+    """Return (minX, minY, maxX, maxY) that contains all of object, or None if it can't be bounded.
+
+    Args:
+        object (dict): Tiled object with at least x, y, width, height, anchorX, anchorY.
+    """
+    minX = x = object['x']
+    minY = y = object['y']
+    maxX = x + object['width']
+    maxY = y + object['height']
+
+    # circles are centered in the rect with a radius of width/2, which may be more than height/2.
+    extra = (object['width'] - object['height']) / 2
+    if extra > 0:
+        minY -= extra
+        maxY += extra
+
+    if 'anchorX' in object:
+        anchorX = object['anchorX']
+        anchorY = object['anchorY']
+        if anchorX < minX:
+            minX = anchorX
+        elif anchorX > maxX:
+            maxX = anchorX
+        if anchorY < minY:
+            minY = anchorY
+        elif anchorY > maxY:
+            maxY = anchorY
+
+    points = object.get('polyline') or object.get('polygon')
+    if points:
+        for p in points:
+            minX = min(minX, x + p['x'])
+            minY = min(minY, y + p['y'])
+            maxX = max(maxX, x + p['x'])
+            maxY = max(maxY, y + p['y'])
+    elif object['collisionType'] == 'line':
+        return None
+
+    return minX, minY, maxX, maxY
+
+
+class SpatialIndex(dict):
+    """SpatialIndex Class
+
+    A uniform grid index of the objects in one object list.
+    """
+
+    def __init__(self, objects, cellSize):
+        """Create an index of objects.
+
+        Args:
+            objects (list): The object list to index, e.g. map['sprites'].
+            cellSize (float): Width and height of each grid cell in pixels.
+        """
+        self['objects'] = objects
+        self['cellSize'] = cellSize
+        self['cells'] = {}  # {(cellX, cellY): {id(object): object, ...}, ...}
+        self['everywhere'] = {}  # {id(object): object, ...} objects returned by every query.
+        self['entries'] = {}  # {id(object): (order, cellRange), ...} cellRange is False if object is everywhere.
+        self['nextOrder'] = 0  # objects are sorted by order so queries return them in list order.
+
+        for object in objects:
+            self.add(object)
+
+    def getCellRange(self, bounds):
+        """Return (x1, y1, x2, y2), the first and last cell bounds touches on each axis.
+
+        Returns False if bounds is None or touches more than MAX_CELLS cells.
+        """
+        if bounds is None:
+            return False
+        size = self['cellSize']
+        x1 = math.floor(bounds[0] / size)
+        y1 = math.floor(bounds[1] / size)
+        x2 = math.floor(bounds[2] / size)
+        y2 = math.floor(bounds[3] / size)
+        if (x2 - x1 + 1) * (y2 - y1 + 1) > MAX_CELLS:
+            return False
+        return x1, y1, x2, y2
+
+    def add(self, object):
+        """Add object to the index, after all objects already in it."""
+        if id(object) in self['entries']:
+            self.remove(object)
+        cellRange = self.getCellRange(getBounds(object))
+        self['entries'][id(object)] = (self['nextOrder'], cellRange)
+        self['nextOrder'] += 1
+        self.addToCells(object, cellRange)
+
+    def remove(self, object):
+        """Remove object from the index. Does nothing if object is not in the index."""
+        entry = self['entries'].pop(id(object), None)
+        if entry:
+            self.removeFromCells(object, entry[1])
+
+    def update(self, object):
+        """Move object to the cells of its current bounds. Does nothing if object is not in the index."""
+        entry = self['entries'].get(id(object))
+        if not entry:
+            return
+        cellRange = self.getCellRange(getBounds(object))
+        if cellRange == entry[1]:
+            return
+        self.removeFromCells(object, entry[1])
+        self.addToCells(object, cellRange)
+        self['entries'][id(object)] = (entry[0], cellRange)
+
+    def addToCells(self, object, cellRange):
+        """Store object in the cells of cellRange (from getCellRange())."""
+        if cellRange is False:
+            self['everywhere'][id(object)] = object
+            return
+        cells = self['cells']
+        x1, y1, x2, y2 = cellRange
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                if (cx, cy) not in cells:
+                    cells[(cx, cy)] = {}
+                cells[(cx, cy)][id(object)] = object
+
+    def removeFromCells(self, object, cellRange):
+        """Remove object from the cells of cellRange (from getCellRange())."""
+        if cellRange is False:
+            del self['everywhere'][id(object)]
+            return
+        cells = self['cells']
+        x1, y1, x2, y2 = cellRange
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                del cells[(cx, cy)][id(object)]
+                if not cells[(cx, cy)]:
+                    del cells[(cx, cy)]
+
+    def isCurrent(self, objects):
+        """Return True if the index is of objects and objects has not been changed without the index knowing."""
+        return self['objects'] is objects and len(objects) == len(self['entries'])
+
+    def query(self, bounds, ordered=True):
+        """Return the objects that may collide with something inside bounds.
+
+        Args:
+            bounds (tuple): (minX, minY, maxX, maxY) from getBounds() or None.
+                If None then all objects are returned.
+            ordered (bool): If True then the objects are returned in list order.
+
+        Returns:
+            list: The objects. This may be the indexed object list itself so
+                it must not be changed.
+        """
+        cellRange = self.getCellRange(bounds)
+        if cellRange is False:
+            return self['objects']
+        x1, y1, x2, y2 = cellRange
+
+        allCells = self['cells']
+        if x1 == x2 and y1 == y2 and not self['everywhere']:
+            # the most common case, bounds are inside one cell.
+            found = allCells.get((x1, y1))
+            if not found:
+                return []
+        else:
+            found = dict(self['everywhere'])
+            for cx in range(x1, x2 + 1):
+                for cy in range(y1, y2 + 1):
+                    cell = allCells.get((cx, cy))
+                    if cell:
+                        found.update(cell)
+
+        if not ordered or len(found) < 2:
+            return list(found.values())
+        entries = self['entries']
+        return sorted(found.values(), key=lambda o: entries[id(o)][0])
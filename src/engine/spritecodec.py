@@ -0,0 +1,173 @@
+"""Compact Step Sprite Encoding
+
+This module is used by the server and client to send the sprites of a
+step message in a compact form. Which fields can be compacted, and how,
+is defined by engine.messages.Messages['spriteFields'], which games can
+extend.
+
+Each sprite (a dict) is encoded as a flat list of field/value pairs:
+
+    [tag1, value1, tag2, value2, ...]
+
+The tag is the index of the field name in Messages['spriteFields'].
+Fields not in Messages['spriteFields'], or with a value that does not
+suit the field's type, are sent with their name (a str) as the tag and
+their value unchanged.
+
+Values are encoded based on the field type:
+
+    'str': index into the step msg's string table (msg['spriteStrings']).
+    'strs': list of indexes into the string table.
+    'pos': int, the value times POS_SCALE rounded to the nearest int.
+    'points': flat list of 'pos' encoded x, y values, e.g. a polyline.
+    'sprite': a sprite, encoded as above.
+    'raw': unchanged.
+
+If the sprites are step deltas (see engine.stepdelta) then the fields and
+removed field names of each delta entry are encoded instead.
+"""
+
+POS_SCALE = 16  # positions are sent with a precision of 1/16 of a pixel.
+
+
+class SpriteCodec(dict):
+    """SpriteCodec Class
+
+    Encodes and decodes step sprites using the field types from
+    Messages['spriteFields'].
+    """
+
+    def __init__(self, spriteFields):
+        """Create a SpriteCodec.
+
+        Args:
+            spriteFields (dict): {fieldName: fieldType, ...} from Messages['spriteFields']
+        """
+        self['names'] = list(spriteFields.keys())
+        self['types'] = list(spriteFields.values())
+        self['tags'] = {name: tag for tag, name in enumerate(self['names'])}
+
+    ########################################################
+    # ENCODE
+    ########################################################
+
+    def encodeSprites(self, sprites, delta=False):
+        """Return sprites in compact form.
+
+        Args:
+            sprites (list): Sprites from a map or entries from engine.stepdelta.encodeSprites().
+            delta (bool): True if sprites are step delta entries.
+
+        Returns:
+            encoded (list): Encoded sprites, in the same order as sprites.
+            strings (list): The string table that encoded refers to.
+        """
+        strings = {}
+        encoded = []
+        for sprite in sprites:
+            if not delta:
+                encoded.append(self.encodeSprite(sprite, strings))
+            elif isinstance(sprite, list):
+                key, fields, removed = sprite
+                encoded.append([key, self.encodeSprite(fields, strings), [self['tags'].get(f, f) for f in removed]])
+            else:
+                encoded.append(sprite)
+        return encoded, list(strings.keys())
+
+    def encodeSprite(self, sprite, strings):
+        """Return sprite encoded as a list of field/value pairs. strings is updated with new strings."""
+        encoded = []
+        tags = self['tags']
+        types = self['types']
+        for fld, value in sprite.items():
+            if fld in tags:
+                tag = tags[fld]
+                v = self.encodeValue(types[tag], value, strings)
+                if v is not None:
+                    encoded.append(tag)
+                    encoded.append(v)
+                    continue
+            encoded.append(fld)
+            encoded.append(value)
+        return encoded
+
+    def encodeValue(self, fldType, value, strings):
+        """Return value encoded for fldType or None if value is not suitable for fldType."""
+        if fldType == 'raw':
+            return value
+        if fldType == 'pos':
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return round(value * POS_SCALE)
+        elif fldType == 'str':
+            if isinstance(value, str):
+                return strings.setdefault(value, len(strings))
+        elif fldType == 'strs':
+            if isinstance(value, list) and all(isinstance(s, str) for s in value):
+                return [strings.setdefault(s, len(strings)) for s in value]
+        elif fldType == 'points':
+            if isinstance(value, list) and all(isinstance(p, dict) and len(p) == 2 and 'x' in p and 'y' in p and
+                                               isinstance(p['x'], (int, float)) and isinstance(p['y'], (int, float))
+                                               for p in value):
+                points = []
+                for p in value:
+                    points.append(round(p['x'] * POS_SCALE))
+                    points.append(round(p['y'] * POS_SCALE))
+                return points
+        elif fldType == 'sprite':
+            if isinstance(value, dict):
+                return self.encodeSprite(value, strings)
+        return None
+
+    ########################################################
+    # DECODE
+    ########################################################
+
+    def decodeSprites(self, encoded, strings, delta=False):
+        """Return sprites from the compact form created by encodeSprites().
+
+        Args:
+            encoded (list): Encoded sprites.
+            strings (list): The string table that encoded refers to.
+            delta (bool): True if the sprites were step delta entries.
+
+        Returns:
+            list: Sprites (or step delta entries), the same as was passed to encodeSprites().
+        """
+        sprites = []
+        for sprite in encoded:
+            if not delta:
+                sprites.append(self.decodeSprite(sprite, strings))
+            elif isinstance(sprite, list):
+                key, fields, removed = sprite
+                sprites.append([key, self.decodeSprite(fields, strings),
+                                [self['names'][f] if isinstance(f, int) else f for f in removed]])
+            else:
+                sprites.append(sprite)
+        return sprites
+
+    def decodeSprite(self, encoded, strings):
+        """Return sprite (dict) from list of field/value pairs created by encodeSprite()."""
+        sprite = {}
+        names = self['names']
+        types = self['types']
+        for i in range(0, len(encoded), 2):
+            tag = encoded[i]
+            if isinstance(tag, str):
+                sprite[tag] = encoded[i + 1]
+            else:
+                sprite[names[tag]] = self.decodeValue(types[tag], encoded[i + 1], strings)
+        return sprite
+
+    def decodeValue(self, fldType, value, strings):
+        """Return value decoded from fldType."""
+        if fldType == 'pos':
+            return value / POS_SCALE
+        if fldType == 'str':
+            return strings[value]
+        if fldType == 'strs':
+            return [strings[s] for s in value]
+        if fldType == 'points':
+            return [{'x': value[i] / POS_SCALE, 'y': value[i + 1] / POS_SCALE} for i in range(0, len(value), 2)]
+        if fldType == 'sprite':
+            return self.decodeSprite(value, strings)
+        return value
@@ -0,0 +1,145 @@
+"""Step Message Delta Encoding
+
+This module is used by the server and client to send the sprites of a
+step message as a delta against an earlier step that the client has
+already received and acknowledged.
+
+A snapshot is a copy of a map's sprites exactly as a client would see
+them after the sprites have been sent over the network:
+
+    {
+        'stepNum': (int) number that identifies the snapshot,
+        'keys': [key1, key2, ...]  sprite keys in sprite layer order,
+        'sprites': {key1: sprite1, key2: sprite2, ...}
+    }
+
+The encoded form of a snapshot is a list with one entry per sprite, in
+sprite layer order. Each entry is one of:
+
+    key (int): The sprite has not changed since the base snapshot.
+    [key, fields, removed]: fields (dict) are the sprite fields that were
+        added or changed and removed (list) are the names of fields that
+        were deleted since the base snapshot. If the sprite is not in the
+        base snapshot then fields is the complete sprite.
+
+Sprites that are in the base snapshot but not in the encoded list have
+been removed from the map.
+"""
+
+import msgpack
+
+
+def spriteKey(map, sprite):
+    """Return the key used to identify sprite across snapshots of map.
+
+    The key is the sprite's object id on map (see engine.map.Map.getObjectId()),
+    which is never used by a different sprite, on map or any other map. So a
+    sprite from a snapshot of one map is never mistaken for a sprite of another
+    map when a player changes maps. If a sprite leaves map and comes back then
+    it gets a new key and is simply encoded as a new sprite.
+    """
+    return map.getObjectId(sprite)
+
+
+def spriteKeys(map):
+    """Return the keys (see spriteKey()) of all sprites on map, in sprite layer order."""
+    return map.getObjectIds(map['sprites'])
+
+
+def makeSnapshot(stepNum, map):
+    """Return a snapshot of map's sprites.
+
+    The sprites are copied by packing and unpacking them with msgpack so
+    the snapshot contains exactly the data a client would receive and
+    will not change when the game changes the original sprites.
+
+    Args:
+        stepNum (int): Number that identifies this snapshot.
+        map (engine.map.Map): The map to take the sprites from.
+
+    Returns:
+        dict: A snapshot (see module doc string).
+    """
+    copies = msgpack.unpackb(msgpack.packb(map['sprites'], use_bin_type=True), raw=False)
+    keys = spriteKeys(map)
+    return {
+        'stepNum': stepNum,
+        'keys': keys,
+        'sprites': dict(zip(keys, copies))
+        }
+
+
+def encodeSprites(snapshot, base=False):
+    """Return the sprites of snapshot encoded as a delta against base.
+
+    Args:
+        snapshot (dict): The snapshot to encode.
+        base (dict): A snapshot the receiver already has. If False then
+            every sprite is sent in full.
+
+    Returns:
+        list: Encoded sprites (see module doc string).
+    """
+    entries = []
+    for key in snapshot['keys']:
+        entries.append(encodeSprite(key, snapshot['sprites'][key], base['sprites'].get(key) if base else None))
+    return entries
+
+
+def encodeSprite(key, sprite, baseSprite=None):
+    """Return one encoded sprite entry (see module doc string).
+
+    Args:
+        key (int): The sprite's key.
+        sprite (dict): The sprite from the snapshot being encoded.
+        baseSprite (dict): The sprite with the same key from the base
+            snapshot or None if the base does not have it.
+    """
+    if baseSprite is None:
+        return [key, sprite, []]
+    if sprite == baseSprite:
+        return key
+    changed = {}
+    for fld, value in sprite.items():
+        if fld not in baseSprite or baseSprite[fld] != value:
+            changed[fld] = value
+    removed = [fld for fld in baseSprite if fld not in sprite]
+    return [key, changed, removed]
+
+
+def decodeSprites(stepNum, entries, base=False):
+    """Rebuild a snapshot from encoded sprites.
+
+    Args:
+        stepNum (int): Number that identifies the new snapshot.
+        entries (list): Encoded sprites from encodeSprites().
+        base (dict): The snapshot entries were encoded against or False
+            if entries were encoded without a base.
+
+    Returns:
+        dict: A snapshot (see module doc string). Sprites that did not
+            change are shared (not copied) with base.
+    """
+    snapshot = {'stepNum': stepNum, 'keys': [], 'sprites': {}}
+    for entry in entries:
+        if isinstance(entry, list):
+            key, fields, removed = entry
+            if base and key in base['sprites']:
+                sprite = base['sprites'][key].copy()
+                sprite.update(fields)
+                for fld in removed:
+                    if fld in sprite:
+                        del sprite[fld]
+            else:
+                sprite = fields
+        else:
+            key = entry
+            sprite = base['sprites'][key]
+        snapshot['keys'].append(key)
+        snapshot['sprites'][key] = sprite
+    return snapshot
+
+
+def getSprites(snapshot):
+    """Return the sprites of snapshot as a list in sprite layer order."""
+    return [snapshot['sprites'][key] for key in snapshot['keys']]
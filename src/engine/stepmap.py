@@ -2,6 +2,7 @@
 from engine.log import log
 import engine.map
 import engine.geometry as geo
+import math
 import engine.time as time
 import engine.server
 
@@ -45,8 +46,14 @@ class StepMap(engine.map.Map):
     the various servermap sub-classes of the enginetest and demo games.
 
     The Server normally only calls the engine.stepmap.StepMap.StepMap()
-    method if at least one player is on the map. So game logic stops for
-    maps with no players.
+    method every step if at least one player is on the map. Maps near
+    players are stepped less often, covering the same game time in
+    sub-steps, and other maps are not stepped at all, so game logic stops
+    for maps far from players. See
+    engine.server.Server.scheduleMaps() for details. Mechanics that
+    change things over time should use self['stepDt'], the secs of game
+    time the current step covers, rather than assuming each step is 1/fps
+    secs. It is never more than 1/fps secs (see stepMap()).
 
     Also, the Server class normally calls stepServerStart() before the
     maps process thier steps and calls stepServerEnd() after
@@ -66,6 +73,7 @@ class StepMap(engine.map.Map):
 
         self['stepsProcessed'] = 0
         self['stepProcessingTime'] = 0
+        self['stepDt'] = 0  # secs of game time the current (sub-)step covers. Set by stepMap().
 
         self['stepMethodTypes'] = (
             "stepMapStart",
@@ -210,33 +218,54 @@ class StepMap(engine.map.Map):
     # STEP DISPATCHER (Order of steps matters!)
     ########################################################
 
-    def stepMap(self):
-        """Move the map forward one step in time"""
+    def stepMap(self, dt=None):
+        """Move the map forward one step in time
 
-        startTime = time.perf_counter()
+        A dt longer than one server step (e.g. a map near players that is
+        stepped less often, see engine.server.Server.scheduleMaps()) is split
+        into equal sub-steps that are each no longer than one server step.
+        Every sub-step runs all the step methods so sprites do not move
+        farther in one go than they would on a map with players on it,
+        and so can not pass through walls or triggers.
 
-        # call all self.stepMapStart*() methods
-        for methodName in self['stepMethods']['stepMapStart']:
-            method = getattr(self, methodName, None)
-            method()
+        Args:
+            dt (float): Secs of game time since the map was last stepped.
+                Each sub-step's share is stored in self['stepDt'] for the
+                step methods to use. Defaults to one server step (1/fps secs).
+        """
 
-        # for each sprite, find all triggers sprite is inside and call
-        # corresponding trigger* method.
-        for sprite in self['sprites']:
-            self.stepTriggers(sprite)
+        startTime = time.perf_counter()
 
-        # call all selfstepMove*(sprite) methods for each sprite
-        # with a corresponding sprite['move']['type']
-        for methodName in self['stepMethods']['stepMove']:
-            method = getattr(self, methodName, None)
+        fps = engine.server.SERVER['fps']
+        if dt is None:
+            dt = 1.0 / fps
+        # small tolerance so float error in dt does not add a sub-step.
+        subSteps = max(1, math.ceil(dt * fps - 0.0001))
+        self['stepDt'] = dt / subSteps
+
+        for i in range(subSteps):
+            # call all self.stepMapStart*() methods
+            for methodName in self['stepMethods']['stepMapStart']:
+                method = getattr(self, methodName, None)
+                method()
+
+            # for each sprite, find all triggers sprite is inside and call
+            # corresponding trigger* method.
             for sprite in self['sprites']:
-                if 'move' in sprite and sprite['move']['type'] == methodName[8:]:
-                    method(sprite)
+                self.stepTriggers(sprite)
+
+            # call all selfstepMove*(sprite) methods for each sprite
+            # with a corresponding sprite['move']['type']
+            for methodName in self['stepMethods']['stepMove']:
+                method = getattr(self, methodName, None)
+                for sprite in self['sprites']:
+                    if 'move' in sprite and sprite['move']['type'] == methodName[8:]:
+                        method(sprite)
 
-        # call all self.stepMapEnd*() methods
-        for methodName in self['stepMethods']['stepMapEnd']:
-            method = getattr(self, methodName, None)
-            method()
+            # call all self.stepMapEnd*() methods
+            for methodName in self['stepMethods']['stepMapEnd']:
+                method = getattr(self, methodName, None)
+                method()
 
         self['stepsProcessed'] += 1
         self['stepProcessingTime'] += (time.perf_counter()-startTime)
@@ -263,9 +292,9 @@ class StepMap(engine.map.Map):
         # The next line was removed and replaced with the lines below to increase performance.
         #triggers = self.findObject(collidesWith=sprite,objectList=self['triggers'],returnAll=True,exclude=sprite)
         triggers = []
-        for t in self['triggers']:
+        for t in self.findObjectsNear(sprite, self['triggers']):
             # using collidesFast() assumes t objects have collision types of rect or circle. Others will return False
-            if t != sprite and geo.collidesFast(sprite,sprite['collisionType'], t, t['collisionType']):
+            if t is not sprite and geo.collidesFast(sprite,sprite['collisionType'], t, t['collisionType']):
                 triggers.append(t)
 
         # remove any triggers that do not have trigger* methods to call.
@@ -9,7 +9,11 @@ server.
 
 import time
 
+from engine.log import log
+
 DELTA = 0
+SPIN_SEC = 0.002  # sleep(until=...) busy waits for only the last SPIN_SEC. Before that it lets the OS sleep.
+MAX_CATCHUP = 5  # most late ticks nextTick() will schedule back to back before giving up on catching up.
 
 
 def set(serverTime):
@@ -38,8 +42,10 @@ def sleep(sec=False, until=False):
     """Function does not return until a specified time has passed.
 
     one of 'sec' or 'until' must be provided. 'sec' will
-    use the OS sleep function while 'until' will busy 
-    wait for greater accuracy.
+    use the OS sleep function while 'until' will use the OS
+    sleep function until SPIN_SEC before 'until' and then busy
+    wait for greater accuracy. OS sleeps can wake up late, but
+    not by more than SPIN_SEC on most systems.
 
     Args:
         sec (float): seconds to sleep.
@@ -50,5 +56,100 @@ def sleep(sec=False, until=False):
 
     if until:
         global DELTA
+        osSleep = until - (time.perf_counter() + DELTA) - SPIN_SEC
+        if osSleep > 0:
+            time.sleep(osSleep)
         while time.perf_counter() + DELTA < until:
             pass
+
+
+def nextTick(tickAt, tickSec):
+    """Return the time the tick after the one scheduled for tickAt should start.
+
+    Ticks are scheduled every tickSec from tickAt, not from when the last
+    tick finished, so the time it takes to run a tick does not make the
+    schedule drift. If a tick runs late then the following ticks start
+    straight away until the schedule is caught up, unless the schedule is
+    more than MAX_CATCHUP ticks behind. Then it starts over from now.
+
+    Args:
+        tickAt (float): time the last tick was scheduled to start.
+        tickSec (float): seconds between ticks.
+
+    Returns:
+        float: time the next tick should start.
+    """
+    tickAt += tickSec
+    now = perf_counter()
+    if now - tickAt > tickSec * MAX_CATCHUP:
+        tickAt = now
+    return tickAt
+
+
+class StepPacer(dict):
+    """StepPacer Class
+
+    Keeps a main loop (e.g. engine.server.Server.run()) running once every
+    1/fps seconds and logs how busy the loop is. The pacer only decides when
+    to wait, the loop does the waiting, so the same pacer works for a loop
+    that sleeps and one that awaits asyncio:
+
+        pacer = StepPacer(fps, busySec, "Server")
+        while True:
+            runStep()
+            waitUntil = pacer.getWaitUntil()
+            if waitUntil:
+                sleep(until=waitUntil)
+            pacer.scheduleNextStep()
+    """
+
+    def __init__(self, fps, busySec, name):
+        """Start pacing from now.
+
+        Args:
+            fps (float): Steps per second.
+            busySec (float): Seconds between busy status log msgs.
+            name (str): Name used in log msgs, e.g. "Server".
+        """
+        self['fps'] = fps
+        self['busySec'] = busySec
+        self['name'] = name
+        self['startAt'] = perf_counter()
+        self['nextStatusAt'] = self['startAt'] + busySec
+        self['sleepTime'] = 0  # time spent waiting since startAt.
+        self['nextStepAt'] = self['startAt'] + (1.0 / fps)
+        self['idleAt'] = False  # time startIdle() was called.
+
+    def getWaitUntil(self):
+        """Call after a step. Return the time the next step should start or False if it should start now.
+
+        Also logs the busy status every busySec seconds.
+        """
+        ptime = perf_counter()
+        if ptime < self['nextStepAt']:
+            self['sleepTime'] += self['nextStepAt'] - ptime
+
+            if ptime > self['nextStatusAt']:
+                # log the amount of time we are busy vs. waiting for the next step.
+                log(f"Status: busy == {int(100-(self['sleepTime']/(ptime-self['startAt'])*100))}%")
+                self['startAt'] = ptime
+                self['nextStatusAt'] = self['startAt'] + self['busySec']
+                self['sleepTime'] = 0
+            return self['nextStepAt']
+
+        log(f"{self['name']} running slower than {self['fps']} fps.", "VERBOSE")
+        return False
+
+    def scheduleNextStep(self):
+        """Call after waiting for the time from getWaitUntil() to schedule the step after."""
+        self['nextStepAt'] = nextTick(self['nextStepAt'], 1.0 / self['fps'])
+
+    def startIdle(self):
+        """Call after a step if the loop is going to wait for something other than the next step."""
+        self['idleAt'] = perf_counter()
+
+    def endIdle(self):
+        """Call when done waiting after startIdle(). The next step starts now and the one after in 1/fps."""
+        self['nextStepAt'] = perf_counter() + (1.0 / self['fps'])
+        self['sleepTime'] += self['nextStepAt'] - self['idleAt']
+        self['idleAt'] = False
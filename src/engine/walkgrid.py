@@ -0,0 +1,206 @@
+"""Walkability Grid of inBounds and outOfBounds Layers
+
+This module is used by engine.servermap.ServerMap to quickly answer the
+inBounds and outOfBounds part of engine.map.Map.checkLocation(). Those
+layers rarely change after a map is loaded so they are rasterized once
+into a grid of square cells. Each cell records:
+
+    outOfBounds state (bytearray):
+        CLEAR: No outOfBounds object touches the cell.
+        BLOCKED: The cell is fully inside a 'rect' outOfBounds object.
+        UNKNOWN: Anything else, e.g. an outOfBounds wall edge crosses the cell.
+
+    inBounds container (array): 1 + the index in the inBounds list of a
+        'rect' inBounds object that fully contains the cell, or 0 if none does.
+
+Summed area tables of the UNKNOWN and BLOCKED cells are also kept so a
+rect of cells can be checked without looking at every cell in it.
+
+Cells include their edges, the same as the collision checks in
+engine.geometry, so a grid answer is always the same as checkLocation()
+would give. When the grid can't answer (e.g. a mover is in an UNKNOWN
+cell) check() returns None and the caller must do the full check.
+"""
+
+import math
+import array
+
+import engine.spatialindex
+
+CLEAR = 0
+BLOCKED = 1
+UNKNOWN = 2
+
+
+class WalkGrid(dict):
+    """WalkGrid Class
+
+    A grid of what is in bounds on one map.
+    """
+
+    def __init__(self, inBounds, outOfBounds, pixelWidth, pixelHeight, cellSize):
+        """Rasterize inBounds and outOfBounds.
+
+        Args:
+            inBounds (list): The map's inBounds object list.
+            outOfBounds (list): The map's outOfBounds object list.
+            pixelWidth, pixelHeight (int): Size of the map.
+            cellSize (float): Width and height of each cell in pixels.
+        """
+        self['inBounds'] = inBounds
+        self['outOfBounds'] = outOfBounds
+        self['inBoundsLen'] = len(inBounds)
+        self['outOfBoundsLen'] = len(outOfBounds)
+        self['ids'] = {id(o) for o in inBounds + outOfBounds}  # used to check if an object is on these layers.
+        self['cellSize'] = cellSize
+        self['cols'] = math.ceil(pixelWidth / cellSize)
+        self['rows'] = math.ceil(pixelHeight / cellSize)
+        self['blocked'] = bytearray(self['cols'] * self['rows'])
+        self['container'] = array.array('I', bytes(4 * self['cols'] * self['rows']))
+
+        for o in outOfBounds:
+            if o['collisionType'] == 'rect':
+                self.rasterize(o, self.setBlocked)
+            elif o['collisionType'] == 'circle':
+                self.rasterize(o, self.setUnknown)
+            # other collision types never collide with anchor, rect and circle objects.
+
+        for i in range(len(inBounds)):
+            if inBounds[i]['collisionType'] == 'rect':
+                self.rasterize(inBounds[i], self.setContainer, i + 1)
+
+        self['notClearSums'] = self.sumCells(lambda state: state != CLEAR)
+        self['blockedSums'] = self.sumCells(lambda state: state == BLOCKED)
+
+    ########################################################
+    # BUILD
+    ########################################################
+
+    def rasterize(self, o, setCell, value=None):
+        """Call setCell(cellIndex, inside, value) for each cell o touches.
+
+        inside is True if the cell is fully inside o's rect.
+        """
+        if o['collisionType'] == 'rect':
+            bounds = (o['x'], o['y'], o['x'] + o['width'], o['y'] + o['height'])
+        else:
+            bounds = engine.spatialindex.getBounds(o)
+            if bounds is None:
+                return
+        size = self['cellSize']
+        cols = self['cols']
+        x1 = max(0, math.floor(bounds[0] / size))
+        y1 = max(0, math.floor(bounds[1] / size))
+        x2 = min(cols - 1, math.floor(bounds[2] / size))
+        y2 = min(self['rows'] - 1, math.floor(bounds[3] / size))
+        for cy in range(y1, y2 + 1):
+            insideY = o['y'] <= cy * size and (cy + 1) * size <= o['y'] + o['height']
+            for cx in range(x1, x2 + 1):
+                inside = insideY and o['x'] <= cx * size and (cx + 1) * size <= o['x'] + o['width']
+                setCell(cy * cols + cx, inside, value)
+
+    def setBlocked(self, i, inside, value):
+        """Cell i is touched by a 'rect' outOfBounds object."""
+        if inside:
+            self['blocked'][i] = BLOCKED
+        elif self['blocked'][i] == CLEAR:
+            self['blocked'][i] = UNKNOWN
+
+    def setUnknown(self, i, inside, value):
+        """Cell i may be touched by an outOfBounds object."""
+        if self['blocked'][i] == CLEAR:
+            self['blocked'][i] = UNKNOWN
+
+    def setContainer(self, i, inside, value):
+        """Cell i is touched by inBounds object number value."""
+        if inside and not self['container'][i]:
+            self['container'][i] = value
+
+    def sumCells(self, counts):
+        """Return a summed area table of the cells where counts(blocked state) is True.
+
+        Entry (cy * (cols + 1) + cx) is the number of counted cells above and
+        to the left of cell (cx, cy).
+        """
+        cols = self['cols']
+        width = cols + 1
+        sums = array.array('I', bytes(4 * width * (self['rows'] + 1)))
+        blocked = self['blocked']
+        for cy in range(self['rows']):
+            rowSum = 0
+            for cx in range(cols):
+                rowSum += counts(blocked[cy * cols + cx])
+                sums[(cy + 1) * width + cx + 1] = sums[cy * width + cx + 1] + rowSum
+        return sums
+
+    ########################################################
+    # CHECK
+    ########################################################
+
+    def isCurrent(self, inBounds, outOfBounds):
+        """Return True if the grid is of inBounds and outOfBounds and they have not been added to or removed from."""
+        return self['inBounds'] is inBounds and self['outOfBounds'] is outOfBounds and \
+            self['inBoundsLen'] == len(inBounds) and self['outOfBoundsLen'] == len(outOfBounds)
+
+    def check(self, collidesWith):
+        """Return if collidesWith is in bounds based on the inBounds and outOfBounds layers.
+
+        Args:
+            collidesWith (dict): The object, at the location being checked (see checkLocation()).
+
+        Returns:
+            True: collidesWith does not collide with any outOfBounds object and
+                is fully inside an inBounds object (or there are no inBounds objects).
+            False: collidesWith collides with an outOfBounds object.
+            None: The grid can't tell.
+        """
+        collisionType = collidesWith['collisionType']
+        size = self['cellSize']
+        cols = self['cols']
+
+        if collisionType == 'anchor':
+            # checkLocation() skips bounds objects that don't overlap the object's rect so
+            # only answer if the anchor is inside the rect, as it almost always is.
+            if not (collidesWith['x'] <= collidesWith['anchorX'] <= collidesWith['x'] + collidesWith['width'] and
+                    collidesWith['y'] <= collidesWith['anchorY'] <= collidesWith['y'] + collidesWith['height']):
+                return None
+            cx = math.floor(collidesWith['anchorX'] / size)
+            cy = math.floor(collidesWith['anchorY'] / size)
+            if cx < 0 or cy < 0 or cx >= cols or cy >= self['rows']:
+                return None
+            i = cy * cols + cx
+            blocked = self['blocked'][i]
+            if blocked == BLOCKED:
+                return False
+            if blocked == CLEAR and (self['inBoundsLen'] == 0 or self['container'][i]):
+                return True
+            return None
+
+        if collisionType not in ('rect', 'circle'):
+            return None
+
+        # circles are checked using their rect so they can't be found to be out of bounds.
+        x1 = math.floor(collidesWith['x'] / size)
+        y1 = math.floor(collidesWith['y'] / size)
+        x2 = math.floor((collidesWith['x'] + collidesWith['width']) / size) + 1
+        y2 = math.floor((collidesWith['y'] + collidesWith['height']) / size) + 1
+        if x1 < 0 or y1 < 0 or x2 > cols or y2 > self['rows']:
+            return None
+
+        # count the cells in the rect from (x1, y1) up to, but not including, (x2, y2).
+        width = cols + 1
+        sums = self['notClearSums']
+        if sums[y2 * width + x2] - sums[y1 * width + x2] - sums[y2 * width + x1] + sums[y1 * width + x1]:
+            if collisionType == 'rect':
+                sums = self['blockedSums']
+                if sums[y2 * width + x2] - sums[y1 * width + x2] - sums[y2 * width + x1] + sums[y1 * width + x1]:
+                    return False
+            return None
+
+        if self['inBoundsLen'] == 0:
+            return True
+        # containers are rects so if one contains both corner cells it contains every cell between them.
+        container = self['container'][y1 * cols + x1]
+        if container and container == self['container'][(y2 - 1) * cols + x2 - 1]:
+            return True
+        return None
@@ -38,7 +38,7 @@ class ServerMap(engine.servermap.ServerMap):
         #find trigger for the holdable that was just dropped and add timer.
         followers = self.getFollowers(holdable)
         for follower in followers:
-            if 'holdableSprite' in follower and follower['holdableSprite'] == holdable:
+            if 'holdableSprite' in follower and follower['holdableSprite'] is holdable:
                 follower['delAfter'] = time.perf_counter() + 5
         
     def stepMapStartDelHoldableAfter(self):
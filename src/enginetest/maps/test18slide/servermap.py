@@ -3,7 +3,6 @@
 from engine.log import log
 import engine.servermap
 import engine.geometry as geo
-import engine.server
 
 
 class ServerMap(engine.servermap.ServerMap):
@@ -42,7 +41,7 @@ class ServerMap(engine.servermap.ServerMap):
             sprite['anchorX'],
             sprite['anchorY'],
             trigger["prop-slideDirection"],
-            trigger["prop-slideSpeed"] / engine.server.SERVER['fps'] * 1.001
+            trigger["prop-slideSpeed"] * self['stepDt'] * 1.001
             )
         self.setMoveLinear(sprite, moveDestX, moveDestY, trigger["prop-slideSpeed"])
 
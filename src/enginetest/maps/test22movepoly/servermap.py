@@ -64,8 +64,8 @@ class ServerMap(engine.servermap.ServerMap):
             bounce = sprite['move']['b']
 
             moveSpeed = sprite['move']['s']
-            # convert pixels per second to pixels per step
-            stepSpeed = moveSpeed / engine.server.SERVER['fps']
+            # convert pixels per second to pixels this step
+            stepSpeed = moveSpeed * self['stepDt']
 
             position = sprite['move']['df'] * polyObject['totalDistance']
             newposition = position + stepSpeed
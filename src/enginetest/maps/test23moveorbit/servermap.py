@@ -51,8 +51,8 @@ class ServerMap(engine.servermap.ServerMap):
             radius = sprite['move']['r']
 
             moveSpeed = sprite['move']['s']
-            # convert pixels per second to pixels per step
-            stepSpeed = moveSpeed / engine.server.SERVER['fps']
+            # convert pixels per second to pixels this step
+            stepSpeed = moveSpeed * self['stepDt']
             circumference = 2 * math.pi * radius
             newAngle = geo.normalizeAngle(currentAngle + (stepSpeed/circumference) * (2 * math.pi))
             newAnchorX, newAnchorY = geo.project(
@@ -17,4 +17,5 @@ class ServerMap(engine.servermap.ServerMap):
             if sprite['type'] == "monster":
                 if "move" not in sprite:
                     player = self.findObject(type="player")
-                    self.setMoveLinear(sprite, player['anchorX'], player['anchorY'], 10)
\ No newline at end of file
+                    if player:  # map is still stepped for a while after the player leaves.
+                        self.setMoveLinear(sprite, player['anchorX'], player['anchorY'], 10)
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""makezdict module.
+
+Parses command line arguments, loads a game's maps, and writes
+<game>/step.zdict, a preset compression dictionary trained from
+the step msgs the server would send for each map.
+
+The samples are built from the maps as they are loaded, before any step
+has run. Sprites that the game only adds or changes while it runs (e.g.
+speech text, labels, or sprites created by map code) are not included,
+so the dictionary may compress real step msgs less well than it does the
+samples.
+
+The server uses the dictionary when started with -codec zdict.
+Clients use it automatically if their copy of the game has the
+same step.zdict. Run this again whenever the game's maps change.
+"""
+
+import argparse
+
+from engine.log import log
+from engine.log import setLogLevel
+
+# only import msgpack here to make sure it is installed.
+try:
+    import msgpack
+except BaseException:
+    log("Python package missing. Install with something similar to:\n py -3 -m pip install msgpack", "FAILURE")
+    exit()
+
+import engine.loaders
+import engine.codec
+
+
+def makeZdict():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-game', metavar='dir', dest='game', type=str,
+                        default='demo', help='Directory to load game from')
+    parser.add_argument('-size', metavar='bytes', dest='size', type=int,
+                        default=32768, help='Maximum size of dictionary')
+
+    parser.add_argument('-verbose', dest='verbose', action='store_true',
+                        default=False, help='Print VERBOSE level log messages')
+    parser.add_argument('-debug', dest='debug', action='store_true',
+                        default=False, help='Print DEBUG level log messages (includes -verbose)')
+    args = parser.parse_args()
+
+    setLogLevel(args.debug, args.verbose)
+
+    tilesets = engine.loaders.loadTilesets(game=args.game, loadImages=False)
+    maps = engine.loaders.loadMaps(tilesets=tilesets, game=args.game, maptype="ServerMap")
+
+    # build a step msg for each map, the same as engine.server.Server.getStepMsg() would.
+    samples = []
+    for mapName, map in maps.items():
+        samples.append({
+            'type': 'step',
+            'gameSec': 0.0,
+            'mapName': mapName,
+            'layerVisabilityMask': map.getLayerVisablityMask(),
+            'sprites': map['sprites']
+            })
+
+    zdict = engine.codec.trainZdict(samples, args.size)
+
+    before = 0
+    after = 0
+    codec = engine.codec.Codec('zdict', zdict=zdict)
+    for sample in samples:
+        b = msgpack.packb(sample, use_bin_type=True)
+        before += len(engine.codec.Codec('zlib', threshold=0).encode(b))
+        after += len(codec.encode(b))
+
+    zdictFile = f"src/{args.game}/step.zdict"
+    with open(zdictFile, "wb") as f:
+        f.write(zdict)
+    log(f"Wrote {len(zdict)} byte dictionary to {zdictFile}. Step msgs for {len(samples)} maps compress to "
+        f"{after} bytes with dictionary and {before} bytes without.")
+
+
+if __name__ == "__main__":
+    makeZdict()
@@ -5,6 +5,7 @@ creates Client instance, and call run() on Client.
 """
 
 import argparse
+import asyncio
 import os
 import engine.time as time
 
@@ -58,6 +59,22 @@ def startClient():
     parser.add_argument('-pause', metavar='secs', dest='pause', type=int,
                         default=0, help='Duration to pause in seconds before starting client (for testing)')
 
+    parser.add_argument('-emuloss', metavar='pct', dest='emuLoss', type=float,
+                        default=0, help='Emulate network: percent of sent datagrams to drop')
+    parser.add_argument('-emulatency', metavar='ms', dest='emuLatency', type=float,
+                        default=0, help='Emulate network: delay sent datagrams by ms')
+    parser.add_argument('-emujitter', metavar='ms', dest='emuJitter', type=float,
+                        default=0, help='Emulate network: add random delay of up to ms')
+    parser.add_argument('-emudup', metavar='pct', dest='emuDuplicate', type=float,
+                        default=0, help='Emulate network: percent of sent datagrams to duplicate')
+    parser.add_argument('-emureorder', metavar='pct', dest='emuReorder', type=float,
+                        default=0, help='Emulate network: percent of sent datagrams to reorder')
+    parser.add_argument('-emurate', metavar='kbps', dest='emuRate', type=float,
+                        default=0, help='Emulate network: limit sending to kbit/s (0 is no limit)')
+    parser.add_argument('-emuseed', metavar='seed', dest='emuSeed', type=int,
+                        default=0, help='Emulate network: random seed so runs can be repeated')
+    parser.add_argument('-asyncio', dest='asyncio', action='store_true',
+                        default=False, help='Run main loop with asyncio instead of busy waiting')
     parser.add_argument('-profile', dest='profile', action='store_true',
                         default=False, help='Print function performance profile on exit.')
     parser.add_argument('-verbose', dest='verbose', action='store_true',
@@ -74,7 +91,10 @@ def startClient():
         time.sleep(sec=args.pause)
 
     module = engine.loaders.loadModule("client", game=args.game)
-    module.Client(args).run()
+    if args.asyncio:
+        asyncio.run(module.Client(args).runAsync())
+    else:
+        module.Client(args).run()
 
 
 if __name__ == '__main__':
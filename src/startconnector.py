@@ -5,6 +5,7 @@ instance, and call run() on Connector.
 """
 
 import argparse
+import asyncio
 import os
 import engine.time as time
 
@@ -31,6 +32,8 @@ def startConnector():
     parser.add_argument('-cp', metavar='port', dest='connectorPort', type=int,
                         default=20000, help='Connector port number')
 
+    parser.add_argument('-asyncio', dest='asyncio', action='store_true',
+                        default=False, help='Run main loop with asyncio instead of busy waiting')
     parser.add_argument('-verbose', dest='verbose', action='store_true',
                         default=False, help='Print VERBOSE level log messages')
     parser.add_argument('-debug', dest='debug', action='store_true',
@@ -39,7 +42,10 @@ def startConnector():
 
     setLogLevel(args.debug, args.verbose)
 
-    engine.connector.Connector(args.connectorIP, args.connectorPort).run()
+    if args.asyncio:
+        asyncio.run(engine.connector.Connector(args.connectorIP, args.connectorPort).runAsync())
+    else:
+        engine.connector.Connector(args.connectorIP, args.connectorPort).run()
 
 
 if __name__ == "__main__":
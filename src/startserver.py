@@ -5,7 +5,11 @@ creates Server instance, and call run() on Server.
 """
 
 import argparse
+import asyncio
+import multiprocessing
 import os
+import signal
+import socket
 import engine.time as time
 
 from engine.log import log
@@ -20,6 +24,7 @@ except BaseException:
 
 import engine.network
 import engine.loaders
+import engine.codec
 
 
 def startServer():
@@ -41,10 +46,49 @@ def startServer():
 
     parser.add_argument('-fps', metavar='fps', dest='fps', type=int,
                         default=30, help='Target frames per second (aka steps/sec)')
+    parser.add_argument('-sendfps', metavar='fps', dest='sendFps', type=int,
+                        default=0, help='Max step msgs sent to each player per second (0 is the same as -fps)')
     parser.add_argument('-busy', metavar='secs', dest='busySec', type=int,
                         default=60, help='Seconds between logging percent busy')
     parser.add_argument('-pause', metavar='secs', dest='pause', type=int,
                         default=0, help='Duration to pause in seconds before starting server (for testing)')
+    parser.add_argument('-codec', dest='codec', type=str, choices=engine.codec.CODECS,
+                        default='zlib', help='Best codec to use for msgs sent to players (zdict needs <game>/step.zdict)')
+    parser.add_argument('-zlevel', metavar='level', dest='zlibLevel', type=int,
+                        default=6, help='zlib compression level (1-9)')
+    parser.add_argument('-zmin', metavar='bytes', dest='zlibMin', type=int,
+                        default=128, help='Msgs smaller than this are not compressed')
+    parser.add_argument('-compact', dest='compactSprites', action='store_true',
+                        default=False, help='Send step sprites in compact form')
+    parser.add_argument('-delta', dest='stepDelta', action='store_true',
+                        default=False, help='Send step msgs as deltas against the last step each client acknowledged')
+    parser.add_argument('-budget', metavar='bytes', dest='stepBudget', type=int,
+                        default=0, help='Max bytes of sprite changes sent to each player per step, highest priority '
+                        'sprites first. 1200 keeps step msgs in one datagram. (0 is no limit, otherwise implies -delta)')
+    parser.add_argument('-emuloss', metavar='pct', dest='emuLoss', type=float,
+                        default=0, help='Emulate network: percent of sent datagrams to drop')
+    parser.add_argument('-emulatency', metavar='ms', dest='emuLatency', type=float,
+                        default=0, help='Emulate network: delay sent datagrams by ms')
+    parser.add_argument('-emujitter', metavar='ms', dest='emuJitter', type=float,
+                        default=0, help='Emulate network: add random delay of up to ms')
+    parser.add_argument('-emudup', metavar='pct', dest='emuDuplicate', type=float,
+                        default=0, help='Emulate network: percent of sent datagrams to duplicate')
+    parser.add_argument('-emureorder', metavar='pct', dest='emuReorder', type=float,
+                        default=0, help='Emulate network: percent of sent datagrams to reorder')
+    parser.add_argument('-emurate', metavar='kbps', dest='emuRate', type=float,
+                        default=0, help='Emulate network: limit sending to kbit/s (0 is no limit)')
+    parser.add_argument('-emuseed', metavar='seed', dest='emuSeed', type=int,
+                        default=0, help='Emulate network: random seed so runs can be repeated')
+    parser.add_argument('-workers', metavar='num', dest='workers', type=int,
+                        default=1, help='Number of server processes sharing the server port, each running a separate '
+                        'game. The OS assigns each client to one of them. (Linux only)')
+    parser.add_argument('-mapworkers', metavar='num', dest='mapWorkers', type=int,
+                        default=0, help='Experimental: Step maps in parallel in num worker processes (0 steps maps in '
+                        'the server process)')
+    parser.add_argument('-asyncio', dest='asyncio', action='store_true',
+                        default=False, help='Run main loop with asyncio instead of busy waiting')
+    parser.add_argument('-aoi', dest='areaOfInterest', action='store_true',
+                        default=False, help='Only send sprites that are near the part of the map each player can see')
     parser.add_argument('-test', dest='testMode', action='store_true',
                         default=False, help='Start server in test mode')
 
@@ -63,8 +107,38 @@ def startServer():
         log(f"Pausing for {args.pause} seconds before starting server.")
         time.sleep(sec=args.pause)
 
+    if args.workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            log("-workers is not supported on this operating system.", "FAILURE")
+            exit()
+        if args.registerName:
+            log("-workers can't be used with -register since each worker is a separate game.", "FAILURE")
+            exit()
+
+        workers = []
+        for i in range(args.workers):
+            worker = multiprocessing.Process(target=runServer, args=(args, i), name=f"worker{i}")
+            worker.start()
+            workers.append(worker)
+        # workers handle Ctrl-C themselves so just wait for them to quit.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for worker in workers:
+            worker.join()
+    else:
+        runServer(args)
+
+
+def runServer(args, worker=0):
+    """Create a Server and run it until it quits."""
+    setLogLevel(args.debug, args.verbose)
+    if args.workers > 1:
+        log(f"Starting server worker {worker} (pid {os.getpid()}).")
+
     module = engine.loaders.loadModule("server", game=args.game)
-    module.Server(args).run()
+    if args.asyncio:
+        asyncio.run(module.Server(args).runAsync())
+    else:
+        module.Server(args).run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,12 @@
+"""Shared setup for the tests.
+
+The engine expects to be run from the top folder of the repo with src on
+the python path (see startserver.py), so the tests do the same.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
@@ -0,0 +1,64 @@
+"""Tests for the object registry of engine.map.Map"""
+
+import engine.loaders
+
+
+def loadMaps():
+    tilesets = engine.loaders.loadTilesets(game='enginetest', loadImages=False)
+    return engine.loaders.loadMaps(tilesets=tilesets, game='enginetest', maptype="ServerMap")
+
+
+def test_objectIdsUniqueAcrossMaps():
+    seen = set()
+    for map in loadMaps().values():
+        objectIds = set()  # an object may be in more than one list of a map.
+        for objectList in map['objectLists'].values():
+            objectIds.update(map.getObjectIds(objectList))
+        assert False not in objectIds
+        assert not objectIds & seen
+        seen |= objectIds
+
+
+def test_objectIdsAfterMove():
+    maps = loadMaps()
+    fromMap = maps['test19push']
+    toMap = maps['test26manysprites']
+    sprite = fromMap['sprites'][0]
+    objectId = fromMap.getObjectId(sprite)
+    fromMap.setObjectMap(sprite, toMap)
+    assert fromMap.getObjectId(sprite) is False
+    assert toMap.getObjectId(sprite) not in (False, objectId)
+    assert fromMap.getObjectById(objectId) is False
+
+
+def test_directListChanges():
+    """Changes made to an object list without addObject() or removeObject() are seen by the registry."""
+    map = loadMaps()['test19push']
+    sprites = map['sprites']
+    first, second, third = sprites[0], sprites[1], sprites[2]
+    ids = map.getObjectIds()
+
+    new = dict(first)  # equal to first but not the same object.
+    sprites[0] = new
+    assert map.getObjectLayers(first) == []
+    assert not map.isObjectInList(first)
+    assert map.getObjectLayers(new) == ['sprites']
+    assert map.getObjectId(new) not in ids
+
+    sprites[1], sprites[2] = third, second
+    assert map.getObjectIds()[1:3] == [ids[2], ids[1]]
+
+    del sprites[1:]
+    assert not map.isObjectInList(second)
+    assert map.getObjectById(ids[1]) is False
+
+
+def test_removeObjectByIdentity():
+    map = loadMaps()['test19push']
+    sprites = map['sprites']
+    copy = dict(sprites[0])
+    map.addObject(copy)
+    map.removeObject(copy)
+    assert map.isObjectInList(sprites[0])
+    assert not map.isObjectInList(copy)
+    assert sprites[0] is not copy and len([s for s in sprites if s == copy]) == 1
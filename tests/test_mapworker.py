@@ -0,0 +1,48 @@
+"""Tests for engine.mapworker"""
+
+import pytest
+
+import engine.loaders
+import engine.mapworker
+import engine.server
+
+
+def makeServer(game):
+    """Return a Server for game with its tilesets and maps loaded but no socket."""
+    serverClass = engine.loaders.loadModule("server", game=game).Server
+    server = serverClass.__new__(serverClass)
+    server['game'] = game
+    server['fps'] = 30
+    server['tilesets'] = engine.loaders.loadTilesets(game=game, loadImages=False)
+    server['maps'] = engine.loaders.loadMaps(tilesets=server['tilesets'], game=game, maptype="ServerMap")
+    server['players'] = {}
+    server['playersByNum'] = {}
+    return server
+
+
+def test_spawnStartMethod():
+    """Workers started with "spawn", as on Windows, can load and step the maps and are stopped."""
+    server = makeServer('enginetest')
+    monster = next(s for s in server['maps']['test22movepoly']['sprites'] if s['name'] == 'monster1')
+    start = (monster['x'], monster['y'])
+
+    pool = engine.mapworker.MapWorkerPool(server, 2, startMethod='spawn')
+    try:
+        for i in range(5):
+            pool.stepMaps(sorted(server['maps']))
+    finally:
+        pool.stop()
+
+    assert (monster['x'], monster['y']) != start
+    assert not any(process.is_alive() for process in pool['processes'])
+    pool.stop()  # stopping again does nothing.
+
+
+def test_workerServerMissingKey():
+    """The stand in Server names Server data that map workers do not have."""
+    server = engine.mapworker.WorkerServer.create(engine.server.Server, {'fps': 30}, {}, {})
+    assert isinstance(server, engine.server.Server)
+    assert server['fps'] == 30
+    assert server.get('socket') is None
+    with pytest.raises(KeyError, match="socket"):
+        server['socket']
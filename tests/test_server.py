@@ -0,0 +1,209 @@
+"""Tests for the step msgs engine.server.Server sends to players."""
+
+import msgpack
+
+import engine.loaders
+import engine.messages
+import engine.network
+import engine.server
+import engine.stepdelta as stepdelta
+
+
+def makeServer(**fields):
+    """Return a Server with the enginetest maps loaded and fields set, without running Server.__init__()."""
+    server = engine.server.Server.__new__(engine.server.Server)
+    server['socket'] = engine.network.Socket(engine.messages.Messages(), server, '127.0.0.1', 0)
+    server['tilesets'] = engine.loaders.loadTilesets(game='enginetest', loadImages=False)
+    server['maps'] = engine.loaders.loadMaps(tilesets=server['tilesets'], game='enginetest', maptype="ServerMap")
+    server.update({
+        'fps': 30,
+        'sendFps': 30,
+        'stepDelta': True,
+        'stepBudget': 0,
+        'areaOfInterest': False,
+        'gameStartSec': 0,
+        'players': {},
+        'playersByNum': {},
+        'stepNum': 0,
+        'stepSnapshots': {},
+        'latestStepSnapshot': {},
+        'stepEncodeCache': {},
+        'STEP_SNAPSHOTS': 32,
+        'BUDGET_DISTANCE': 320,
+        'BUDGET_TYPE_PRIORITY': {'player': 4},
+        'AOI_MARGIN': 32,
+        'AOI_HYSTERESIS': 32
+        })
+    server.update(fields)
+    server['playerStepViews'] = server['stepDelta'] and (server['stepBudget'] or server['areaOfInterest'])
+    return server
+
+
+def addPlayer(server, sprite, mapName, **msg):
+    """Add a player with sprite to server and return it. msg is added to the player's joinRequest."""
+    server['unassignedPlayerSprites'] = [(sprite, mapName)]
+    server.addPlayer('127.0.0.1', 20002, '127.0.0.1:20002', dict(msg, playerDisplayName='test'))
+    return server['players']['127.0.0.1:20002']
+
+
+class Client:
+    """Keeps the sprites a player has received, the same way engine.client.Client does."""
+
+    def __init__(self):
+        self.snapshots = {}
+        self.latest = False
+
+    def recvStep(self, server, msg):
+        msg = msgpack.unpackb(msgpack.packb(msg, use_bin_type=True), raw=False)
+        base = self.snapshots[msg['baseStepNum']] if 'baseStepNum' in msg else False
+        self.latest = stepdelta.decodeSprites(msg['stepNum'], msg['sprites'], base)
+        self.snapshots[msg['stepNum']] = self.latest
+        server.msgStepAck('127.0.0.1', 20002, '127.0.0.1:20002', {'type': 'stepAck', 'stepNum': msg['stepNum']})
+
+
+def step(server, player, client):
+    """Send the player a step msg for their map, as it is now."""
+    server.addStepSnapshot(server['maps'][player['sprite']['mapName']])
+    client.recvStep(server, server.getStepMsg(player))
+
+
+def getSent(sprites):
+    """Return sprites as the client receives them."""
+    return msgpack.unpackb(msgpack.packb(sprites, use_bin_type=True), raw=False)
+
+
+def test_budgetConverges():
+    """With a small budget the player falls behind while sprites move but catches up once they stop."""
+    server = makeServer(stepBudget=300)
+    map = server['maps']['test26manysprites']
+    player = addPlayer(server, map['sprites'][0], map['name'])
+    client = Client()
+
+    for i in range(10):
+        for sprite in map['sprites']:
+            sprite['x'] += 1
+        step(server, player, client)
+        assert player['stepBudgetPending']
+        assert stepdelta.getSprites(client.latest) != getSent(map['sprites'])
+
+    for i in range(len(map['sprites'])):
+        step(server, player, client)
+        if not player['stepBudgetPending']:
+            break
+    assert not player['stepBudgetPending']
+    assert stepdelta.getSprites(client.latest) == getSent(map['sprites'])
+
+
+def getInterestSprites(player, map):
+    """Return the sprites of map the player is interested in, as the client receives them."""
+    return getSent([s for s in map['sprites'] if stepdelta.spriteKey(map, s) in player['interestKeys']])
+
+
+def moveAcross(map, playerSprite, x):
+    """Move playerSprite to x and every other sprite a little."""
+    playerSprite['anchorX'] += x - playerSprite['x']
+    playerSprite['x'] = x
+    for sprite in map['sprites']:
+        if sprite is not playerSprite:
+            sprite['y'] += 1
+
+
+def test_interestView():
+    """The player is sent exactly the sprites near their window as they move across the map and back."""
+    server = makeServer(areaOfInterest=True)
+    map = server['maps']['test26manysprites']
+    playerSprite = map['sprites'][0]
+    player = addPlayer(server, playerSprite, map['name'], windowWidth=160, windowHeight=160)
+    client = Client()
+
+    for x in list(range(0, 640, 40)) + list(range(640, 0, -40)):
+        moveAcross(map, playerSprite, x)
+        step(server, player, client)
+        assert stepdelta.getSprites(client.latest) == getInterestSprites(player, map)
+        assert 0 < len(client.latest['keys']) < len(map['sprites'])
+
+
+def test_interestBudgetConverges():
+    """With a budget as well, the player catches up with the sprites near their window once they stop moving."""
+    server = makeServer(areaOfInterest=True, stepBudget=300)
+    map = server['maps']['test26manysprites']
+    playerSprite = map['sprites'][0]
+    player = addPlayer(server, playerSprite, map['name'], windowWidth=160, windowHeight=160)
+    client = Client()
+
+    for x in range(0, 640, 40):
+        moveAcross(map, playerSprite, x)
+        step(server, player, client)
+
+    for i in range(len(map['sprites'])):
+        step(server, player, client)
+        if not player['stepBudgetPending']:
+            break
+    assert not player['stepBudgetPending']
+    assert stepdelta.getSprites(client.latest) == getInterestSprites(player, map)
+
+
+def test_interestWindowResize():
+    """After the player resizes their window they are sent the sprites near their new window."""
+    server = makeServer(areaOfInterest=True)
+    map = server['maps']['test26manysprites']
+    playerSprite = map['sprites'][0]
+    player = addPlayer(server, playerSprite, map['name'], windowWidth=160, windowHeight=160)
+    client = Client()
+    step(server, player, client)
+    before = len(client.latest['keys'])
+
+    msg = {'type': 'windowSize', 'windowWidth': 480, 'windowHeight': 480}
+    assert engine.messages.Messages().isValidMsg(msg)
+    server.msgWindowSize('127.0.0.1', 20002, '127.0.0.1:20002', msg)
+    step(server, player, client)
+    assert stepdelta.getSprites(client.latest) == getInterestSprites(player, map)
+    assert len(client.latest['keys']) > before
+
+
+def test_budgetChangeMap():
+    """A player on a budget who changes maps is only sent sprites of the map they are on."""
+    server = makeServer(stepBudget=300)
+    fromMap = server['maps']['test26manysprites']
+    toMap = server['maps']['test19push']
+    playerSprite = fromMap['sprites'][0]
+    player = addPlayer(server, playerSprite, fromMap['name'])
+    client = Client()
+
+    for i in range(5):
+        for sprite in fromMap['sprites']:
+            sprite['x'] += 1
+        step(server, player, client)
+    assert player['stepBudgetPending']
+
+    fromMap.setObjectMap(playerSprite, toMap)
+    for i in range(len(toMap['sprites'])):
+        step(server, player, client)
+        sprites = getSent(toMap['sprites'])
+        assert all(sprite in sprites for sprite in stepdelta.getSprites(client.latest))
+        if not player['stepBudgetPending']:
+            break
+    assert stepdelta.getSprites(client.latest) == getSent(toMap['sprites'])
+
+
+def test_nearMapsWallTime(monkeypatch):
+    """Near maps are stepped by wall time, not by how many steps the server takes."""
+    server = makeServer(MAP_NEAR_FPS=5, MAP_NEAR_SEC=10, mapSchedule={})
+    server['maps'] = {'test22movepoly': server['maps']['test22movepoly']}
+    server['mapSchedule']['test22movepoly'] = {
+        'lastStep': False,
+        'nearUntil': 10,
+        'changeCount': server['maps']['test22movepoly'].changeCount
+        }
+    now = [0]
+    monkeypatch.setattr(engine.server.time, 'perf_counter', lambda: now[0])
+
+    assert server.scheduleMaps() == {'test22movepoly': 1 / 30}
+    for i in range(10):
+        assert server.scheduleMaps() == {}  # many fast steps do not make it due.
+    now[0] = 0.2
+    assert server.scheduleMaps() == {'test22movepoly': 0.2}
+    now[0] = 5
+    assert server.scheduleMaps() == {'test22movepoly': 0.4}  # a stalled server does not cause a burst.
+    now[0] = 11
+    assert server.scheduleMaps() == {}  # dormant.
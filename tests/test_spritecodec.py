@@ -0,0 +1,57 @@
+"""Tests for engine.spritecodec"""
+
+import msgpack
+
+import engine.loaders
+import engine.messages
+import engine.spritecodec
+import engine.stepdelta as stepdelta
+
+
+def makeCodec():
+    return engine.spritecodec.SpriteCodec(engine.messages.Messages()['spriteFields'])
+
+
+def makeSprites():
+    # positions are multiples of 1/POS_SCALE so they survive encoding exactly.
+    return [
+        {'name': 'alpha', 'type': 'player', 'mapName': 'start', 'x': 10.5, 'y': 20.25, 'anchorX': 11, 'anchorY': 21,
+         'gid': 7, 'labelText': 'hi', 'checkLocationOn': ['inBounds', 'outOfBounds'], 'move': {'type': 'Linear'}},
+        {'name': 'beta', 'type': 'npc', 'x': 1, 'y': 2, 'polyline': [{'x': 0, 'y': 0}, {'x': 3.5, 'y': 4.0625}],
+         'holding': {'name': 'book', 'type': 'holdable', 'x': 5, 'y': 6}},
+        {'name': 'gamma', 'x': True, 'notAField': [1, 'two'], 'speechText': 'hello'}
+        ]
+
+
+def sendAndDecode(codec, sprites, delta=False):
+    """Return sprites after they are encoded, cross the network, and are decoded."""
+    encoded, strings = codec.encodeSprites(sprites, delta)
+    encoded, strings = msgpack.unpackb(msgpack.packb([encoded, strings], use_bin_type=True), raw=False)
+    return codec.decodeSprites(encoded, strings, delta)
+
+
+def test_roundTrip():
+    codec = makeCodec()
+    sprites = makeSprites()
+    assert sendAndDecode(codec, sprites) == sprites
+
+
+def test_deltaRoundTrip():
+    codec = makeCodec()
+    tilesets = engine.loaders.loadTilesets(game='enginetest', loadImages=False)
+    map = engine.loaders.loadMaps(tilesets=tilesets, game='enginetest', maptype="ServerMap")['test09smallmap']
+    sprites = map['sprites']
+    sprites.extend(makeSprites())
+    base = stepdelta.makeSnapshot(1, map)
+    received = stepdelta.decodeSprites(1, sendAndDecode(codec, stepdelta.encodeSprites(base), delta=True))
+
+    sprites[0]['x'] += 0.5
+    del sprites[0]['labelText']
+    sprites[1]['holding'] = {'name': 'cup', 'type': 'holdable', 'x': 7, 'y': 8}
+    sprites.pop()
+    sprites.append({'name': 'delta', 'type': 'npc', 'x': 0, 'y': 0})
+    snapshot = stepdelta.makeSnapshot(2, map)
+
+    entries = stepdelta.encodeSprites(snapshot, base)
+    decoded = stepdelta.decodeSprites(2, sendAndDecode(codec, entries, delta=True), received)
+    assert stepdelta.getSprites(decoded) == sprites
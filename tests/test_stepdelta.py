@@ -0,0 +1,66 @@
+"""Tests for engine.stepdelta"""
+
+import msgpack
+
+import engine.loaders
+import engine.stepdelta as stepdelta
+
+
+def makeMap():
+    """Return an enginetest map with a few sprites on its sprite layer."""
+    tilesets = engine.loaders.loadTilesets(game='enginetest', loadImages=False)
+    map = engine.loaders.loadMaps(tilesets=tilesets, game='enginetest', maptype="ServerMap")['test09smallmap']
+    map['sprites'].extend([
+        {'name': 'alpha', 'x': 10, 'y': 20, 'gid': 1, 'labelText': 'hi'},
+        {'name': 'beta', 'x': 30.5, 'y': 40.25, 'gid': 2},
+        {'name': 'gamma', 'x': 50, 'y': 60, 'gid': 3, 'speechText': {'text': 'hello'}}
+        ])
+    return map
+
+
+def sendAndDecode(stepNum, entries, base=False):
+    """Return the snapshot the receiver rebuilds from entries after they cross the network."""
+    entries = msgpack.unpackb(msgpack.packb(entries, use_bin_type=True), raw=False)
+    return stepdelta.decodeSprites(stepNum, entries, base)
+
+
+def test_fullRoundTrip():
+    map = makeMap()
+    snapshot = stepdelta.makeSnapshot(1, map)
+    decoded = sendAndDecode(1, stepdelta.encodeSprites(snapshot))
+    assert decoded['stepNum'] == 1
+    assert stepdelta.getSprites(decoded) == map['sprites']
+
+
+def test_deltaRoundTrip():
+    map = makeMap()
+    sprites = map['sprites']
+    base = stepdelta.makeSnapshot(1, map)
+    received = sendAndDecode(1, stepdelta.encodeSprites(base))
+
+    alpha, beta, gamma = sprites
+    alpha['x'] += 1  # changed field
+    del alpha['labelText']  # removed field
+    beta['moveSpeed'] = 5  # added field
+    sprites.remove(gamma)  # removed sprite
+    sprites.insert(0, {'name': 'delta', 'x': 0, 'y': 0, 'gid': 4})  # added sprite
+    sprites.append({'name': 'epsilon', 'x': 1, 'y': 1, 'gid': 5})
+    sprites[0], sprites[1] = sprites[1], sprites[0]  # reordered
+    snapshot = stepdelta.makeSnapshot(2, map)
+
+    entries = stepdelta.encodeSprites(snapshot, base)
+    decoded = sendAndDecode(2, entries, received)
+    assert stepdelta.getSprites(decoded) == sprites
+
+    # a later step where nothing changed is sent as keys only.
+    again = stepdelta.makeSnapshot(3, map)
+    entries = stepdelta.encodeSprites(again, snapshot)
+    assert all(isinstance(entry, int) for entry in entries)
+    assert stepdelta.getSprites(sendAndDecode(3, entries, decoded)) == sprites
+
+
+def test_snapshotIsCopy():
+    map = makeMap()
+    snapshot = stepdelta.makeSnapshot(1, map)
+    map['sprites'][0]['x'] = 999
+    assert stepdelta.getSprites(snapshot)[0]['x'] == 10
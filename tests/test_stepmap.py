@@ -0,0 +1,26 @@
+"""Tests for engine.stepmap"""
+
+import engine.loaders
+import engine.server
+
+
+def loadMap(mapName):
+    """Return mapName from enginetest loaded as a ServerMap."""
+    tilesets = engine.loaders.loadTilesets(game='enginetest', loadImages=False)
+    return engine.loaders.loadMaps(tilesets=tilesets, game='enginetest', maptype="ServerMap")[mapName]
+
+
+def test_subSteps(monkeypatch):
+    """A long dt is stepped in sub-steps so sprites end up where they would with normal steps."""
+    monkeypatch.setattr(engine.server, 'SERVER', {'fps': 30}, raising=False)
+    stepped = loadMap('test22movepoly')
+    subStepped = loadMap('test22movepoly')
+
+    for i in range(10):
+        for j in range(6):
+            stepped.stepMap()
+        subStepped.stepMap(0.2)
+        assert subStepped['stepDt'] == stepped['stepDt']
+
+    assert subStepped['sprites'] == stepped['sprites']
+    assert subStepped['stepsProcessed'] == 10